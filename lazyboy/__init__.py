@@ -13,7 +13,8 @@ from lazyboy.recordset import RecordSet, KeyRecordSet
 from lazyboy.view import (View, PartitionedView, BatchLoadingView,
                           FaultTolerantView)
 from lazyboy.iterators import slice_iterator, sparse_get, sparse_multiget, \
-    key_range, key_range_iterator, pack, unpack, multigetterator
+    key_range, key_range_iterator, pack, unpack, multigetterator, \
+    list_multigetterator, range_slice_iterator
 from lazyboy.array import Array
 from . import column_crud
 from . import exceptions
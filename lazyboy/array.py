@@ -10,6 +10,8 @@ from functools import partial
 from itertools import islice
 from copy import copy
 
+from cassandra.ttypes import Column, ColumnOrSuperColumn, ColumnPath
+
 from lazyboy.base import CassandraBase
 import column_crud as crud
 from iterators import slice_iterator
@@ -71,7 +73,8 @@ class Array(CassandraBase):
     def extend(self, iterable):
         """Append multiple records to this array."""
         now = timestamp()
-        cfmap = {self.key.column_family: [Column(value, "", now)
-                                          for value in iterable]}
+        cfmap = {self.key.column_family: [
+                ColumnOrSuperColumn(column=Column(value, "", now))
+                for value in iterable]}
         self._get_cas().batch_insert(self.key.keyspace, self.key.key, cfmap,
                                      self.consistency)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Load balancing policies.
+
+A policy decides which server each Client call is sent to. The Client
+hands it the servers which aren't marked down, and tells it when each
+call starts and finishes, so it can keep whatever statistics it
+needs.
+"""
+
+from __future__ import with_statement
+import itertools as it
+import math
+import random
+import threading
+import time
+
+
+class Policy(object):
+
+    """The base balancing policy."""
+
+    def choose(self, servers):
+        """Return the server to send the next call to."""
+        raise NotImplementedError()
+
+    def started(self, server):
+        """Record the start of a call to server."""
+        pass
+
+    def finished(self, server, elapsed):
+        """Record the end of a call to server, which took elapsed seconds."""
+        pass
+
+
+class RoundRobinPolicy(Policy):
+
+    """Send calls to each server in turn."""
+
+    def __init__(self):
+        self._counter = it.count(random.randint(0, 1000))
+
+    def choose(self, servers):
+        """Return the next server."""
+        return servers[self._counter.next() % len(servers)]
+
+
+class LeastLatencyPolicy(Policy):
+
+    """Send calls to the server with the lowest expected latency.
+
+    Each server's latency is tracked as an exponentially weighted
+    moving average, which is scaled by the number of calls currently
+    in flight to it. Samples are weighted by age over a window of
+    about `decay' seconds, except that a call slower than the average
+    raises it immediately, so a server which starts struggling is
+    avoided right away. A server which isn't receiving traffic has
+    its average decay toward zero, so it's tried again.
+    """
+
+    def __init__(self, decay=5.0):
+        self.decay = decay
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _get_stats(self, server):
+        """Return the [ewma, last_sample, outstanding] list for server."""
+        try:
+            return self._stats[server]
+        except KeyError:
+            return self._stats.setdefault(server, [0.0, 0, 0])
+
+    def cost(self, server, now=None):
+        """Return the expected latency of a call to server."""
+        (ewma, last, outstanding) = self._get_stats(server)
+        now = now or time.time()
+        ewma = ewma * math.exp(-(now - last) / self.decay)
+        # The floor breaks ties between idle servers by outstanding calls.
+        return max(ewma, 1e-6) * (outstanding + 1)
+
+    def choose(self, servers):
+        """Return the server with the lowest cost."""
+        now = time.time()
+        offset = random.randint(0, len(servers) - 1)
+        return min(servers[offset:] + servers[:offset],
+                   key=lambda server: self.cost(server, now))
+
+    def started(self, server):
+        """Count an outstanding call."""
+        with self._lock:
+            self._get_stats(server)[2] += 1
+
+    def finished(self, server, elapsed):
+        """Update the moving average."""
+        now = time.time()
+        with self._lock:
+            stats = self._get_stats(server)
+            if elapsed > stats[0]:
+                stats[0] = elapsed
+            else:
+                weight = math.exp(-(now - stats[1]) / self.decay)
+                stats[0] = stats[0] * weight + elapsed * (1 - weight)
+            stats[1] = now
+            stats[2] = max(stats[2] - 1, 0)
@@ -10,6 +10,7 @@ from cassandra.ttypes import ConsistencyLevel
 
 from lazyboy.exceptions import ErrorIncompleteKey
 import lazyboy.connection as connection
+import lazyboy.nonblocking as nonblocking
 
 
 class CassandraBase(object):
@@ -20,6 +21,7 @@ class CassandraBase(object):
 
     def __init__(self):
         self._clients = {}
+        self._async_clients = {}
 
     def _get_cas(self, keyspace=None):
         """Return the cassandra client."""
@@ -31,3 +33,14 @@ class CassandraBase(object):
             self._clients[keyspace] = connection.get_pool(keyspace)
 
         return self._clients[keyspace]
+
+    def _get_async_cas(self, keyspace=None):
+        """Return the non-blocking cassandra client."""
+        if not keyspace and (not hasattr(self, 'key') or not self.key):
+            raise ErrorIncompleteKey("Instance has no key.")
+
+        keyspace = keyspace or self.key.keyspace
+        if keyspace not in self._async_clients:
+            self._async_clients[keyspace] = nonblocking.get_pool(keyspace)
+
+        return self._async_clients[keyspace]
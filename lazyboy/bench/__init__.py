@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: End-to-end benchmarks.
+
+The benchmarks drive lazyboy's real Client, over Thrift and a TSocket,
+against a LoopbackServer: a Thrift server on a loopback port, backed
+by a lazyboy.memory store, which can add artificial latency to every
+call. Each workload is run at several thread counts, and its
+throughput and latency percentiles reported.
+
+Run them with:
+
+    python -m lazyboy.bench --threads 1,8,64 --latency 1
+
+See `python -m lazyboy.bench --help' for the options.
+"""
+
+from lazyboy.bench.server import LoopbackServer, start_process
+from lazyboy.bench.workloads import WORKLOADS
+from lazyboy.bench.runner import run, main
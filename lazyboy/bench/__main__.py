@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Run the lazyboy benchmarks."""
+
+from lazyboy.bench.runner import main
+
+main()
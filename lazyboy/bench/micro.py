@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Microbenchmarks of the CPU-bound code.
+
+These time the per-column work lazyboy does on every call, with no
+network involved: Record's bookkeeping, packing and unpacking columns,
+keys, the iterator helpers and Model fields. Results are written as
+JSON, and compared against a stored baseline; any benchmark slower
+than its baseline by more than the threshold is a regression, and
+makes the run exit non-zero.
+
+Timings are also recorded relative to a fixed pure-Python reference
+loop, and those are what's compared, so a baseline taken on one
+machine is usable on another. Run them with:
+
+    python -m lazyboy.bench.micro
+    python -m lazyboy.bench.micro --save-baseline
+"""
+
+from __future__ import with_statement
+import copy
+import os
+import platform
+import sys
+import timeit
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from cassandra.ttypes import Column, ColumnOrSuperColumn
+
+import lazyboy.connection as connection
+import lazyboy.iterators as iterators
+from lazyboy.key import Key
+from lazyboy.record import Record
+from lazyboy.models import Model, KeyField, IntegerField, ListField, \
+    DictField
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Benchmarks, as (name, setup) pairs. setup returns a function which
+# runs one operation.
+BENCHMARKS = []
+
+_POOL = 'MicroBench'
+_COLUMNS = 10
+
+
+def benchmark(setup):
+    """Register a benchmark, named after its setup function."""
+    BENCHMARKS.append((setup.__name__, setup))
+    return setup
+
+
+def _cols(count=_COLUMNS):
+    """Return count Columns."""
+    return [Column("column-%02d" % n, "value %d" % n, 1270000000000000)
+            for n in range(count)]
+
+
+def _record():
+    """Return a Record with _COLUMNS loaded columns."""
+    return Record()._inject(Key(_POOL, 'Records', 'record'), _cols())
+
+
+class _BenchModel(Model):
+
+    """A Model with one of each kind of field."""
+
+    class Meta:
+        keyspace = _POOL
+        column_family = 'Models'
+
+    id = KeyField()
+    count = IntegerField()
+    tags = ListField()
+    attrs = DictField()
+
+
+@benchmark
+def record_setitem():
+    """Record.__setitem__ on every column of a loaded record."""
+    items = [(col.name, "new " + col.value) for col in _cols()]
+
+    def __run__():
+        record = _record()
+        for (name, value) in items:
+            record[name] = value
+    return __run__
+
+
+@benchmark
+def record_inject():
+    """Record._inject of a fetched row."""
+    (key, cols) = (Key(_POOL, 'Records', 'record'), _cols())
+    return lambda: Record()._inject(key, cols)
+
+
+@benchmark
+def record_marshal():
+    """Record._marshal of a record with every column changed."""
+    record = _record()
+    for col in _cols():
+        record[col.name] = "new " + col.value
+    return record._marshal
+
+
+@benchmark
+def record_save():
+    """Record.save of every column, to a memory:// store."""
+    items = [(col.name, "new " + col.value) for col in _cols()]
+    if _POOL not in connection._SERVERS:
+        connection.add_pool(_POOL, ['memory://micro'])
+
+    def __run__():
+        record = _record()
+        for (name, value) in items:
+            record[name] = value
+        record.save()
+    return __run__
+
+
+@benchmark
+def record_copy_columns():
+    """The copy of _columns Record.save keeps as the original."""
+    record = _record()
+    return lambda: copy.deepcopy(record._columns)
+
+
+@benchmark
+def pack():
+    """iterators.pack of a row of columns."""
+    cols = _cols()
+    return lambda: tuple(iterators.pack(cols))
+
+
+@benchmark
+def unpack():
+    """iterators.unpack of a row of ColumnOrSuperColumns."""
+    packed = [ColumnOrSuperColumn(column=col) for col in _cols()]
+    return lambda: tuple(iterators.unpack(packed))
+
+
+@benchmark
+def chunk_seq():
+    """iterators.chunk_seq of 1000 items into chunks of 100."""
+    seq = range(1000)
+    return lambda: [chunk for chunk in iterators.chunk_seq(seq, 100)]
+
+
+@benchmark
+def groupsort():
+    """iterators.groupsort of 100 keys by column family."""
+    keys = [Key(_POOL, "cf-%d" % (n % 4), "key-%d" % n) for n in range(100)]
+    return lambda: [tuple(group) for (cf, group) in
+                    iterators.groupsort(keys, iterators.GET_COLFAM)]
+
+
+@benchmark
+def key_clone():
+    """Key.clone, then reading the clone's attributes."""
+    key = Key(_POOL, 'Records', 'record')
+
+    def __run__():
+        clone = key.clone(key='other')
+        return (clone.keyspace, clone.column_family, clone.key,
+                clone.super_column)
+    return __run__
+
+
+@benchmark
+def model_encode():
+    """Building a Model, and marshalling its encoded fields."""
+    return lambda: _BenchModel(id='model', count=42, tags=['a', 'b', 'c'],
+                               attrs={'x': 1, 'y': 2})._marshal()
+
+
+@benchmark
+def model_decode():
+    """Decoding a row's values into a Model's fields."""
+    row = {'id': 'model', 'count': '42', 'tags': '["a", "b", "c"]',
+           'attrs': '{"x": 1, "y": 2}'}
+
+    def __run__():
+        model = _BenchModel()
+        model.update(row)
+        return (model.id, model.count, model.tags, model.attrs)
+    return __run__
+
+
+def _reference():
+    """A fixed pure-Python loop, which other timings are relative to."""
+    out = {}
+    for n in xrange(200):
+        out["key-%d" % n] = [n, str(n)]
+    return sorted(out.itervalues())
+
+
+def measure(func, min_time=0.1, repeat=5):
+    """Return the fastest time, in seconds, of one call to func.
+
+    Calls are timed in loops long enough to take min_time seconds,
+    and the best of repeat loops is used.
+    """
+    timer = timeit.Timer(func)
+    loops = 1
+    while timer.timeit(loops) < min_time / 10:
+        loops *= 10
+    loops = max(1, int(loops * min_time / max(timer.timeit(loops), 1e-9)))
+    return min(timer.repeat(repeat, loops)) / loops
+
+
+def run(names=None, min_time=0.1, repeat=5):
+    """Run the benchmarks, or those in names.
+
+    Returns a dict of results, as written to the results file.
+    """
+    reference = measure(_reference, min_time, repeat)
+    results = {}
+    for (name, setup) in BENCHMARKS:
+        if names and name not in names:
+            continue
+        seconds = measure(setup(), min_time, repeat)
+        results[name] = {'seconds': seconds, 'relative': seconds / reference}
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'reference': reference, 'results': results}
+
+
+def compare(current, baseline, threshold=0.25):
+    """Compare results to a baseline.
+
+    Returns a dict of each benchmark's change relative to the
+    baseline, as a fraction, and a list of those which are more than
+    threshold slower.
+    """
+    changes, regressed = {}, []
+    for (name, result) in sorted(current['results'].iteritems()):
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        changes[name] = result['relative'] / base['relative'] - 1
+        if changes[name] > threshold:
+            regressed.append(name)
+    return changes, regressed
+
+
+def _parser():
+    """Return the command-line option parser."""
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-b", "--benchmarks",
+                      help="Comma-separated benchmarks to run [all]")
+    parser.add_option("-o", "--output", default="microbench.json",
+                      help="Write results here [%default]")
+    parser.add_option("--baseline", default=BASELINE,
+                      help="Compare to this baseline [%default]")
+    parser.add_option("--save-baseline", action="store_true",
+                      default=False,
+                      help="Write the results as the new baseline")
+    parser.add_option("-t", "--threshold", type="float", default=0.25,
+                      help="Fraction slower than the baseline which is a "
+                      "regression [%default]")
+    parser.add_option("--min-time", type="float", default=0.1,
+                      help="Seconds to time each loop for [%default]")
+    parser.add_option("-r", "--repeat", type="int", default=5,
+                      help="Loops to take the best of [%default]")
+    return parser
+
+
+def main(argv=None, out=sys.stdout):
+    """Run the microbenchmarks, as given on the command line.
+
+    Returns the exit status: 1 if any benchmark regressed, else 0.
+    """
+    (opts, args) = _parser().parse_args(argv)
+    names = opts.benchmarks.split(",") if opts.benchmarks else None
+    current = run(names, opts.min_time, opts.repeat)
+
+    baseline = {}
+    if os.path.exists(opts.baseline) and not opts.save_baseline:
+        with open(opts.baseline) as handle:
+            baseline = json.load(handle)
+    (changes, regressed) = compare(current, baseline, opts.threshold)
+    current.update(baseline=opts.baseline, threshold=opts.threshold,
+                   changes=changes, regressed=regressed)
+
+    print >> out, "%-20s %12s %10s" % ('benchmark', 'usec/op', 'change')
+    for (name, result) in sorted(current['results'].iteritems()):
+        change = ("%+9.1f%%" % (changes[name] * 100)
+                  if name in changes else "%10s" % "-")
+        print >> out, "%-20s %12.2f %s%s" % (
+            name, result['seconds'] * 1e6, change,
+            " REGRESSED" if name in regressed else "")
+
+    if opts.output:
+        _write(opts.output, current)
+    if opts.save_baseline:
+        _write(opts.baseline, dict((key, current[key]) for key in
+                                   ('python', 'platform', 'results')))
+    return 1 if regressed else 0
+
+
+def _write(path, results):
+    """Write results to path, as JSON."""
+    with open(path, 'w') as handle:
+        json.dump(results, handle, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
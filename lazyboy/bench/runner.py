@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Run benchmarks, and report on them."""
+
+import logging
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+from lazyboy.connection import add_pool
+from lazyboy.stats import Histogram
+from lazyboy.bench.server import LoopbackServer, start_process
+from lazyboy.bench.workloads import WORKLOADS, KEYSPACE
+
+_LOG = logging.getLogger(__name__)
+
+COLUMNS = ('workload', 'threads', 'ops/s', 'p50', 'p95', 'p99', 'max',
+           'errors')
+
+
+def run(workload, threads=1, duration=5.0, warmup=1.0):
+    """Run workload on threads threads, for duration seconds.
+
+    Each thread calls it as fast as it can; calls in the first warmup
+    seconds aren't counted. Returns a dict of the operations per
+    second, the number of errors, and the latency percentiles and
+    maximum, in seconds.
+    """
+    histograms = [Histogram() for n in range(threads)]
+    errors = [0] * threads
+    start = time.time()
+    measure_from, stop_at = start + warmup, start + warmup + duration
+
+    def __worker__(histogram, index):
+        """Call workload until stop_at."""
+        while True:
+            before = time.time()
+            if before >= stop_at:
+                return
+            try:
+                workload()
+            except Exception:
+                _LOG.exception("Error running %s", workload)
+                if before >= measure_from:
+                    errors[index] += 1
+                continue
+            if before >= measure_from:
+                histogram.record(time.time() - before)
+
+    workers = [threading.Thread(target=__worker__, args=(histogram, n))
+               for (n, histogram) in enumerate(histograms)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    elapsed = max(time.time() - measure_from, 1e-9)
+    total = Histogram()
+    for histogram in histograms:
+        total.merge(histogram)
+    result = total.summary()
+    result.update(ops=total.count / elapsed, errors=sum(errors))
+    return result
+
+
+def _format(name, threads, result):
+    """Return a table row for a result."""
+    return "%-16s %7d %10.1f %9.2f %9.2f %9.2f %9.2f %7d" % (
+        name, threads, result['ops'], result['p50'] * 1000,
+        result['p95'] * 1000, result['p99'] * 1000, result['max'] * 1000,
+        result['errors'])
+
+
+def _parser():
+    """Return the command-line option parser."""
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-t", "--threads", default="1,8,64",
+                      help="Comma-separated thread counts [%default]")
+    parser.add_option("-d", "--duration", type="float", default=5.0,
+                      help="Seconds to measure each run [%default]")
+    parser.add_option("--warmup", type="float", default=1.0,
+                      help="Seconds to run before measuring [%default]")
+    parser.add_option("-w", "--workloads", default=",".join(sorted(WORKLOADS)),
+                      help="Comma-separated workloads [%default]")
+    parser.add_option("-s", "--size", type="int", default=100,
+                      help="Records per view, set or array extend "
+                      "[%default]")
+    parser.add_option("-l", "--latency", type="float", default=0.0,
+                      help="Milliseconds the server waits per call "
+                      "[%default]")
+    parser.add_option("-j", "--jitter", type="float", default=0.0,
+                      help="Up to this many more milliseconds [%default]")
+    parser.add_option("--transport", default="buffered",
+                      help="Thrift transport [%default]")
+    parser.add_option("--protocol", default="accelerated",
+                      help="Thrift protocol [%default]")
+    parser.add_option("--server",
+                      help="Benchmark this host:port instead of starting "
+                      "a server")
+    parser.add_option("--in-process", action="store_true", default=False,
+                      help="Run the server in this process")
+    return parser
+
+
+def main(argv=None, out=sys.stdout):
+    """Run benchmarks, as given on the command line."""
+    (opts, args) = _parser().parse_args(argv)
+    threads = [int(count) for count in opts.threads.split(",")]
+    names = opts.workloads.split(",")
+    for name in names:
+        if name not in WORKLOADS:
+            raise SystemExit("Unknown workload `%s'; choose from: %s" %
+                             (name, ", ".join(sorted(WORKLOADS))))
+
+    server, process = None, None
+    server_args = dict(latency=opts.latency / 1000.0,
+                       jitter=opts.jitter / 1000.0,
+                       transport=opts.transport, protocol=opts.protocol)
+    if opts.server:
+        address = opts.server
+    elif opts.in_process:
+        server = LoopbackServer(**server_args)
+        address = server.start()
+    else:
+        (process, address) = start_process(**server_args)
+
+    add_pool(KEYSPACE, [address], pool_max=max(threads),
+             transport=opts.transport, protocol=opts.protocol)
+    try:
+        print >> out, "%-16s %7s %10s %9s %9s %9s %9s %7s" % COLUMNS
+        print >> out, "%62s" % "(latencies in ms)"
+        for name in names:
+            workload = WORKLOADS[name](opts.size)
+            workload.setup()
+            for count in threads:
+                result = run(workload, count, opts.duration, opts.warmup)
+                print >> out, _format(name, count, result)
+                out.flush()
+    finally:
+        if server:
+            server.stop()
+        if process:
+            process.terminate()
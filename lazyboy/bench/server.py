@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: A loopback Thrift server for benchmarks."""
+
+import logging
+import multiprocessing
+import random
+import socket
+import threading
+import time
+
+from cassandra import Cassandra
+from thrift.transport import TSocket, TTransport
+
+from lazyboy.memory import MemoryStore
+from lazyboy.transport import get_transport, get_protocol
+
+_LOG = logging.getLogger(__name__)
+
+
+class _SlowStore(object):
+
+    """A store which waits before every call, as a network would.
+
+    Each call waits latency seconds, plus up to jitter more.
+    """
+
+    def __init__(self, store, latency=0, jitter=0):
+        self.store = store
+        self.latency, self.jitter = latency, jitter
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+        if not self.latency and not self.jitter:
+            return method
+
+        def __delayed__(*args, **kwargs):
+            """Wait, then make the call."""
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+            return method(*args, **kwargs)
+        return __delayed__
+
+
+class LoopbackServer(object):
+
+    """A Thrift Cassandra server on a loopback port.
+
+    Calls are answered from store, a MemoryStore by default, after
+    latency seconds plus up to jitter more; each connection gets its
+    own thread. transport and protocol are named as for
+    connection.Client, and must match the clients'.
+    """
+
+    def __init__(self, store=None, latency=0, jitter=0, transport='buffered',
+                 protocol='accelerated'):
+        self.store = store if store is not None else MemoryStore()
+        self.processor = Cassandra.Processor(
+            _SlowStore(self.store, latency, jitter))
+        self.transport = get_transport(transport)
+        self.protocol = get_protocol(protocol)
+        self.address = None
+        self._sock = None
+
+    def start(self):
+        """Start serving in the background, returning the address."""
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(128)
+        self.address = "127.0.0.1:%d" % self._sock.getsockname()[1]
+        thread = threading.Thread(target=self._accept,
+                                  name="lazyboy-loopback")
+        thread.setDaemon(True)
+        thread.start()
+        return self.address
+
+    def stop(self):
+        """Stop accepting connections."""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _accept(self):
+        """Accept connections, until stopped."""
+        while self._sock is not None:
+            try:
+                (conn, addr) = self._sock.accept()
+            except (socket.error, AttributeError):
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            thread = threading.Thread(target=self._serve, args=(conn,))
+            thread.setDaemon(True)
+            thread.start()
+
+    def _serve(self, conn):
+        """Answer calls on one connection, until it's closed."""
+        sock = TSocket.TSocket()
+        sock.handle = conn
+        trans = self.transport(sock)
+        proto = self.protocol(trans)
+        try:
+            while True:
+                self.processor.process(proto, proto)
+        except (EOFError, TTransport.TTransportException, socket.error):
+            pass
+        except Exception:
+            _LOG.exception("Error serving %s", conn)
+        conn.close()
+
+
+def _serve_forever(pipe, kwargs):
+    """Run a LoopbackServer, sending its address down pipe."""
+    server = LoopbackServer(**kwargs)
+    pipe.send(server.start())
+    pipe.recv()
+
+
+def start_process(**kwargs):
+    """Start a LoopbackServer in a child process.
+
+    This keeps the server's work off the benchmark's interpreter lock.
+    Takes LoopbackServer's arguments, and returns (process, address);
+    the server stops when process is terminated.
+    """
+    (ours, theirs) = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve_forever,
+                                      args=(theirs, kwargs))
+    process.daemon = True
+    process.start()
+    return (process, ours.recv())
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Benchmark workloads.
+
+Each workload seeds the data it needs through lazyboy's own APIs,
+then runs one operation per call. They use the pool named KEYSPACE,
+which the runner points at the server being measured.
+"""
+
+import random
+import threading
+
+from lazyboy.array import Array
+from lazyboy.iterators import multigetterator
+from lazyboy.key import Key
+from lazyboy.record import Record
+from lazyboy.recordset import KeyRecordSet
+from lazyboy.view import View, BatchLoadingView
+
+KEYSPACE = 'Bench'
+
+
+class BenchRecord(Record):
+
+    """The record every workload reads and writes."""
+
+    _keyspace = KEYSPACE
+    _column_family = 'Records'
+
+
+class Workload(object):
+
+    """A benchmarked operation.
+
+    size sets how much each operation touches: the records in a view or
+    set, or the columns appended to an array.
+    """
+
+    def __init__(self, size=100):
+        self.size = size
+
+    def setup(self):
+        """Write the data this workload reads."""
+        pass
+
+    def __call__(self):
+        """Run one operation."""
+        raise NotImplementedError()
+
+    def _record_keys(self):
+        """Return the keys of the records written by _seed_records."""
+        return [Key(KEYSPACE, 'Records', "record-%d" % n)
+                for n in range(self.size)]
+
+    def _seed_records(self):
+        """Write size records."""
+        for key in self._record_keys():
+            record = BenchRecord(title="Title of %s" % key.key,
+                                 body="x" * 512, votes="0")
+            record.key = key
+            record.save()
+
+
+class RecordLoad(Workload):
+
+    """Record.load of a random record."""
+
+    setup = Workload._seed_records
+
+    def __call__(self):
+        BenchRecord().load(random.choice(self._record_keys()))
+
+
+class RecordSave(Workload):
+
+    """Record.save of a modified record."""
+
+    def setup(self):
+        self._local = threading.local()
+
+    def __call__(self):
+        record = getattr(self._local, 'record', None)
+        if record is None:
+            record = self._local.record = BenchRecord(
+                title="A title", body="x" * 512)
+            record.key = Key(KEYSPACE, 'Records',
+                             "save-%d" % threading.currentThread().ident)
+        record['votes'] = str(random.randint(0, 1 << 30))
+        record.save()
+
+
+class ViewIteration(Workload):
+
+    """Iteration over a View of size records, loading each."""
+
+    view_class = View
+    read_ahead = 0
+
+    def setup(self):
+        self._seed_records()
+        view = self._view()
+        for key in self._record_keys():
+            view.append(BenchRecord().load(key))
+
+    def _view(self):
+        """Return the view being iterated."""
+        view = self.view_class(Key(KEYSPACE, 'Views', 'view'),
+                               Key(KEYSPACE, 'Records'), BenchRecord)
+        view.read_ahead = self.read_ahead
+        return view
+
+    def __call__(self):
+        for record in self._view():
+            pass
+
+
+class ReadAheadViewIteration(ViewIteration):
+
+    """Iteration over a View of size records, reading pages ahead."""
+
+    read_ahead = 1
+
+
+class BatchViewIteration(ViewIteration):
+
+    """Iteration over a BatchLoadingView of size records."""
+
+    view_class = BatchLoadingView
+
+
+class KeyRecordSetLoad(Workload):
+
+    """Loading size records with a KeyRecordSet."""
+
+    setup = Workload._seed_records
+
+    def __call__(self):
+        KeyRecordSet(self._record_keys(), BenchRecord)
+
+
+class MultigetFanout(Workload):
+
+    """multigetterator over size keys in two column families."""
+
+    def setup(self):
+        self._seed_records()
+        for key in self._record_keys():
+            record = BenchRecord(title="Other %s" % key.key)
+            record.key = key.clone(column_family='Others')
+            record.save()
+
+    def __call__(self):
+        keys = self._record_keys()
+        multigetterator(keys + [key.clone(column_family='Others')
+                                for key in keys], BenchRecord.consistency)
+
+
+class ArrayExtend(Workload):
+
+    """Array.extend with size new columns."""
+
+    def __call__(self):
+        array = Array(Key(KEYSPACE, 'Arrays',
+                          "array-%d" % threading.currentThread().ident))
+        array.extend("%016x" % random.getrandbits(64)
+                     for n in range(self.size))
+
+
+# Workloads by the name they're run with.
+WORKLOADS = {'record_load': RecordLoad,
+             'record_save': RecordSave,
+             'view': ViewIteration,
+             'view_read_ahead': ReadAheadViewIteration,
+             'batch_view': BatchViewIteration,
+             'key_record_set': KeyRecordSetLoad,
+             'multiget': MultigetFanout,
+             'array_extend': ArrayExtend}
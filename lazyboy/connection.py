@@ -7,73 +7,778 @@
 
 """Lazyboy: Connections."""
 from __future__ import with_statement
-from functools import update_wrapper
+from functools import update_wrapper, partial
+from collections import deque
 import logging
 import random
 import os
 import threading
 import socket
 import errno
+import sys
 import time
 
 from cassandra import Cassandra
 import cassandra.ttypes as cas_types
 from thrift import Thrift
-from thrift.transport import TTransport, TSocket
-from thrift.protocol import TBinaryProtocol
+from thrift.transport import TTransport
 import thrift
 
 import lazyboy.exceptions as exc
+import lazyboy.balancer as balancer
+from lazyboy.ring import TokenRing
+from lazyboy.stats import Stats, SlowCallLogger
+from lazyboy.hooks import CallInfo, Hooks, fire
+from lazyboy.limiter import Limiter, AdaptiveLimiter
+import lazyboy.memory as memory
+from lazyboy.transport import build_transport, get_transport, get_protocol
+from lazyboy.workers import WorkerPool
 from contextlib import contextmanager
 
 _SERVERS = {}
 _CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+_LOG = logging.getLogger(__name__)
+_PID = os.getpid()
+_AFTER_FORK = []
+_HOOKS = Hooks()
+_ATTEMPT = threading.local()
+_DEADLINE = threading.local()
+_NO_KEYSPACE = ('get_string_property', 'get_string_list_property')
 RETRY_ATTEMPTS = 5
 
-def _retry_default_callback(attempt, exc_):
-    """Retry an attempt five times, then give up."""
-    return attempt < RETRY_ATTEMPTS
+
+class RetryBudget(object):
+
+    """A token bucket which limits retries to a share of all calls.
+
+    Every call deposits `ratio' tokens, and every retry withdraws
+    one. To allow retries when traffic is light, `min_rate' tokens are
+    also added every second. The bucket holds at most `capacity'
+    tokens.
+    """
+
+    def __init__(self, ratio=0.1, min_rate=10, capacity=100):
+        self.ratio, self.min_rate = ratio, min_rate
+        self.capacity = capacity
+        self._balance = float(capacity)
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount):
+        """Add tokens to the bucket."""
+        now = time.time()
+        self._balance = min(self.capacity, self._balance + amount +
+                            (now - self._last) * self.min_rate)
+        self._last = now
+
+    def deposit(self):
+        """Record a call."""
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        """Return True if a retry is allowed, and record it."""
+        with self._lock:
+            self._refill(0)
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+
+class RetryPolicy(object):
+
+    """Decides whether and when a failed call is retried.
+
+    Failed calls are retried up to `attempts' times in total, with
+    exponential backoff starting at `backoff' seconds, capped at
+    `backoff_max', and full jitter. Only exceptions in `retryable' are
+    retried, and only while the `budget' allows it. If `deadline' is
+    set, no retry starts which would end after that many seconds from
+    the first attempt; nor does one start after the deadline of the
+    call, if it has one.
+
+    Cassandra writes carry their own timestamps, so replaying one is
+    harmless and they are retried like reads. If `retry_writes' is
+    False, writes are only retried when they never reached a server.
+    """
+
+    RETRYABLE = (exc.ErrorThriftMessage, cas_types.UnavailableException,
+                 cas_types.TimedOutException, socket.error)
+    WRITES = ('insert', 'batch_insert', 'batch_mutate', 'remove')
+
+    def __init__(self, attempts=RETRY_ATTEMPTS, backoff=0.01,
+                 backoff_max=1.0, retryable=None, budget=None,
+                 deadline=None, retry_writes=True):
+        self.attempts = attempts
+        self.backoff, self.backoff_max = backoff, backoff_max
+        self.retryable = retryable or self.RETRYABLE
+        self.budget = budget or RetryBudget()
+        self.deadline = deadline
+        self.retry_writes = retry_writes
+
+    def delay(self, attempt):
+        """Return the time to wait before retrying a failed attempt."""
+        return random.uniform(
+            0, min(self.backoff * 2 ** (attempt - 1), self.backoff_max))
+
+    def should_retry(self, method, attempt, ex):
+        """Return True if the exception may be retried."""
+        if attempt >= self.attempts or not isinstance(ex, self.retryable):
+            return False
+
+        return (self.retry_writes or method not in self.WRITES
+                or isinstance(ex, exc.ErrorConnectionFailed))
+
+    def call(self, func, *args, **kwargs):
+        """Call func, retrying it according to this policy."""
+        return self.run(func, args, kwargs)
+
+    def run(self, func, args, kwargs, on_retry=None):
+        """Call func, retrying it according to this policy.
+
+        If on_retry is given, it's called with the name of func, the
+        attempt which failed and its exception, before each retry.
+        Leading underscores are stripped from the name, so retries of
+        the private halves of methods such as multiget_slice are
+        counted as the method's.
+        """
+        method = func.__name__.lstrip('_')
+        start = time.time()
+        self.budget.deposit()
+        attempt = 1
+        while True:
+            _ATTEMPT.number = attempt
+            try:
+                return func(*args, **kwargs)
+            except Exception, ex:
+                delay = self.delay(attempt)
+                left = time_left()
+                if (not self.should_retry(method, attempt, ex)
+                    or (self.deadline is not None and
+                        time.time() + delay - start >= self.deadline)
+                    or (left is not None and delay >= left)
+                    or not self.budget.withdraw()):
+                    raise
+                if on_retry:
+                    on_retry(method, attempt, ex)
+                time.sleep(delay)
+                attempt += 1
+
+
+class HedgePolicy(object):
+
+    """Decides when a read is also sent to a second server.
+
+    A read which hasn't finished after the `percentile' of recent
+    latencies for its method is sent to another server as well, and
+    whichever answers first is used. Latencies are kept for the last
+    `window' successful calls of each method; reads aren't hedged until
+    `min_samples' have been seen, and never sooner than `min_delay'
+    seconds. `budget', a RetryBudget, limits hedged reads to a share
+    of all reads; by default, a tenth.
+
+    The first call runs in the caller's thread, and hedged calls on up
+    to `workers' threads. If the hedged call answers first, the first
+    is cancelled by shutting down its connection.
+    """
+
+    def __init__(self, percentile=0.95, window=1000, min_samples=20,
+                 min_delay=0.005, budget=None, workers=32):
+        assert 0 < percentile <= 1
+        self.percentile, self.window = percentile, window
+        self.min_samples, self.min_delay = min_samples, min_delay
+        self.budget = budget or RetryBudget()
+        self.workers = WorkerPool(workers, "lazyboy-hedge")
+        self._samples = {}
+        self._delays = {}
+        self._lock = threading.Lock()
+
+    def record(self, method, elapsed):
+        """Record the latency of a successful call."""
+        with self._lock:
+            if method not in self._samples:
+                self._samples[method] = deque(maxlen=self.window)
+            self._samples[method].append(elapsed)
+            # Re-sorting every call is wasteful; the percentile is
+            # recalculated after every twentieth of a window instead.
+            (delay, stale) = self._delays.get(method, (None, 0))
+            self._delays[method] = (delay, stale + 1)
+
+    def delay(self, method):
+        """Return how long to wait before hedging a call, or None."""
+        self.budget.deposit()
+        with self._lock:
+            samples = self._samples.get(method)
+            if not samples or len(samples) < self.min_samples:
+                return None
+
+            (delay, stale) = self._delays[method]
+            if delay is None or stale >= max(self.window // 20, 1):
+                ordered = sorted(samples)
+                index = min(int(len(ordered) * self.percentile),
+                            len(ordered) - 1)
+                delay = max(ordered[index], self.min_delay)
+                self._delays[method] = (delay, 0)
+            return delay
+
+    def allow(self):
+        """Return True if a hedged call may be made, and record it."""
+        return self.budget.withdraw()
+
+
+class _HedgedRead(object):
+
+    """What the two calls of a hedged read know about each other.
+
+    The first call, in the caller's thread, attaches its connection,
+    and finishes when it's done. The hedged call waits until `at',
+    starts if the first hasn't finished, and if it answers first,
+    shuts down the first call's socket, so its blocking read fails at
+    once.
+    """
+
+    def __init__(self, at):
+        self.at = at
+        self.started = self.won = False
+        self._done = threading.Event()
+        self._sock = None
+        self._shut = False
+        self._lock = threading.Lock()
+
+    def attach(self, client):
+        """Note the connection the first call is made on."""
+        sock = getattr(getattr(getattr(client, 'transport', None), 'socket',
+                               None), 'handle', None)
+        with self._lock:
+            self._sock = sock
+            if self.won:
+                self._shutdown()
+
+    def detach(self):
+        """Forget the first call's connection.
+
+        Returns True if it was shut down, and mustn't be reused.
+        """
+        with self._lock:
+            self._sock = None
+            return self._shut
+
+    def _shutdown(self):
+        """Shut down the first call's socket."""
+        if self._sock is not None:
+            self._shut = True
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def finish(self):
+        """Mark the first call finished."""
+        with self._lock:
+            self._done.set()
+
+    def start(self):
+        """Wait until `at'. Returns True if the hedged call should start."""
+        self._done.wait(max(self.at - time.time(), 0))
+        with self._lock:
+            self.started = not self._done.isSet()
+            return self.started
+
+    def answer(self):
+        """Cancel the first call, if it's still running."""
+        with self._lock:
+            if not self._done.isSet():
+                self.won = True
+                self._shutdown()
 
 
 def retry(callback=None):
-    """Retry an operation."""
+    """Retry an operation.
 
-    callback = callback or _retry_default_callback
-    assert callable(callback)
+    If callback is given, it's called with the attempt number and the
+    exception after each failure, and the operation is retried while
+    it returns True. Otherwise, the RetryPolicy of the Client whose
+    method is being called is used.
+    """
 
     def __closure__(func):
 
-        def __inner__(*args, **kwargs):
+        def __callback__(*args, **kwargs):
             attempt = 1
             while True:
                 try:
                     return func(*args, **kwargs)
                 except Exception, ex:
                     if not callback(attempt, ex):
-                        raise ex
+                        raise
                     attempt += 1
+
+        def __policy__(*args, **kwargs):
+            policy = (args and getattr(args[0], '_retry_policy', None)
+                      or DEFAULT_RETRY_POLICY)
+            return policy.run(func, args, kwargs,
+                              args and getattr(args[0], '_retried', None))
+
+        __inner__ = __callback__ if callback else __policy__
+        update_wrapper(__inner__, func)
         return __inner__
     return __closure__
 
 
+def current_attempt():
+    """Return the attempt number of the call being made in this thread."""
+    return getattr(_ATTEMPT, 'number', 1)
+
+
+def get_deadline():
+    """Return the time calls in this thread must finish by, or None."""
+    return getattr(_DEADLINE, 'at', None)
+
+
+def time_left():
+    """Return the seconds left before this thread's deadline, or None."""
+    at = getattr(_DEADLINE, 'at', None)
+    return None if at is None else at - time.time()
+
+
+@contextmanager
+def until(at):
+    """Make calls in this block finish by `at', a UNIX timestamp.
+
+    A deadline can only be shortened by another inside it, never
+    extended; if at is None, the current deadline is kept.
+    """
+    previous = getattr(_DEADLINE, 'at', None)
+    if at is None or (previous is not None and previous < at):
+        at = previous
+    _DEADLINE.at = at
+    try:
+        yield
+    finally:
+        _DEADLINE.at = previous
+
+
+def deadline(timeout):
+    """Give the calls in a with block `timeout' seconds, in all.
+
+    Calls started after the deadline raise ErrorDeadlineExceeded, as
+    do calls which are still waiting on the server when it passes;
+    retries which would start after it aren't made. If timeout is
+    None, there's no new deadline.
+    """
+    return until(None if timeout is None else time.time() + timeout)
+
+
+def add_hook(hook, sample=1.0):
+    """Add a lifecycle hook for every Client.
+
+    hook is a lazyboy.hooks.Hook, which sees a `sample' fraction of
+    calls.
+    """
+    _HOOKS.add(hook, sample)
+
+
+def remove_hook(hook):
+    """Remove a lifecycle hook added with add_hook."""
+    _HOOKS.remove(hook)
+
+
+def _arg(args, kwargs, index, name):
+    """Return an argument which may be passed by position or keyword."""
+    return args[index] if len(args) > index else kwargs.get(name)
+
+
+def _replace_arg(args, kwargs, index, name, value):
+    """Return (args, kwargs) with an argument replaced."""
+    if len(args) > index:
+        args = args[:index] + (value,) + args[index + 1:]
+    else:
+        kwargs = dict(kwargs)
+        kwargs[name] = value
+    return (args, kwargs)
+
+
+def register_after_fork(func):
+    """Call func in forked children, before they use any pools."""
+    _AFTER_FORK.append(func)
+    return func
+
+
+def check_fork():
+    """Run the after-fork hooks, if this is a newly forked child."""
+    if os.getpid() != _PID:
+        after_fork()
+
+
+def prefork():
+    """Prepare the pools for forking worker processes.
+
+    A client is built for every pool which doesn't have one, without
+    opening any connections, and any idle connections are closed, so
+    each child inherits the configuration, but no sockets.
+    """
+    check_fork()
+    pid = os.getpid()
+    with _CLIENTS_LOCK:
+        for (name, config) in _SERVERS.iteritems():
+            if (pid, name) not in _CLIENTS:
+                client = Client(**dict(config, warm_up=0))
+                # Warm up in the children instead.
+                client._warm_up = config.get('warm_up', 0)
+                _CLIENTS[(pid, name)] = client
+        clients = _CLIENTS.values()
+
+    for client in clients:
+        client.close()
+
+
+def after_fork():
+    """Take over the pools inherited from the parent, in a forked child.
+
+    Inherited connections are dropped without anything being sent on
+    them, since the parent may still be using them; the clients are
+    kept, and warm up again if their pool asks for it. This is called
+    automatically where os.register_at_fork exists, and otherwise on
+    the first use of a pool in the child; call it directly in a
+    post-fork hook to do the work up front.
+    """
+    global _PID, _CLIENTS_LOCK
+    if os.getpid() == _PID:
+        return
+    _PID = os.getpid()
+    # The lock may have been held by another thread when we forked.
+    _CLIENTS_LOCK = threading.Lock()
+
+    inherited = _CLIENTS.items()
+    _CLIENTS.clear()
+    for ((pid, name), client) in inherited:
+        client._after_fork()
+        if name in _SERVERS and (_PID, name) not in _CLIENTS:
+            _CLIENTS[(_PID, name)] = client
+
+    for func in _AFTER_FORK:
+        func()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=after_fork)
+
+
 def add_pool(name, servers, timeout=None, recycle=None, **kwargs):
-    """Add a connection."""
+    """Add a connection pool.
+
+    In addition to the Client arguments, this accepts pool_min,
+    pool_max, pool_timeout and idle_timeout to size the per-host
+    connection pools. If warm_up is given, the pool's client is
+    created now, and opens that many connections to each host in the
+    background.
+    """
     _SERVERS[name] = dict(servers=servers, timeout=timeout, recycle=recycle,
                           **kwargs)
+    check_fork()
+    with _CLIENTS_LOCK:
+        old = _CLIENTS.pop((os.getpid(), name), None)
+    if old:
+        old.close()
+    if kwargs.get('warm_up'):
+        get_pool(name)
 
 
 def get_pool(name):
-    """Return a client for the given pool name."""
-    key = str(os.getpid()) + threading.currentThread().getName() + name
+    """Return the shared client for the given pool name."""
+    check_fork()
+    key = (os.getpid(), name)
     if key in _CLIENTS:
         return _CLIENTS[key]
 
-    try:
-        _CLIENTS[key] = Client(**_SERVERS[name])
+    with _CLIENTS_LOCK:
+        if key not in _CLIENTS:
+            if name not in _SERVERS:
+                raise exc.ErrorCassandraClientNotFound(
+                    "Pool `%s' is not defined." % name)
+            _CLIENTS[key] = Client(**_SERVERS[name])
         return _CLIENTS[key]
-    except Exception:
-        raise exc.ErrorCassandraClientNotFound(
-            "Pool `%s' is not defined." % name)
+
+
+class HostPool(object):
+
+    """A bounded, thread-safe pool of connections to one server.
+
+    Connections are opened on demand, up to max_size. When every
+    connection is checked out, callers wait up to wait_timeout
+    seconds for one to be returned. Connections which have been idle
+    longer than idle_timeout are closed rather than reused, though
+    min_size of them are left open between calls.
+
+    The pool also keeps a circuit breaker for its server. After
+    failure_threshold consecutive transport failures, the server is
+    marked down, and calls to it fail immediately. After down_backoff
+    seconds, one call at a time is let through as a probe; if it
+    succeeds the server is marked up, and if it fails the wait
+    doubles, up to down_backoff_max.
+    """
+
+    def __init__(self, factory, host, port, min_size=1, max_size=10,
+                 wait_timeout=None, idle_timeout=None, recycle=None,
+                 down_backoff=1.0, down_backoff_max=60.0,
+                 failure_threshold=3, limiter=None):
+        assert max_size > 0 and min_size <= max_size
+        self.host, self.port = host, port
+        self.min_size, self.max_size = min_size, max_size
+        self.wait_timeout = wait_timeout
+        self.idle_timeout = idle_timeout
+        self.recycle = recycle
+        self.down_backoff = down_backoff
+        self.down_backoff_max = down_backoff_max
+        self.failure_threshold = failure_threshold
+        self.limiter = limiter
+        self.down = False
+        self._backoff = 0
+        self._failures = 0
+        self._retry_at = 0
+        self._probing = False
+        self._factory = factory
+        self._idle = []
+        self._size = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def __str__(self):
+        return "%s:%s" % (self.host, self.port)
+
+    def __repr__(self):
+        return "<%s %s (%s, %d/%d open, %d idle)>" % (
+            self.__class__.__name__, self, "down" if self.down else "up",
+            self._size, self.max_size, len(self._idle))
+
+    def is_up(self):
+        """Return True unless this server is marked down, and not yet
+        ready to be probed."""
+        return not self.down or (not self._probing and
+                                 time.time() >= self._retry_at)
+
+    def mark_down(self):
+        """Mark this server down, until down_backoff has passed.
+
+        A server which is already down is only backed off further if
+        a probe of it failed.
+        """
+        with self._cond:
+            if self.down and not self._probing:
+                return
+
+            self.down, self._probing = True, False
+            self._backoff = min(self._backoff * 2 or self.down_backoff,
+                                self.down_backoff_max)
+            # Jitter the delay, so clients don't probe in lockstep.
+            self._retry_at = (time.time() +
+                              self._backoff * random.uniform(0.75, 1.0))
+            while self._idle:
+                self._close(self._idle.pop()[0])
+
+    def mark_up(self):
+        """Mark this server up."""
+        with self._cond:
+            self.down = self._probing = False
+            self._backoff = self._failures = 0
+
+    def record_failure(self):
+        """Count a transport failure, marking the server down if needed."""
+        with self._cond:
+            self._failures += 1
+            trip = self._probing or self._failures >= self.failure_threshold
+        if trip:
+            self.mark_down()
+
+    def record_success(self):
+        """Count a successful call, marking the server up if it was down."""
+        self._failures = 0
+        if self.down:
+            self.mark_up()
+
+    def allow(self):
+        """Return True if a call may be sent to this server.
+
+        If it's down, only one probe is allowed at a time, once
+        down_backoff has passed.
+        """
+        if not self.down:
+            return True
+        with self._cond:
+            if self._probing or time.time() < self._retry_at:
+                return False
+            self._probing = True
+            return True
+
+    def end_probe(self):
+        """Let another probe through, if one didn't finish normally."""
+        self._probing = False
+
+    def size(self):
+        """Return the number of open and checked-out connections."""
+        return self._size
+
+    def idle(self):
+        """Return the number of idle connections."""
+        return len(self._idle)
+
+    def warm(self, count):
+        """Open connections until count are idle, or the pool is full.
+
+        Returns the number of connections opened. If one can't be
+        opened, warming stops and the failure counts toward
+        failure_threshold, like any other transport failure.
+        """
+        opened = 0
+        while True:
+            with self._cond:
+                if (self.down or len(self._idle) >= count
+                    or self._size >= self.max_size):
+                    return opened
+                self._size += 1
+
+            try:
+                client = self._open()
+            except Exception, ex:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                _LOG.warn("Couldn't warm up %s: %s", self, ex)
+                self.record_failure()
+                return opened
+
+            self.put(client)
+            opened += 1
+
+    def _expired(self, client, now, since=None):
+        """Return True if a connection should not be reused.
+
+        since is when it was returned to the pool, if it's idle.
+        """
+        return (not client.transport.isOpen() or
+                (self.recycle and client.connect_time + self.recycle <= now)
+                or (since is not None and self.idle_timeout and
+                    since + self.idle_timeout <= now))
+
+    def _close(self, client):
+        """Close a connection which is leaving the pool."""
+        self._size -= 1
+        try:
+            client.transport.close()
+        except Exception:
+            pass
+
+    def _reap(self, now):
+        """Close connections which have been idle too long."""
+        if not self.idle_timeout:
+            return
+
+        # Idle connections are used LIFO, so the oldest are at the bottom.
+        while (self._idle and self._size > self.min_size
+               and self._idle[0][1] + self.idle_timeout <= now):
+            self._close(self._idle.pop(0)[0])
+
+    def get(self):
+        """Check a connection out of the pool.
+
+        Callers wait up to wait_timeout for a connection, but never past
+        their deadline.
+        """
+        give_up = (time.time() + self.wait_timeout
+                   if self.wait_timeout is not None else None)
+        at = get_deadline()
+        if at is not None and (give_up is None or at < give_up):
+            give_up = at
+        with self._cond:
+            while True:
+                now = time.time()
+                self._reap(now)
+                while self._idle:
+                    (client, since) = self._idle.pop()
+                    if not self._expired(client, now, since):
+                        return client
+                    self._close(client)
+
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+
+                if give_up is not None and now >= give_up:
+                    if give_up == at:
+                        raise exc.ErrorDeadlineExceeded(
+                            "Deadline passed waiting for %s" % self)
+                    raise exc.ErrorPoolExhausted(
+                        "No connection to %s available after %ss" % (
+                            self, self.wait_timeout))
+                self._cond.wait(give_up - now if give_up else None)
+
+        try:
+            return self._open()
+        except:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def _open(self):
+        """Return a new, open connection."""
+        client = self._factory()
+        if client is None:
+            raise exc.ErrorConnectionFailed("Could not build client",
+                                            str(self))
+
+        try:
+            client.transport.open()
+            client.connect_time = time.time()
+        except thrift.transport.TTransport.TTransportException, ex:
+            client.transport.close()
+            raise exc.ErrorConnectionFailed(ex.message, str(self))
+        return client
+
+    def put(self, client, discard=False):
+        """Return a connection to the pool.
+
+        If discard is True, or the connection was closed while it was
+        checked out, it is closed rather than reused.
+        """
+        now = time.time()
+        with self._cond:
+            if discard or not client.transport.isOpen():
+                self._close(client)
+            else:
+                self._idle.append((client, now))
+            self._reap(now)
+            self._cond.notify()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._cond:
+            while self._idle:
+                self._close(self._idle.pop()[0])
+            self._cond.notify_all()
+
+    def _after_fork(self):
+        """Forget the connections and threads inherited from the parent.
+
+        Closing a socket in the child sends nothing while the parent
+        still has it open; connections checked out by other threads
+        in the parent are simply forgotten.
+        """
+        self._cond = threading.Condition(threading.Lock())
+        self.down = self._probing = False
+        self._backoff = self._failures = self._retry_at = 0
+        if self.limiter is not None:
+            self.limiter.reset()
+        while self._idle:
+            try:
+                self._idle.pop()[0].transport.close()
+            except Exception:
+                pass
+        self._size = 0
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
 
 
 class _DebugTraceFactory(type):
@@ -130,7 +835,11 @@ class _DebugTraceFactory(type):
 
 class DebugTraceClient(Cassandra.Client):
 
-    """A client with debug tracing and slow query logging."""
+    """A client with debug tracing and slow query logging.
+
+    This logs every call, which is expensive; Client's slow_log option
+    logs a sample of slow calls from the call statistics instead.
+    """
 
     __metaclass__ = _DebugTraceFactory
 
@@ -149,32 +858,153 @@ class DebugTraceClient(Cassandra.Client):
 
 class Client(object):
 
-    """A wrapper around the Cassandra client which load-balances."""
+    """A wrapper around the Cassandra client which load-balances.
+
+    Clients are thread-safe; each call checks a connection out of the
+    pool for the server it's sent to, and returns it when done. Calls
+    are spread over the servers which aren't marked down by a
+    balancing policy from lazyboy.balancer; round-robin by default.
+
+    If token_aware is set, the client fetches the cluster's token map
+    every ring_refresh seconds, and sends single-key calls straight to
+    a server which owns the key. Multi-key calls are split up by owner
+    and run concurrently, on up to `workers' threads.
+
+    Failed calls are retried according to retry_policy, a RetryPolicy.
+    If hedge_policy, a HedgePolicy, is given, slow reads are also sent
+    to a second server.
+
+    max_in_flight limits the calls in flight from this client, and
+    host_max_in_flight those to each server. Calls over a limit wait
+    up to limit_wait seconds for a slot, then raise ErrorOverloaded.
+    If adaptive_limit is set, the limits are lowered as latency rises;
+    see lazyboy.limiter.
+
+    Connections are only opened when they're needed, unless warm_up is
+    given, in which case that many are opened to each server in a
+    background thread, and again in forked children. A Client which
+    is used in a forked child drops the connections it inherited.
+
+    Lifecycle hooks can be added to every Client with add_hook, or to
+    one with its add_hook method.
+
+    Every call is counted in stats(), by method and server. Listeners
+    in stats_listeners are told about each call, as described in
+    lazyboy.stats.Stats; if slow_log is given, a sample of calls taking
+    that many seconds or more, and of failures, are logged.
+
+    Connections use the `transport' ('buffered' or 'framed') and
+    `protocol' ('accelerated', 'binary' or, if this Thrift has it,
+    'compact') named. timeout is the read timeout, and connect_timeout
+    the connect timeout, both in milliseconds. read_buffer and
+    write_buffer size the socket buffers, in bytes, and nodelay and
+    keepalive set TCP_NODELAY and SO_KEEPALIVE.
+
+    A server given as memory:// is an in-process store, from
+    lazyboy.memory, rather than a Cassandra node.
+    """
 
     def __init__(self, servers, timeout=None, recycle=None, debug=False,
-                 **conn_args):
+                 pool_min=1, pool_max=10, pool_timeout=30, idle_timeout=300,
+                 down_backoff=1.0, down_backoff_max=60.0,
+                 failure_threshold=3, policy=None,
+                 token_aware=False, partitioner='RandomPartitioner',
+                 ring_refresh=300, workers=8, retry_policy=None,
+                 hedge_policy=None, transport='buffered',
+                 protocol='accelerated', connect_timeout=None,
+                 read_buffer=None, write_buffer=None, nodelay=True,
+                 keepalive=False, warm_up=0, stats_listeners=None,
+                 slow_log=None, max_in_flight=None, host_max_in_flight=None,
+                 limit_wait=0, adaptive_limit=False, **conn_args):
         """Initialize the client."""
         self._servers = servers
         self._recycle = recycle
         self._timeout = timeout
+        self._transport_args = dict(
+            transport=transport, protocol=protocol,
+            connect_timeout=connect_timeout, read_buffer=read_buffer,
+            write_buffer=write_buffer, nodelay=nodelay, keepalive=keepalive)
+        # Fail now, rather than on every connection.
+        get_transport(transport)
+        get_protocol(protocol)
+        policy = policy or balancer.RoundRobinPolicy
+        self._policy = policy() if isinstance(policy, type) else policy
+
+        self._token_aware = token_aware
+        self._partitioner = partitioner
+        self._ring_refresh = ring_refresh
+        self._ring = None
+        self._ring_expires = 0
+        self._ring_lock = threading.Lock()
+        self._workers = WorkerPool(workers)
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._hedge_policy = hedge_policy
+        self._warm_up = warm_up
+        self._pid = os.getpid()
+        self._stats = Stats(stats_listeners)
+        self._hooks = Hooks()
+        self._failed = threading.local()
+        self._hedged = threading.local()
+        if slow_log is not None:
+            self._stats.listeners.append(SlowCallLogger(slow_log))
+
+        limiter = AdaptiveLimiter if adaptive_limit else Limiter
+        self._limiter = (limiter(max_in_flight, limit_wait)
+                         if max_in_flight else None)
 
         class_ = DebugTraceClient if debug else Cassandra.Client
-        self._clients = [s for s in
-                         [self._build_server(class_, *server.split(":"),
-                                             **conn_args)
-                          for server in servers] if s]
-        self._current_server = random.randint(0, len(self._clients))
+        self._clients = []
+        for server in servers:
+            host, port = server.split(":", 1)
+            if server.startswith(memory.SCHEME):
+                factory = partial(memory.connect, server)
+            else:
+                factory = partial(self._build_server, class_, host, port,
+                                  **conn_args)
+            self._clients.append(HostPool(
+                    factory, host, port, min_size=pool_min, max_size=pool_max,
+                    wait_timeout=pool_timeout, idle_timeout=idle_timeout,
+                    recycle=recycle, down_backoff=down_backoff,
+                    down_backoff_max=down_backoff_max,
+                    failure_threshold=failure_threshold,
+                    limiter=(limiter(host_max_in_flight, limit_wait)
+                             if host_max_in_flight else None)))
+
+        if warm_up:
+            self._start_warm_up()
+
+    def _start_warm_up(self):
+        """Warm up the connections in a background thread."""
+        thread = threading.Thread(target=self.warm, args=(self._warm_up,),
+                                  name="lazyboy-warm-up")
+        thread.setDaemon(True)
+        thread.start()
+
+    def _after_fork(self):
+        """Drop state inherited from the parent, in a forked child."""
+        self._pid = os.getpid()
+        for pool in self._clients:
+            pool._after_fork()
+        self._ring_lock = threading.Lock()
+        self._ring_expires = 0
+        if self._limiter is not None:
+            self._limiter.reset()
+        self._workers = WorkerPool(self._workers.size, self._workers.name)
+        if self._hedge_policy:
+            workers = self._hedge_policy.workers
+            self._hedge_policy.workers = WorkerPool(workers.size,
+                                                    workers.name)
+        if self._warm_up:
+            self._start_warm_up()
 
     def _build_server(self, class_, host, port, **conn_args):
         """Return a client for the given host and port."""
         try:
-            socket_ = TSocket.TSocket(host, int(port))
-            if self._timeout:
-                socket_.setTimeout(self._timeout)
-            transport = TTransport.TBufferedTransport(socket_)
-            protocol = TBinaryProtocol.TBinaryProtocolAccelerated(transport)
+            (trans, protocol) = build_transport(
+                host, port, timeout=self._timeout or None,
+                **self._transport_args)
             client = class_(protocol, **conn_args)
-            client.transport = transport
+            client.transport = trans
             setattr(client, 'host', host)
             setattr(client, 'port', port)
             return client
@@ -182,67 +1012,387 @@ class Client(object):
                 cas_types.UnavailableException):
             return None
 
-    def _get_server(self):
-        """Return the next server (round-robin) from the list."""
+    def _get_server(self, key=None, exclude=None):
+        """Return the server the balancing policy picks for the next call.
+
+        Servers which are marked down are skipped. If every server is
+        down, the policy picks from all of them anyway. If a row key
+        is given, a live server which owns it is preferred. If exclude
+        is given, that server is never picked, and None is returned if
+        there's no other.
+        """
         if self._clients is None or len(self._clients) == 0:
             raise exc.ErrorCassandraNoServersConfigured()
 
-        self._current_server = self._current_server % len(self._clients)
-        return self._clients[self._current_server]
+        if key is not None and self._token_aware:
+            owner = self._owner(key, exclude)
+            if owner is not None:
+                return owner
+
+        candidates = [pool for pool in self._clients if pool is not exclude]
+        servers = [pool for pool in candidates if pool.is_up()]
+        if not servers and not candidates:
+            return None
+        return self._policy.choose(servers or candidates)
+
+    def _check_ring(self):
+        """Refresh the token ring in the background, if it's stale."""
+        if (time.time() >= self._ring_expires
+            and self._ring_lock.acquire(False)):
+            thread = threading.Thread(target=self._refresh_ring,
+                                      name="lazyboy-ring-refresh")
+            thread.setDaemon(True)
+            thread.start()
+
+    def _refresh_ring(self):
+        """Fetch the token map, and map its endpoints to our servers."""
+        try:
+            try:
+                ring = TokenRing(self.get_string_property('token map'),
+                                 self._partitioner)
+                servers = {}
+                for pool in self._clients:
+                    servers[pool.host] = pool
+                    try:
+                        servers[socket.gethostbyname(pool.host)] = pool
+                    except socket.error:
+                        pass
+
+                self._ring = (ring, [servers.get(endpoint)
+                                     for endpoint in ring.endpoints])
+                self._ring_expires = time.time() + self._ring_refresh
+            except Exception, ex:
+                _LOG.warn("Couldn't refresh token map: %s", ex)
+                self._ring_expires = time.time() + min(self._ring_refresh, 30)
+        finally:
+            self._ring_lock.release()
+
+    def _owner(self, key, exclude=None):
+        """Return the first live server in the ring from key's owner.
+
+        Returns None if the ring isn't known, or none of its servers
+        are ones we're configured to use.
+        """
+        self._check_ring()
+        if not self._ring or not self._ring[0]:
+            return None
+
+        (ring, servers) = self._ring
+        index = ring.owner_index(key)
+        for server in servers[index:] + servers[:index]:
+            if (server is not None and server is not exclude
+                and server.is_up()):
+                return server
+
+    def _split_keys(self, keys):
+        """Return a list of lists of row keys, grouped by owner."""
+        if not self._token_aware or not keys:
+            return [keys]
+
+        groups = {}
+        for key in keys:
+            groups.setdefault(self._owner(key), []).append(key)
+        return groups.values()
 
     def list_servers(self):
         """Return all servers we know about."""
         return self._clients
 
-    def _connect(self):
-        """Connect to Cassandra if not connected."""
+    def partitioner(self):
+        """Return the name of the cluster's partitioner."""
+        return self._partitioner
 
-        client = self._get_server()
+    def warm(self, count=1):
+        """Open count connections to every server, concurrently.
 
-        if client.transport.isOpen() and self._recycle:
-            if (client.connect_time + self._recycle) > time.time():
-                return client
-            else:
-                client.transport.close()
-
-        elif client.transport.isOpen():
-            return client
-
-        try:
-            client.transport.open()
-            client.connect_time = time.time()
-        except thrift.transport.TTransport.TTransportException, ex:
-            client.transport.close()
-            raise exc.ErrorThriftMessage(
-                ex.message, self._servers[self._current_server])
+        Returns the number of connections opened.
+        """
+        return sum(self._workers.run_all(partial(pool.warm, count)
+                                         for pool in self._clients))
 
-        return client
+    def close(self):
+        """Close all idle connections to every server."""
+        for pool in self._clients:
+            pool.close()
 
     @contextmanager
-    def get_client(self):
-        """Yield a Cassandra client connection."""
-        client = None
+    def get_client(self, key=None, pool=None):
+        """Yield a Cassandra client connection from the pool.
+
+        If key is given, the connection is to a server which owns it,
+        where possible; if pool is given, it's to that server. The
+        connection is returned to the pool afterwards, unless there was
+        a transport error, in which case it's closed. If this is the
+        first call of a hedged read, the hedged call may shut the
+        connection down.
+
+        If the server's circuit breaker is open, ErrorCircuitOpen is
+        raised without touching the network, and if too many calls are
+        in flight, ErrorOverloaded is. If the call has a deadline
+        sooner than the socket timeout, the timeout is cut to match for
+        the call.
+        """
+        # The pools' after-fork hooks reset this client, if it's in
+        # one; a client which isn't resets itself.
+        check_fork()
+        if self._pid != os.getpid():
+            self._after_fork()
+        pool = pool or self._get_server(key)
+        # Slots are taken first, so a probe which is let through always
+        # reaches the finally below, which ends it.
+        held = self._acquire(pool)
+        probe = pool.down
+        if not pool.allow():
+            for (limiter, started) in held:
+                limiter.release()
+            raise exc.ErrorCircuitOpen("Server is marked down", str(pool))
+
+        hedged = getattr(self._hedged, 'read', None)
+        client, discard, sock, dropped = None, True, None, True
+        self._policy.started(pool)
+        start = time.time()
         try:
-            client = self._connect()
+            try:
+                client = pool.get()
+            except exc.ErrorThriftMessage:
+                pool.record_failure()
+                raise
+            sock = self._cut_timeout(client)
+            if hedged is not None:
+                hedged.attach(client)
             yield client
+            discard = dropped = False
+            pool.record_success()
         except socket.error, ex:
-            if client:
-                client.transport.close()
-
-            args = (errno.errorcode[ex.args[0]], ex.args[1],
-                    self._servers[self._current_server])
-            raise exc.ErrorThriftMessage(*args)
+            if sock is not None and isinstance(ex, socket.timeout):
+                # The deadline cut it short; the server isn't to blame.
+                raise exc.ErrorDeadlineExceeded(
+                    "Deadline passed waiting for %s" % pool)
+            if hedged is None or not hedged.won:
+                pool.record_failure()
+            args = tuple(ex.args) or (None, "timed out")
+            raise exc.ErrorThriftMessage(errno.errorcode.get(args[0], args[0]),
+                                         args[-1], str(pool))
         except Thrift.TException, ex:
+            if (isinstance(ex, TTransport.TTransportException)
+                and (hedged is None or not hedged.won)):
+                pool.record_failure()
             message = ex.message or "Transport error, reconnect"
-            if client:
-                client.transport.close()
-            raise exc.ErrorThriftMessage(message,
-                                         self._servers[self._current_server])
+            raise exc.ErrorThriftMessage(message, str(pool))
         except (cas_types.NotFoundException, cas_types.UnavailableException,
+                cas_types.TimedOutException,
                 cas_types.InvalidRequestException), ex:
-            ex.args += (self._servers[self._current_server],
-                        "on %s" % self._servers[self._current_server])
+            discard = False
+            dropped = isinstance(ex, (cas_types.UnavailableException,
+                                      cas_types.TimedOutException))
+            pool.record_success()
+            ex.args += (str(pool), "on %s" % pool)
             raise ex
+        finally:
+            if hedged is not None and hedged.detach():
+                discard = True
+            if hedged is not None and hedged.won:
+                # Cancelled, not shed by an overloaded server.
+                dropped = False
+            self._policy.finished(pool, time.time() - start)
+            if probe:
+                pool.end_probe()
+            if sock is not None and not discard:
+                sock.setTimeout(self._timeout or None)
+            if client is not None:
+                pool.put(client, discard)
+            for (limiter, started) in held:
+                limiter.release(started, dropped)
+
+    def _acquire(self, pool):
+        """Take a slot from this client's limiter, and pool's.
+
+        Returns a list of (limiter, start time) for each slot taken.
+        """
+        held = []
+        try:
+            for limiter in (self._limiter, pool.limiter):
+                if limiter is not None:
+                    held.append((limiter, limiter.acquire(time_left())))
+        except:
+            for (limiter, started) in held:
+                limiter.release()
+            raise
+        return held
+
+    def _cut_timeout(self, client):
+        """Cut a connection's socket timeout to this thread's deadline.
+
+        Returns the socket if its timeout was changed, otherwise None.
+        """
+        left = time_left()
+        if left is None:
+            return None
+        sock = getattr(client.transport, 'socket', None)
+        if sock is None or (self._timeout and self._timeout <= left * 1000):
+            return None
+        sock.setTimeout(max(left * 1000, 1))
+        return sock
+
+    def stats(self):
+        """Return the statistics for calls made by this client.
+
+        See lazyboy.stats.Stats.snapshot.
+        """
+        return self._stats.snapshot()
+
+    def add_hook(self, hook, sample=1.0):
+        """Add a lifecycle hook for this client's calls.
+
+        hook is a lazyboy.hooks.Hook, which sees a `sample' fraction of
+        calls.
+        """
+        self._hooks.add(hook, sample)
+
+    def remove_hook(self, hook):
+        """Remove a lifecycle hook."""
+        self._hooks.remove(hook)
+
+    def _sample_hooks(self):
+        """Return the hooks which should see the next call."""
+        if not _HOOKS and not self._hooks:
+            return None
+        return _HOOKS.sample() + self._hooks.sample()
+
+    def _retried(self, method, attempt, ex):
+        """Record that a call is being retried.
+
+        The retry hook is given the failed call's CallInfo, if hooks
+        saw it.
+        """
+        self._stats.retry(method)
+        hooks = self._sample_hooks()
+        if hooks:
+            call = getattr(self._failed, 'call', None)
+            if (call is None or call.method != method
+                or call.attempt != attempt):
+                call = CallInfo(method, attempt=attempt)
+            fire(hooks, 'retry', call, ex)
+        self._failed.call = None
+
+    def _call(self, method, key, args, kwargs, pool=None, attempt=None):
+        """Call a Cassandra method on the server for key, or pool."""
+        left = time_left()
+        if left is not None and left <= 0:
+            raise exc.ErrorDeadlineExceeded("Deadline passed before %s" %
+                                            method)
+        pool = pool or self._get_server(key)
+        hooks = self._sample_hooks()
+        if hooks:
+            call = CallInfo(method, None if method in _NO_KEYSPACE else
+                            _arg(args, kwargs, 0, 'keyspace'), str(pool),
+                            attempt or current_attempt())
+            fire(hooks, 'start', call)
+            sock = sizes = None
+
+        start = time.time()
+        try:
+            with self.get_client(key, pool) as client:
+                if hooks:
+                    sock = getattr(client.transport, 'socket', None)
+                    sizes = sock and (sock.bytes_written, sock.bytes_read)
+                result = getattr(client, method)(*args, **kwargs)
+        except Exception:
+            exc_info = sys.exc_info()
+            elapsed = time.time() - start
+            self._stats.record(method, str(pool), elapsed, exc_info[1], args,
+                               kwargs)
+            # The retry hook is told about this call, if it's retried.
+            self._failed.call = call if hooks else None
+            if hooks:
+                self._finish_call(call, elapsed, sock, sizes)
+                fire(hooks, 'failure', call, exc_info[1])
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        elapsed = time.time() - start
+        self._stats.record(method, str(pool), elapsed, None, args, kwargs)
+        if hooks:
+            self._finish_call(call, elapsed, sock, sizes)
+            fire(hooks, 'success', call)
+        return result
+
+    def _finish_call(self, call, elapsed, sock, sizes):
+        """Fill in the elapsed time and sizes of a finished call."""
+        call.elapsed = elapsed
+        if sock:
+            call.request_size = sock.bytes_written - sizes[0]
+            call.response_size = sock.bytes_read - sizes[1]
+
+    def _timed_call(self, pool, method, args, kwargs, attempt=None, at=None):
+        """Call a method on pool, recording its latency for hedging."""
+        start = time.time()
+        with until(at):
+            result = self._call(method, None, args, kwargs, pool, attempt)
+        self._hedge_policy.record(method, time.time() - start)
+        return result
+
+    def _read(self, method, key, args, kwargs):
+        """Call an idempotent read method, hedging it if it's slow."""
+        hedge = self._hedge_policy
+        if hedge is None or len(self._clients) < 2:
+            return self._call(method, key, args, kwargs)
+
+        delay = hedge.delay(method)
+        pool = self._get_server(key)
+        if delay is None:
+            return self._timed_call(pool, method, args, kwargs)
+
+        hedged = _HedgedRead(time.time() + delay)
+        second = hedge.workers.submit(self._hedge, hedged, key, pool, method,
+                                      args, kwargs, current_attempt(),
+                                      get_deadline())
+        self._hedged.read = hedged
+        try:
+            result = self._timed_call(pool, method, args, kwargs)
+        except Exception:
+            exc_info = sys.exc_info()
+        else:
+            exc_info = None
+        finally:
+            self._hedged.read = None
+            hedged.finish()
+
+        if hedged.won:
+            return second.result()
+        if exc_info is None:
+            return result
+        # A retryable failure waits for the hedged call's answer.
+        if (hedged.started and
+            isinstance(exc_info[1], self._retry_policy.retryable)):
+            try:
+                return second.result()
+            except Exception:
+                pass
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _hedge(self, hedged, key, pool, method, args, kwargs, attempt, at):
+        """Send a read to a second server, if the first is slow.
+
+        Runs on the hedge policy's workers. Returns None if the read
+        isn't hedged.
+        """
+        if not hedged.start() or not self._hedge_policy.allow():
+            return None
+        second = self._get_server(key, exclude=pool)
+        if second is None:
+            return None
+
+        try:
+            result = self._timed_call(second, method, args, kwargs, attempt,
+                                      at)
+        except self._retry_policy.retryable:
+            raise
+        except Exception:
+            # Other exceptions are answers, too.
+            hedged.answer()
+            raise
+        hedged.answer()
+        return result
 
     @retry()
     def get(self, *args, **kwargs):
@@ -253,8 +1403,7 @@ class Client(object):
         - column_path
         - consistency_level
         """
-        with self.get_client() as client:
-            return client.get(*args, **kwargs)
+        return self._read('get', _arg(args, kwargs, 1, 'key'), args, kwargs)
 
     @retry()
     def get_slice(self, *args, **kwargs):
@@ -266,8 +1415,8 @@ class Client(object):
         - predicate
         - consistency_level
         """
-        with self.get_client() as client:
-            return client.get_slice(*args, **kwargs)
+        return self._read('get_slice', _arg(args, kwargs, 1, 'key'), args,
+                          kwargs)
 
     @retry()
     def get_range_slice(self, *args, **kwargs):
@@ -283,8 +1432,7 @@ class Client(object):
         - row_count
         - consistency_level
         """
-        with self.get_client() as client:
-            return client.get_range_slice(*args, **kwargs)
+        return self._read('get_range_slice', None, args, kwargs)
 
     @retry()
     def multiget(self, *args, **kwargs):
@@ -295,10 +1443,8 @@ class Client(object):
         - column_path
         - consistency_level
         """
-        with self.get_client() as client:
-            return client.multiget(*args, **kwargs)
+        return self._call('multiget', None, args, kwargs)
 
-    @retry()
     def multiget_slice(self, *args, **kwargs):
         """
         Parameters:
@@ -308,8 +1454,30 @@ class Client(object):
         - predicate
         - consistency_level
         """
-        with self.get_client() as client:
-            return client.multiget_slice(*args, **kwargs)
+        groups = self._split_keys(_arg(args, kwargs, 1, 'keys'))
+        if len(groups) == 1:
+            return self._multiget_slice(*args, **kwargs)
+
+        at = get_deadline()
+
+        def multiget(group):
+            """Fetch a group of row keys."""
+            (args_, kwargs_) = _replace_arg(args, kwargs, 1, 'keys', group)
+            with until(at):
+                return self._multiget_slice(*args_, **kwargs_)
+
+        out = {}
+        for res in self._workers.run_all(partial(multiget, group)
+                                         for group in groups):
+            out.update(res)
+        return out
+
+    @retry()
+    def _multiget_slice(self, *args, **kwargs):
+        """Call multiget_slice on the server owning the first key."""
+        keys = _arg(args, kwargs, 1, 'keys')
+        return self._read('multiget_slice', keys[0] if keys else None, args,
+                          kwargs)
 
     @retry()
     def get_count(self, *args, **kwargs):
@@ -320,8 +1488,8 @@ class Client(object):
         - column_parent
         - consistency_level
         """
-        with self.get_client() as client:
-            return client.get_count(*args, **kwargs)
+        return self._read('get_count', _arg(args, kwargs, 1, 'key'), args,
+                          kwargs)
 
     @retry()
     def get_key_range(self, *args, **kwargs):
@@ -334,8 +1502,7 @@ class Client(object):
         - count
         - consistency_level
         """
-        with self.get_client() as client:
-            return client.get_key_range(*args, **kwargs)
+        return self._call('get_key_range', None, args, kwargs)
 
     @retry()
     def remove(self, *args, **kwargs):
@@ -347,8 +1514,7 @@ class Client(object):
         - timestamp
         - consistency_level
         """
-        with self.get_client() as client:
-            return client.remove(*args, **kwargs)
+        return self._call('remove', _arg(args, kwargs, 1, 'key'), args, kwargs)
 
     @retry()
     def get_string_property(self, *args, **kwargs):
@@ -356,8 +1522,7 @@ class Client(object):
         Parameters:
         - property
         """
-        with self.get_client() as client:
-            return client.get_string_property(*args, **kwargs)
+        return self._call('get_string_property', None, args, kwargs)
 
     @retry()
     def get_string_list_property(self, *args, **kwargs):
@@ -365,8 +1530,7 @@ class Client(object):
         Parameters:
         - property
         """
-        with self.get_client() as client:
-            return client.get_string_list_property(*args, **kwargs)
+        return self._call('get_string_list_property', None, args, kwargs)
 
     @retry()
     def describe_keyspace(self, *args, **kwargs):
@@ -374,8 +1538,7 @@ class Client(object):
         Parameters:
         - keyspace
         """
-        with self.get_client() as client:
-            return client.describe_keyspace(*args, **kwargs)
+        return self._call('describe_keyspace', None, args, kwargs)
 
     @retry()
     def batch_insert(self, *args, **kwargs):
@@ -386,10 +1549,9 @@ class Client(object):
         - cfmap
         - consistency_level
         """
-        with self.get_client() as client:
-            return client.batch_insert(*args, **kwargs)
+        return self._call('batch_insert', _arg(args, kwargs, 1, 'key'),
+                          args, kwargs)
 
-    @retry()
     def batch_mutate(self, *args, **kwargs):
         """
         Parameters:
@@ -397,8 +1559,29 @@ class Client(object):
         - mutation_map
         - consistency_level
         """
-        with self.get_client() as client:
-            return client.batch_mutate(*args, **kwargs)
+        mutation_map = _arg(args, kwargs, 1, 'mutation_map')
+        groups = self._split_keys(mutation_map)
+        if len(groups) == 1:
+            return self._batch_mutate(*args, **kwargs)
+
+        at = get_deadline()
+
+        def mutate(group):
+            """Apply the mutations for a group of row keys."""
+            mutations = dict((key, mutation_map[key]) for key in group)
+            (args_, kwargs_) = _replace_arg(args, kwargs, 1, 'mutation_map',
+                                            mutations)
+            with until(at):
+                return self._batch_mutate(*args_, **kwargs_)
+
+        self._workers.run_all(partial(mutate, group) for group in groups)
+
+    @retry()
+    def _batch_mutate(self, *args, **kwargs):
+        """Call batch_mutate on the server owning the first key."""
+        mutation_map = _arg(args, kwargs, 1, 'mutation_map')
+        key = iter(mutation_map).next() if mutation_map else None
+        return self._call('batch_mutate', key, args, kwargs)
 
     @retry()
     def insert(self, *args, **kwargs):
@@ -411,5 +1594,4 @@ class Client(object):
         - timestamp
         - consistency_level
         """
-        with self.get_client() as client:
-            return client.insert(*args, **kwargs)
+        return self._call('insert', _arg(args, kwargs, 1, 'key'), args, kwargs)
@@ -60,3 +60,28 @@ class ErrorCassandraNoServersConfigured(LazyboyException):
 class ErrorImmutable(LazyboyException):
     """Raised on an attempt to modify an immutable object."""
     pass
+
+
+class ErrorPoolExhausted(LazyboyException):
+    """Raised when no pooled connection became available in time."""
+    pass
+
+
+class ErrorConnectionFailed(ErrorThriftMessage):
+    """Raised when a connection to a server couldn't be opened."""
+    pass
+
+
+class ErrorCircuitOpen(ErrorConnectionFailed):
+    """Raised instead of calling a server which is marked down."""
+    pass
+
+
+class ErrorDeadlineExceeded(LazyboyException):
+    """Raised when a call's deadline passes before it finishes."""
+    pass
+
+
+class ErrorOverloaded(LazyboyException):
+    """Raised when a call is shed because too many are in flight."""
+    pass
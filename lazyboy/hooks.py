@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Request lifecycle hooks.
+
+Hooks are told when each Client call starts, succeeds, fails or is
+retried, and are handed a CallInfo describing it. They can be added
+for every Client with connection.add_hook, or for one with
+Client.add_hook. Each hook has a sampling rate, decided once per
+call; when no hooks are registered, calls don't pay for them.
+"""
+
+import logging
+import random
+
+_LOG = logging.getLogger(__name__)
+
+
+class CallInfo(object):
+
+    """A description of one attempt at a Client call.
+
+    elapsed is in seconds, and request_size and response_size are in
+    bytes; they're None until the call finishes, and the sizes stay
+    None if the connection can't count them.
+    """
+
+    __slots__ = ('method', 'keyspace', 'host', 'attempt', 'elapsed',
+                 'request_size', 'response_size')
+
+    def __init__(self, method, keyspace=None, host=None, attempt=1):
+        self.method, self.keyspace, self.host = method, keyspace, host
+        self.attempt = attempt
+        self.elapsed = self.request_size = self.response_size = None
+
+    def __repr__(self):
+        return "<%s %s(%s) on %s, attempt %s>" % (
+            self.__class__.__name__, self.method, self.keyspace, self.host,
+            self.attempt)
+
+
+class Hook(object):
+
+    """The base lifecycle hook. Override the events of interest."""
+
+    def start(self, call):
+        """Called before a call is sent."""
+        pass
+
+    def success(self, call):
+        """Called after a call succeeds."""
+        pass
+
+    def failure(self, call, ex):
+        """Called after a call raises ex."""
+        pass
+
+    def retry(self, call, ex):
+        """Called before a call which raised ex is retried."""
+        pass
+
+
+class Hooks(object):
+
+    """A set of hooks, each with a sampling rate between 0 and 1."""
+
+    def __init__(self):
+        # Replaced, never changed, so it can be read without a lock.
+        self._hooks = ()
+
+    def __nonzero__(self):
+        return bool(self._hooks)
+
+    def __len__(self):
+        return len(self._hooks)
+
+    def add(self, hook, sample=1.0):
+        """Add a hook, which sees a `sample' fraction of calls."""
+        assert 0 <= sample <= 1
+        self._hooks = self._hooks + ((hook, sample),)
+
+    def remove(self, hook):
+        """Remove a hook."""
+        self._hooks = tuple((other, sample) for (other, sample)
+                            in self._hooks if other is not hook)
+
+    def sample(self):
+        """Return the hooks which should see the next call."""
+        return [hook for (hook, sample) in self._hooks
+                if sample >= 1 or random.random() < sample]
+
+
+def fire(hooks, event, *args):
+    """Call the event method of each hook, logging any exceptions."""
+    for hook in hooks:
+        try:
+            getattr(hook, event)(*args)
+        except Exception:
+            _LOG.exception("Error in %s hook %r", event, hook)
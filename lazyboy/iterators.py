@@ -7,11 +7,18 @@
 """Iterator-based Cassandra tools."""
 
 import itertools as it
+import os
+import threading
 import time
+from functools import partial
 from operator import attrgetter, itemgetter
-from collections import defaultdict
+from collections import defaultdict, deque
 
-from lazyboy.connection import get_pool
+from lazyboy.connection import get_pool, deadline as call_deadline, \
+    get_deadline, until
+from lazyboy.nonblocking import get_pool as get_async_pool
+from lazyboy.workers import WorkerPool, chain, gather
+import lazyboy.workers as workers
 import lazyboy.exceptions as exc
 import lazyboy.util as util
 
@@ -24,15 +31,30 @@ GET_COLFAM = attrgetter("column_family")
 GET_KEY = attrgetter("key")
 GET_SUPERCOL = attrgetter("super_column")
 
+# The number of columns slice_iterator fetches at a time
+SLICE_PAGE_SIZE = 1000
+
+# The number of rows range_slice_iterator fetches at a time
+RANGE_PAGE_SIZE = 100
+
+# The most row keys multigetterator asks for in one multiget_slice
+MULTIGET_CHUNK_SIZE = 100
+
+# The most multiget_slice calls multigetterator runs at once, across
+# all threads
+MULTIGET_CONCURRENCY = 16
+
+_WORKERS = {}
+_WORKERS_LOCK = threading.Lock()
+
 
 def groupsort(iterable, keyfunc):
     """Return a generator which sort and groups a list."""
     return it.groupby(sorted(iterable, key=keyfunc), keyfunc)
 
 
-def slice_iterator(key, consistency, **predicate_args):
-    """Return an iterator over a row."""
-
+def _slice_predicate(predicate_args):
+    """Return a SlicePredicate for slice_iterator arguments."""
     predicate = SlicePredicate()
     if 'columns' in predicate_args:
         predicate.column_names = predicate_args['columns']
@@ -41,58 +63,291 @@ def slice_iterator(key, consistency, **predicate_args):
                   'count': 100000, 'reversed': False}
         args.update(predicate_args)
         predicate.slice_range=SliceRange(**args)
+    return predicate
 
-    consistency = consistency or ConsistencyLevel.ONE
 
+def _check_slice(key, res):
+    """Return an iterator over the columns in a slice, if there are any."""
+    if not res:
+        raise exc.ErrorNoSuchRecord("No record matching key %s" % key)
+
+    return unpack(res)
+
+
+def slice_iterator(key, consistency, page_size=None, read_ahead=0,
+                   **predicate_args):
+    """Return an iterator over a row.
+
+    The row is fetched page_size columns at a time (SLICE_PAGE_SIZE by
+    default), as the iterator is consumed, so rows of any width can be
+    read in bounded memory. If read_ahead is given, up to that many
+    pages are fetched in the background while the current one is
+    used. count limits the number of columns; by default, every column
+    is read. If page_size is 0, or columns are named, the row is
+    fetched with a single get_slice, of at most 100000 columns unless
+    count says otherwise.
+
+    ErrorNoSuchRecord is raised if there is no such row.
+    """
+    consistency = consistency or ConsistencyLevel.ONE
     client = get_pool(key.keyspace)
+    page_size = SLICE_PAGE_SIZE if page_size is None else page_size
+
+    if 'columns' in predicate_args or not page_size:
+        res = client.get_slice(key.keyspace, key.key, key,
+                               _slice_predicate(predicate_args), consistency)
+        return _check_slice(key, res)
+
+    args = {'start': "", 'finish': "", 'reversed': False, 'count': None}
+    args.update(predicate_args)
+    pages = _slice_pages(client, key, consistency, page_size,
+                         get_deadline(), **args)
+    if read_ahead:
+        pages = workers.read_ahead(pages, read_ahead)
+
+    cols = chain_iterable(pages)
+    for col in cols:
+        return _prepend(col, cols)
+    raise exc.ErrorNoSuchRecord("No record matching key %s" % key)
+
+
+def _slice_pages(client, key, consistency, page_size, at, start, finish,
+                 reversed, count):
+    """Yield lists of up to count columns from a row, page_size at a time.
+
+    Pages may be fetched in another thread, so the deadline is passed
+    in."""
+    fudge = 0
+    while count is None or count > 0:
+        wanted = page_size if count is None else min(page_size, count)
+        with until(at):
+            page = client.get_slice(
+                key.keyspace, key.key, key,
+                SlicePredicate(slice_range=SliceRange(start, finish,
+                                                      reversed,
+                                                      wanted + fudge)),
+                consistency)
+        cols = list(unpack(page or []))
+        # The start column is included in the results, unless it was
+        # removed since the last page was read.
+        if fudge and cols and cols[0].name == start:
+            cols = cols[1:]
+        cols = cols[:wanted]
+        yield cols
+
+        if len(cols) < wanted:
+            return
+        if count is not None:
+            count -= len(cols)
+        # The next page starts at the last column, and skips it.
+        (start, fudge) = (cols[-1].name, 1)
+
+
+def _prepend(first, rest):
+    """Yield first, then everything in rest."""
+    yield first
+    for item in rest:
+        yield item
+
+
+def slice_iterator_async(key, consistency, **predicate_args):
+    """Return a Future of an iterator over a row, without blocking."""
+    predicate = _slice_predicate(predicate_args)
+    consistency = consistency or ConsistencyLevel.ONE
+
+    client = get_async_pool(key.keyspace)
     res = client.get_slice(
         key.keyspace, key.key, key, predicate, consistency)
 
-    if not res:
-        raise exc.ErrorNoSuchRecord("No record matching key %s" % key)
+    return chain(res, lambda cols: _check_slice(key, cols))
 
-    return unpack(res)
+
+def _multiget_predicate(range_args):
+    """Return a SlicePredicate for multigetterator arguments."""
+    kwargs = {'start': "", 'finish': "",
+              'count': 100000, 'reversed': False}
+    kwargs.update(range_args)
+    return SlicePredicate(slice_range=SliceRange(**kwargs))
 
 
-def multigetterator(keys, consistency, **range_args):
+def _multiget_groups(keys, chunk_size=None):
+    """Yield (keyspace, column_family, super_column, row_keys) groups.
+
+    Each group can be fetched with one multiget_slice. If chunk_size
+    is given, no group has more row keys than that.
+    """
+    groups = {}
+    for key in keys:
+        groups.setdefault((key.keyspace, key.column_family,
+                           key.super_column), []).append(key.key)
+
+    for ((keyspace, colfam, supercol), row_keys) in groups.iteritems():
+        size = chunk_size or len(row_keys)
+        for start in xrange(0, len(row_keys), size):
+            yield (keyspace, colfam, supercol, row_keys[start:start + size])
+
+
+def _get_workers():
+    """Return the worker pool multigetterator fans out on."""
+    pid = os.getpid()
+    if pid not in _WORKERS:
+        with _WORKERS_LOCK:
+            if pid not in _WORKERS:
+                # Threads don't survive a fork, so neither does the pool.
+                _WORKERS.clear()
+                _WORKERS[pid] = WorkerPool(MULTIGET_CONCURRENCY,
+                                           "lazyboy-multiget")
+    return _WORKERS[pid]
+
+
+def _merge_rows(out, keyspace, colfam, supercol, records):
+    """Merge the results of a multiget_slice into multigetterator output."""
+    rows = out.setdefault(keyspace, {}).setdefault(colfam, defaultdict(dict))
+    for (row_key, cols) in records.iteritems():
+        cols = unpack(cols)
+        if supercol is None:
+            rows[row_key] = cols
+        else:
+            rows[row_key][supercol] = cols
+
+
+def _multiget(group, predicate, consistency, at=None):
+    """Fetch a group of row keys, as from _multiget_groups.
+
+    This is run by worker threads, so the deadline is passed in."""
+    (keyspace, colfam, supercol, row_keys) = group
+    with until(at):
+        return get_pool(keyspace).multiget_slice(
+            keyspace, row_keys, ColumnParent(colfam, supercol), predicate,
+            consistency)
+
+
+def multigetterator(keys, consistency, deadline=None, chunk_size=None,
+                    **range_args):
     """Return a dictionary of data from Cassandra.
 
-    This fetches data with the minumum number of network requests. It
-    DOES NOT preserve order.
+    Keys are fetched with one multiget_slice per keyspace, column
+    family and super column, split into chunks of at most chunk_size
+    row keys (MULTIGET_CHUNK_SIZE by default). Every chunk is fetched
+    concurrently, so this takes about as long as the slowest. It DOES
+    NOT preserve order.
 
     If you depend on ordering, use list_multigetterator. This may
     require more requests.
+
+    If deadline is given, every request must finish within that many
+    seconds, in all, or ErrorDeadlineExceeded is raised.
     """
-    kwargs = {'start': "", 'finish': "",
-              'count': 100000, 'reversed': False}
-    kwargs.update(range_args)
-    predicate = SlicePredicate(slice_range=SliceRange(**kwargs))
+    predicate = _multiget_predicate(range_args)
     consistency = consistency or ConsistencyLevel.ONE
+    groups = list(_multiget_groups(keys, chunk_size or MULTIGET_CHUNK_SIZE))
 
-    out = {}
-    for (keyspace, ks_keys) in groupsort(keys, GET_KEYSPACE):
-        client = get_pool(keyspace)
-        out[keyspace] = {}
-        for (colfam, cf_keys) in groupsort(ks_keys, GET_COLFAM):
-
-            if colfam not in keyspace:
-                out[keyspace][colfam] = defaultdict(dict)
-
-            for (supercol, sc_keys) in groupsort(cf_keys, GET_SUPERCOL):
-                records = client.multiget_slice(
-                    keyspace, map(GET_KEY, sc_keys),
-                    ColumnParent(colfam, supercol), predicate, consistency)
-
-                for (row_key, cols) in records.iteritems():
-                    cols = unpack(cols)
-                    if supercol is None:
-                        out[keyspace][colfam][row_key] = cols
-                    else:
-                        out[keyspace][colfam][row_key][supercol] = cols
+    with call_deadline(deadline):
+        results = _get_workers().run_all(
+            partial(_multiget, group, predicate, consistency, get_deadline())
+            for group in groups)
 
+    out = {}
+    for ((keyspace, colfam, supercol, row_keys), records) in \
+            zip(groups, results):
+        _merge_rows(out, keyspace, colfam, supercol, records)
     return out
 
 
+class _Missing(object):
+
+    """The columns list_multigetterator yields for a key with no row."""
+
+    def __nonzero__(self):
+        return False
+
+    def __repr__(self):
+        return "MISSING"
+
+MISSING = _Missing()
+
+
+def _multiget_batch(batch, predicate, consistency, at=None):
+    """Return a Future of the rows for a batch of keys.
+
+    The rows are in a dict keyed by (keyspace, column_family,
+    super_column); each group is fetched concurrently.
+    """
+    groups = list(_multiget_groups(batch))
+    pool = _get_workers()
+    futures = [pool.submit(_multiget, group, predicate, consistency, at)
+               for group in groups]
+    return chain(gather(futures), lambda results: dict(
+            (group[:3], records) for (group, records) in zip(groups, results)))
+
+
+def list_multigetterator(keys, consistency, deadline=None, chunk_size=None,
+                         window=None, **range_args):
+    """Yield (key, columns) for each of keys, in order.
+
+    Keys are read and fetched in batches of chunk_size
+    (MULTIGET_CHUNK_SIZE by default), with up to window batches
+    (MULTIGET_CONCURRENCY by default) fetched ahead of the one being
+    yielded. keys may be any iterable, and is consumed no faster than
+    that, so memory use is bounded however many there are.
+
+    columns is a list of the row's columns, or MISSING if there is no
+    such row. If deadline is given, every request must finish within
+    that many seconds of iteration starting, or ErrorDeadlineExceeded
+    is raised.
+    """
+    predicate = _multiget_predicate(range_args)
+    consistency = consistency or ConsistencyLevel.ONE
+    chunk_size = chunk_size or MULTIGET_CHUNK_SIZE
+    window = window or MULTIGET_CONCURRENCY
+    with call_deadline(deadline):
+        at = get_deadline()
+
+    keys, pending = iter(keys), deque()
+    while True:
+        while len(pending) < window:
+            batch = list(it.islice(keys, chunk_size))
+            if not batch:
+                break
+            pending.append((batch, _multiget_batch(batch, predicate,
+                                                   consistency, at)))
+        if not pending:
+            return
+
+        (batch, future) = pending.popleft()
+        rows = future.result()
+        for key in batch:
+            cols = rows[(key.keyspace, key.column_family,
+                         key.super_column)].get(key.key)
+            yield (key, list(unpack(cols)) if cols else MISSING)
+
+
+def multigetterator_async(keys, consistency, chunk_size=None,
+                          **range_args):
+    """Return a Future of multigetterator's output, without blocking.
+
+    Every multiget_slice is sent at once.
+    """
+    predicate = _multiget_predicate(range_args)
+    consistency = consistency or ConsistencyLevel.ONE
+
+    groups = list(_multiget_groups(keys, chunk_size or MULTIGET_CHUNK_SIZE))
+    futures = [get_async_pool(keyspace).multiget_slice(
+            keyspace, row_keys, ColumnParent(colfam, supercol), predicate,
+            consistency)
+               for (keyspace, colfam, supercol, row_keys) in groups]
+
+    def merge(results):
+        """Merge every group's rows."""
+        out = {}
+        for ((keyspace, colfam, supercol, row_keys), records) in \
+                zip(groups, results):
+            _merge_rows(out, keyspace, colfam, supercol, records)
+        return out
+
+    return chain(gather(futures), merge)
+
+
 def sparse_get(key, columns):
     """Return an iterator over a specific set of columns."""
 
@@ -132,6 +387,57 @@ def key_range_iterator(key, start="", finish="", count=100):
     return (key.clone(key=k) for k in key_range(key, start, finish, count))
 
 
+def range_slice_iterator(key, consistency=None, start="", finish="",
+                         page_size=None, prefetch=False, deadline=None,
+                         **predicate_args):
+    """Yield (Key, columns) for each row in a range of keys.
+
+    key gives the keyspace and column family, and the super column, if
+    any. Rows from start to finish, by default every row in the column
+    family, are fetched with get_range_slice, page_size at a time
+    (RANGE_PAGE_SIZE by default), as the iterator is consumed. If
+    prefetch is True, the next page is fetched in the background while
+    this one is used. Rows with no columns, such as deleted ones, are
+    skipped. predicate_args select the columns, as for slice_iterator.
+
+    If deadline is given, every request must finish within that many
+    seconds of iteration starting, or ErrorDeadlineExceeded is raised.
+    """
+    predicate = _slice_predicate(predicate_args)
+    consistency = consistency or ConsistencyLevel.ONE
+    page_size = page_size or RANGE_PAGE_SIZE
+    parent = ColumnParent(key.column_family, key.super_column)
+    client = get_pool(key.keyspace)
+    with call_deadline(deadline):
+        at = get_deadline()
+
+    def fetch(start_key, count):
+        """Fetch a page of rows."""
+        with until(at):
+            return client.get_range_slice(key.keyspace, parent, predicate,
+                                          start_key, finish, count,
+                                          consistency)
+
+    (last, wanted) = (None, page_size)
+    page = fetch(start, wanted)
+    while True:
+        more = len(page) >= wanted
+        future = None
+        if more and prefetch:
+            future = _get_workers().submit(fetch, page[-1].key,
+                                           page_size + 1)
+
+        # Pages after the first start at the last row seen, inclusive.
+        for row in (page[1:] if page and page[0].key == last else page):
+            if row.columns:
+                yield (key.clone(key=row.key), list(unpack(row.columns)))
+
+        if not more:
+            return
+        (last, wanted) = (page[-1].key, page_size + 1)
+        page = future.result() if future else fetch(last, wanted)
+
+
 def pack(objects):
     """Return a generator which packs objects into ColumnOrSuperColumns."""
     for object_ in objects:
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Concurrency limits.
+
+A Limiter caps the calls a Client has in flight, to the whole cluster
+or to one server. Calls over the limit wait up to `wait' seconds for a
+slot, then are rejected with ErrorOverloaded, which isn't retried;
+when Cassandra slows down, the excess fails quickly instead of
+queueing up in front of it. An AdaptiveLimiter also lowers its limit
+as latency rises.
+"""
+
+from __future__ import with_statement
+import threading
+import time
+
+import lazyboy.exceptions as exc
+
+
+class Limiter(object):
+
+    """Limits calls in flight to `limit'.
+
+    If wait is 0, calls over the limit are rejected at once; if it's
+    None, they wait as long as it takes.
+    """
+
+    def __init__(self, limit, wait=0):
+        assert limit > 0
+        self.limit = limit
+        self.wait = wait
+        self.in_flight = 0
+        self.rejected = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def __repr__(self):
+        return "<%s %d/%d>" % (self.__class__.__name__, self.in_flight,
+                               self.limit)
+
+    def acquire(self, timeout=None):
+        """Take a slot, waiting up to timeout, or self.wait, for one.
+
+        Raises ErrorOverloaded if there's no slot in time.
+        """
+        wait = self.wait
+        if timeout is not None and (wait is None or timeout < wait):
+            wait = max(timeout, 0)
+        give_up = time.time() + wait if wait is not None else None
+        with self._cond:
+            while self.in_flight >= self.limit:
+                now = time.time()
+                if give_up is not None and now >= give_up:
+                    self.rejected += 1
+                    raise exc.ErrorOverloaded(
+                        "%d calls already in flight" % self.in_flight)
+                self._cond.wait(give_up - now if give_up else None)
+            self.in_flight += 1
+            return time.time()
+
+    def release(self, started=None, dropped=False):
+        """Give back a slot.
+
+        started is the value acquire returned, and dropped is True if
+        the call failed in a way which suggests the server is
+        overloaded; if started is None, the call is ignored by
+        adaptive limits.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if started is not None:
+                self._update(started, time.time() - started, dropped)
+            self._cond.notify()
+
+    def _update(self, started, elapsed, dropped):
+        """Adjust the limit after a call. Called with the lock held."""
+        pass
+
+    def reset(self):
+        """Forget calls in flight, as after a fork."""
+        self._cond = threading.Condition(threading.Lock())
+        self.in_flight = 0
+
+
+class AdaptiveLimiter(Limiter):
+
+    """A Limiter which adjusts its limit to latency, AIMD style.
+
+    The limit starts at max_limit. A call which fails, or takes more
+    than `tolerance' times the usual latency, cuts the limit by the
+    `backoff' factor, down to min_limit; other calls raise it by
+    1/limit, so it grows by about one per round trip. Calls which
+    started before the last cut don't cut it again. The usual latency
+    is a slow moving average of the calls which didn't fail.
+    """
+
+    def __init__(self, max_limit, wait=0, min_limit=1, tolerance=2.0,
+                 backoff=0.9, smoothing=0.01):
+        assert 0 < min_limit <= max_limit and 0 < backoff < 1
+        Limiter.__init__(self, max_limit, wait)
+        self.min_limit, self.max_limit = min_limit, max_limit
+        self.tolerance, self.backoff = tolerance, backoff
+        self.smoothing = smoothing
+        self.latency = None
+        self._estimate = float(max_limit)
+        self._cut_at = 0
+
+    def _update(self, started, elapsed, dropped):
+        """Cut the limit after slow or failed calls, otherwise raise it."""
+        if self.latency is None:
+            if dropped:
+                return
+            self.latency = elapsed
+
+        if dropped or elapsed > self.latency * self.tolerance:
+            if started >= self._cut_at:
+                self._estimate = max(self._estimate * self.backoff,
+                                     self.min_limit)
+                self._cut_at = time.time()
+        else:
+            self._estimate = min(self._estimate + 1 / self._estimate,
+                                 self.max_limit)
+        if not dropped:
+            # Slow calls count too, so a lasting change becomes usual.
+            self.latency += (elapsed - self.latency) * self.smoothing
+        self.limit = int(self._estimate)
@@ -0,0 +1,541 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: An in-process, in-memory Cassandra.
+
+MemoryStore implements the Cassandra.Iface calls which Client makes,
+so Records, Views and iterators can be exercised, or benchmarked,
+without a cluster or a network in the way. Columns are kept sorted by
+their column family's comparator, and writes are reconciled by
+timestamp, with deletes winning ties, as Cassandra does. Rows are
+kept in key order, as with the OrderPreservingPartitioner.
+
+To use it, add a pool with a memory:// server:
+
+    connection.add_pool('Keyspace1', ['memory://'])
+
+Every server with the same URL shares a store; 'memory://other' is a
+separate one. Column families are created as they're written to, as
+Standard families compared as bytes, unless they're set up first
+with MemoryStore.define. Consistency levels are ignored.
+"""
+
+from __future__ import with_statement
+import bisect
+import struct
+import threading
+import uuid
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from cassandra import Cassandra
+from cassandra.ttypes import Column, SuperColumn, ColumnOrSuperColumn, \
+    KeySlice, NotFoundException, InvalidRequestException
+
+SCHEME = 'memory://'
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def _long(name):
+    """Sort key for LongType: a big-endian, signed 64 bit integer."""
+    if len(name) != 8:
+        raise InvalidRequestException(
+            why="LongType names must be 8 bytes, not %d" % len(name))
+    return struct.unpack('>q', name)[0]
+
+
+def _uuid(name):
+    """Sort key for LexicalUUIDType."""
+    try:
+        return uuid.UUID(bytes=name)
+    except ValueError:
+        raise InvalidRequestException(why="UUIDs must be 16 bytes")
+
+
+def _time_uuid(name):
+    """Sort key for TimeUUIDType: time first, then the UUID."""
+    value = _uuid(name)
+    return (value.time, value.bytes)
+
+
+COMPARATORS = {'BytesType': str, 'AsciiType': str, 'UTF8Type': str,
+               'LongType': _long, 'LexicalUUIDType': _uuid,
+               'TimeUUIDType': _time_uuid}
+
+
+def _sort_key(comparator):
+    """Return the sort key function for a comparator name or function."""
+    if callable(comparator):
+        return comparator
+    if comparator not in COMPARATORS:
+        raise InvalidRequestException(
+            why="Unknown comparator `%s'" % comparator)
+    return COMPARATORS[comparator]
+
+
+def _copy(column):
+    """Return a copy of a Column, as if it had come over the wire."""
+    return Column(column.name, column.value, column.timestamp)
+
+
+def _wins(new, old):
+    """Return True if Column new supersedes Column old."""
+    return (old is None or new.timestamp > old.timestamp or
+            (new.timestamp == old.timestamp and new.value > old.value))
+
+
+class _Sorted(object):
+
+    """Rows, columns or super columns, kept in comparator order.
+
+    deleted_at is the timestamp of the last deletion of the whole
+    container, and tombstones the timestamps of deleted names. Rows
+    and super columns which are deleted are kept, empty, so their
+    tombstones are, but they aren't counted or sliced.
+    """
+
+    __slots__ = ('sort_key', 'names', 'items', 'deleted_at', 'tombstones')
+
+    def __init__(self, sort_key):
+        self.sort_key = sort_key
+        self.names = []
+        self.items = {}
+        self.deleted_at = None
+        self.tombstones = {}
+
+    def __len__(self):
+        return sum(1 for item in self.items.itervalues() if _live(item))
+
+    def _position(self, name):
+        """Return the index name sorts at."""
+        return bisect.bisect_left(self.names, (self.sort_key(name), name))
+
+    def get(self, name):
+        """Return the item called name, or None if there's none."""
+        item = self.items.get(name)
+        return item if item is not None and _live(item) else None
+
+    def deleted(self, name, timestamp):
+        """Return True if a write of name at timestamp was deleted."""
+        return ((self.deleted_at is not None and
+                 timestamp <= self.deleted_at) or
+                (name in self.tombstones and
+                 timestamp <= self.tombstones[name]))
+
+    def add(self, name, item):
+        """Add an item which isn't here yet."""
+        self.names.insert(self._position(name), (self.sort_key(name), name))
+        self.items[name] = item
+
+    def discard(self, name):
+        """Remove an item, if it's here."""
+        if self.items.pop(name, None) is not None:
+            del self.names[self._position(name)]
+
+    def slice(self, start, finish, reverse, count):
+        """Return up to count names from start to finish.
+
+        Empty start and finish are open ends. When reversed, names are
+        returned in descending order, so start is the high end.
+        """
+        if reverse:
+            low, high = finish, start
+        else:
+            low, high = start, finish
+        first = self._position(low) if low else 0
+        last = (bisect.bisect_right(self.names,
+                                    (self.sort_key(high), high))
+                if high else len(self.names))
+        # Walk the indexes rather than copying the range, so paging
+        # through a wide row costs what each page returns.
+        indexes = (xrange(last - 1, first - 1, -1) if reverse
+                   else xrange(first, last))
+        out = []
+        for index in indexes:
+            if len(out) >= count:
+                break
+            name = self.names[index][1]
+            if _live(self.items[name]):
+                out.append(name)
+        return out
+
+
+def _live(item):
+    """Return True unless item is an empty row or super column."""
+    return not isinstance(item, _Sorted) or bool(item.items)
+
+
+class _Family(object):
+
+    """A column family: its type, comparators and rows."""
+
+    def __init__(self, column_type='Standard', comparator='BytesType',
+                 subcomparator='BytesType'):
+        if column_type not in ('Standard', 'Super'):
+            raise InvalidRequestException(
+                why="Unknown column type `%s'" % column_type)
+        self.column_type = column_type
+        self.comparator, self.subcomparator = comparator, subcomparator
+        self.sort_key = _sort_key(comparator)
+        self.sub_sort_key = _sort_key(subcomparator)
+        self.rows = _Sorted(str)
+
+    def is_super(self):
+        """Return True if this is a super column family."""
+        return self.column_type == 'Super'
+
+    def describe(self):
+        """Return a description, as describe_keyspace does."""
+        out = {'Type': self.column_type,
+               'CompareWith': str(self.comparator)}
+        if self.is_super():
+            out['CompareSubcolumnsWith'] = str(self.subcomparator)
+        return out
+
+
+class MemoryStore(Cassandra.Iface):
+
+    """A Cassandra.Iface which keeps everything in memory.
+
+    It's thread-safe; calls are applied one at a time.
+    """
+
+    def __init__(self):
+        self._families = {}
+        self._lock = threading.RLock()
+
+    def define(self, keyspace, column_family, column_type='Standard',
+               comparator='BytesType', subcomparator='BytesType'):
+        """Set up a column family, with the comparators for its names.
+
+        Comparators are Cassandra's names for them, or functions
+        returning a sort key for a name.
+        """
+        with self._lock:
+            self._families[(keyspace, column_family)] = _Family(
+                column_type, comparator, subcomparator)
+
+    def clear(self):
+        """Forget every column family, and everything in them."""
+        with self._lock:
+            self._families = {}
+
+    def _family(self, keyspace, column_family, is_super=None):
+        """Return a column family, creating it if needed."""
+        if not keyspace or not column_family:
+            raise InvalidRequestException(
+                why="A keyspace and column family are required")
+        family = self._families.get((keyspace, column_family))
+        if family is None:
+            family = self._families[(keyspace, column_family)] = _Family(
+                'Super' if is_super else 'Standard')
+        elif is_super is not None and is_super != family.is_super():
+            raise InvalidRequestException(
+                why="%s is a %s column family" % (column_family,
+                                                  family.column_type))
+        return family
+
+    def _row(self, family, key, create=False):
+        """Return a row's columns, or None if it doesn't exist."""
+        row = family.rows.items.get(key)
+        if row is None and create:
+            row = _Sorted(family.sort_key)
+            family.rows.add(key, row)
+        return row
+
+    def _container(self, family, key, super_column, create=False):
+        """Return the columns for a row, or super column in it."""
+        if super_column is not None and not family.is_super():
+            raise InvalidRequestException(
+                why="Only super column families have super columns")
+        row = self._row(family, key, create)
+        if row is None or super_column is None:
+            return row
+        sup = row.items.get(super_column)
+        if sup is None and create:
+            sup = _Sorted(family.sub_sort_key)
+            sup.deleted_at = row.deleted_at
+            row.add(super_column, sup)
+        return sup
+
+    def _write(self, family, key, super_column, column):
+        """Write a column, if it supersedes what's there."""
+        if column.timestamp is None:
+            raise InvalidRequestException(why="Columns need timestamps")
+        cols = self._container(family, key, super_column, True)
+        if cols.deleted(column.name, column.timestamp):
+            return
+        old = cols.items.get(column.name)
+        if old is None:
+            cols.add(column.name, _copy(column))
+        elif _wins(column, old):
+            cols.items[column.name] = _copy(column)
+
+    def _delete(self, family, key, super_column, column, timestamp):
+        """Delete a row, super column or column as of timestamp."""
+        if column is None and super_column is None:
+            self._purge(self._row(family, key, True), timestamp)
+        elif column is None:
+            if not family.is_super():
+                raise InvalidRequestException(
+                    why="Only super column families have super columns")
+            self._purge(self._container(family, key, super_column, True),
+                        timestamp)
+        else:
+            cols = self._container(family, key, super_column, True)
+            cols.tombstones[column] = max(timestamp,
+                                          cols.tombstones.get(column))
+            old = cols.items.get(column)
+            if old is not None and old.timestamp <= timestamp:
+                cols.discard(column)
+
+    def _purge(self, cols, timestamp):
+        """Delete everything in a row or super column as of timestamp."""
+        cols.deleted_at = max(timestamp, cols.deleted_at)
+        for name in cols.items.keys():
+            item = cols.items[name]
+            if isinstance(item, _Sorted):
+                self._purge(item, timestamp)
+            elif item.timestamp <= timestamp:
+                cols.discard(name)
+
+    def _names(self, cols, predicate):
+        """Return the names in cols which predicate selects."""
+        if predicate.column_names is not None:
+            return [name for name in predicate.column_names
+                    if cols.get(name) is not None]
+        srange = predicate.slice_range
+        if srange is None:
+            raise InvalidRequestException(
+                why="A predicate needs column names or a slice range")
+        return cols.slice(srange.start, srange.finish, srange.reversed,
+                          srange.count)
+
+    def _result(self, item, name):
+        """Return a ColumnOrSuperColumn for a column or super column."""
+        if isinstance(item, _Sorted):
+            return ColumnOrSuperColumn(super_column=SuperColumn(
+                    name, [_copy(item.items[sub])
+                           for (key, sub) in item.names]))
+        return ColumnOrSuperColumn(column=_copy(item))
+
+    def _slice(self, family, key, column_parent, predicate):
+        """Return the ColumnOrSuperColumns of a slice of one row."""
+        cols = self._container(family, key, column_parent.super_column)
+        if cols is None:
+            return []
+        return [self._result(cols.items[name], name)
+                for name in self._names(cols, predicate)]
+
+    # Cassandra.Iface
+
+    def get(self, keyspace, key, column_path, consistency_level=None):
+        with self._lock:
+            family = self._family(keyspace, column_path.column_family)
+            if column_path.column is None:
+                if not family.is_super() or column_path.super_column is None:
+                    raise InvalidRequestException(
+                        why="A column name is required")
+                cols = self._row(family, key)
+                name = column_path.super_column
+            else:
+                cols = self._container(family, key, column_path.super_column)
+                name = column_path.column
+            item = cols.get(name) if cols is not None else None
+            if item is None:
+                raise NotFoundException()
+            return self._result(item, name)
+
+    def get_slice(self, keyspace, key, column_parent, predicate,
+                  consistency_level=None):
+        with self._lock:
+            family = self._family(keyspace, column_parent.column_family)
+            return self._slice(family, key, column_parent, predicate)
+
+    def multiget(self, keyspace, keys, column_path, consistency_level=None):
+        out = {}
+        for key in keys:
+            try:
+                out[key] = self.get(keyspace, key, column_path)
+            except NotFoundException:
+                out[key] = ColumnOrSuperColumn()
+        return out
+
+    def multiget_slice(self, keyspace, keys, column_parent, predicate,
+                       consistency_level=None):
+        with self._lock:
+            family = self._family(keyspace, column_parent.column_family)
+            return dict((key, self._slice(family, key, column_parent,
+                                          predicate))
+                        for key in keys)
+
+    def get_count(self, keyspace, key, column_parent,
+                  consistency_level=None):
+        with self._lock:
+            family = self._family(keyspace, column_parent.column_family)
+            cols = self._container(family, key, column_parent.super_column)
+            return len(cols) if cols is not None else 0
+
+    def get_key_range(self, keyspace, column_family, start="", finish="",
+                      count=100, consistency_level=None):
+        with self._lock:
+            family = self._family(keyspace, column_family)
+            return family.rows.slice(start, finish, False, count)
+
+    def get_range_slice(self, keyspace, column_parent, predicate, start_key,
+                        finish_key, row_count, consistency_level=None):
+        with self._lock:
+            family = self._family(keyspace, column_parent.column_family)
+            return [KeySlice(key, self._slice(family, key, column_parent,
+                                              predicate))
+                    for key in family.rows.slice(start_key, finish_key,
+                                                 False, row_count)]
+
+    def insert(self, keyspace, key, column_path, value, timestamp,
+               consistency_level=None):
+        if column_path.column is None:
+            raise InvalidRequestException(why="A column name is required")
+        with self._lock:
+            family = self._family(keyspace, column_path.column_family,
+                                  column_path.super_column is not None)
+            self._write(family, key, column_path.super_column,
+                        Column(column_path.column, value, timestamp))
+
+    def batch_insert(self, keyspace, key, cfmap, consistency_level=None):
+        with self._lock:
+            for (column_family, cols) in cfmap.iteritems():
+                for col in cols:
+                    self._insert(keyspace, key, column_family, col)
+
+    def _insert(self, keyspace, key, column_family, col):
+        """Write a ColumnOrSuperColumn."""
+        family = self._family(keyspace, column_family,
+                              col.super_column is not None)
+        if col.super_column is not None:
+            for sub in col.super_column.columns:
+                self._write(family, key, col.super_column.name, sub)
+        elif col.column is not None:
+            self._write(family, key, None, col.column)
+        else:
+            raise InvalidRequestException(
+                why="A column or super column is required")
+
+    def batch_mutate(self, keyspace, mutation_map, consistency_level=None):
+        """Apply Mutations, as Cassandra 0.6 does.
+
+        mutation_map maps row keys to dicts of column family names to
+        lists of mutations, each with a column_or_supercolumn to write
+        or a deletion, with a timestamp, optional super_column and a
+        predicate of column_names to delete.
+        """
+        with self._lock:
+            for (key, families) in mutation_map.iteritems():
+                for (column_family, mutations) in families.iteritems():
+                    for mutation in mutations:
+                        self._mutate(keyspace, key, column_family, mutation)
+
+    def _mutate(self, keyspace, key, column_family, mutation):
+        """Apply one Mutation."""
+        col = getattr(mutation, 'column_or_supercolumn', None)
+        if col is not None:
+            return self._insert(keyspace, key, column_family, col)
+
+        deletion = getattr(mutation, 'deletion', None)
+        if deletion is None:
+            raise InvalidRequestException(why="Empty mutation")
+        family = self._family(keyspace, column_family)
+        predicate = getattr(deletion, 'predicate', None)
+        names = predicate and predicate.column_names
+        if not names:
+            return self._delete(family, key, deletion.super_column, None,
+                                deletion.timestamp)
+        for name in names:
+            if family.is_super() and deletion.super_column is None:
+                self._delete(family, key, name, None, deletion.timestamp)
+            else:
+                self._delete(family, key, deletion.super_column, name,
+                             deletion.timestamp)
+
+    def remove(self, keyspace, key, column_path, timestamp,
+               consistency_level=None):
+        with self._lock:
+            family = self._family(keyspace, column_path.column_family)
+            self._delete(family, key, column_path.super_column,
+                         column_path.column, timestamp)
+
+    def get_string_property(self, property):
+        if property == 'token map':
+            return json.dumps({})
+        if property == 'cluster name':
+            return 'Lazyboy memory store'
+        return ''
+
+    def get_string_list_property(self, property):
+        if property == 'keyspaces':
+            return sorted(set(keyspace for (keyspace, column_family)
+                              in self._families))
+        return []
+
+    def describe_keyspace(self, keyspace):
+        with self._lock:
+            out = dict((column_family, family.describe())
+                       for ((name, column_family), family)
+                       in self._families.iteritems() if name == keyspace)
+        if not out:
+            raise NotFoundException()
+        return out
+
+
+class MemoryTransport(object):
+
+    """A transport for a connection which never leaves the process."""
+
+    def __init__(self):
+        self._open = False
+
+    def open(self):
+        """Open the connection."""
+        self._open = True
+
+    def close(self):
+        """Close the connection."""
+        self._open = False
+
+    def isOpen(self):
+        """Return True if the connection is open."""
+        return self._open
+
+
+class MemoryConnection(object):
+
+    """A connection to a MemoryStore, standing in for Cassandra.Client."""
+
+    def __init__(self, store, url=SCHEME):
+        self.store = store
+        self.transport = MemoryTransport()
+        self.host, self.port = url, None
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+
+def get_store(url=SCHEME):
+    """Return the store for a memory:// URL, creating it if needed."""
+    assert url.startswith(SCHEME), "Not a memory:// URL: %s" % url
+    with _STORES_LOCK:
+        if url not in _STORES:
+            _STORES[url] = MemoryStore()
+        return _STORES[url]
+
+
+def connect(url=SCHEME):
+    """Return a new connection to the store for a memory:// URL."""
+    return MemoryConnection(get_store(url), url)
@@ -0,0 +1,597 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Non-blocking client.
+
+AsyncClient speaks the same Thrift protocol as connection.Client, but
+over non-blocking sockets which are all serviced by one event loop
+thread. Every call returns a lazyboy.workers.Future immediately, so a
+single process can keep hundreds of requests in flight without a
+thread for each.
+"""
+
+from __future__ import with_statement
+from collections import deque
+import errno
+import fcntl
+import logging
+import os
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+
+from cassandra import Cassandra
+from thrift.Thrift import TType
+from thrift.protocol import TBinaryProtocol
+from thrift.transport import TTransport
+
+import lazyboy.connection as connection
+import lazyboy.exceptions as exc
+import lazyboy.memory as memory
+from lazyboy.transport import get_transport, get_protocol
+from lazyboy.workers import Future
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+_RECV_SIZE = 65536
+_LOG = logging.getLogger(__name__)
+
+
+def get_pool(name):
+    """Return the shared AsyncClient for the given pool name."""
+    connection.check_fork()
+    key = (os.getpid(), name)
+    if key in _CLIENTS:
+        return _CLIENTS[key]
+
+    with _CLIENTS_LOCK:
+        if key not in _CLIENTS:
+            if name not in connection._SERVERS:
+                raise exc.ErrorCassandraClientNotFound(
+                    "Pool `%s' is not defined." % name)
+            _CLIENTS[key] = AsyncClient(**connection._SERVERS[name])
+        return _CLIENTS[key]
+
+
+def _set_nonblocking(fileno):
+    """Put a file descriptor into non-blocking mode."""
+    flags = fcntl.fcntl(fileno, fcntl.F_GETFL)
+    fcntl.fcntl(fileno, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class EventLoop(object):
+
+    """A select() loop which runs AsyncConnections in one thread."""
+
+    def __init__(self):
+        self._connections = set()
+        self._calls = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._wake_r, self._wake_w = os.pipe()
+        _set_nonblocking(self._wake_r)
+        _set_nonblocking(self._wake_w)
+
+    def call_soon(self, func, *args):
+        """Call func from the loop thread. Safe to call from any thread."""
+        with self._lock:
+            self._calls.append((func, args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="lazyboy-event-loop")
+                self._thread.setDaemon(True)
+                self._thread.start()
+        try:
+            os.write(self._wake_w, "x")
+        except OSError:
+            # The pipe is full, so the loop is waking up anyway.
+            pass
+
+    def add(self, conn):
+        """Start servicing a connection. Call from the loop thread."""
+        self._connections.add(conn)
+
+    def remove(self, conn):
+        """Stop servicing a connection. Call from the loop thread."""
+        self._connections.discard(conn)
+
+    def _run_calls(self):
+        """Run calls queued by call_soon."""
+        with self._lock:
+            calls, self._calls = self._calls, []
+        for (func, args) in calls:
+            func(*args)
+
+    def _run(self):
+        """Service connections until the loop is closed."""
+        while not self._closed:
+            try:
+                self._run_once()
+            except Exception:
+                _LOG.exception("Error in event loop")
+
+    def _run_once(self):
+        """Wait for and handle one round of socket events."""
+        self._run_calls()
+
+        now = time.time()
+        readers, writers, timeout = [self._wake_r], [], None
+        for conn in list(self._connections):
+            if conn.deadline is not None:
+                if conn.deadline <= now:
+                    conn.fail(exc.ErrorThriftMessage(
+                            "Timed out", str(conn)))
+                    continue
+                wait = conn.deadline - now
+                timeout = wait if timeout is None else min(timeout, wait)
+            if conn.wants_write():
+                writers.append(conn)
+            elif conn.wants_read():
+                readers.append(conn)
+
+        try:
+            readable, writable = select.select(readers, writers, [],
+                                               timeout)[:2]
+        except select.error, ex:
+            if ex.args[0] == errno.EINTR:
+                return
+            raise
+
+        for conn in writable:
+            conn.handle_write()
+        for conn in readable:
+            if conn == self._wake_r:
+                self._drain_wakeups()
+            elif conn in self._connections:
+                conn.handle_read()
+
+    def close(self):
+        """Close the wakeup pipe, and every connection's socket."""
+        self._closed = True
+        for conn in list(self._connections):
+            conn.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _drain_wakeups(self):
+        """Empty the wakeup pipe."""
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except OSError:
+            pass
+
+
+# _MessageScanner's stack entries
+(_HEADER, _STRUCT, _VALUE, _BYTES, _SEQ) = range(5)
+_FIXED = {TType.BOOL: 1, TType.BYTE: 1, TType.I16: 2, TType.I32: 4,
+          TType.I64: 8, TType.DOUBLE: 8}
+
+
+class _MessageScanner(object):
+
+    """Finds the end of a binary protocol message, as it arrives.
+
+    An unframed message's length isn't sent, so it's found by walking
+    its fields. scan is given the whole buffer each time, and picks up
+    where it left off, so however the message is split up, each byte
+    is only looked at once.
+    """
+
+    def __init__(self):
+        self.pos = 0
+        self.stack = [[_HEADER]]
+
+    def scan(self, buf):
+        """Return True once buf, a bytearray, holds the whole message.
+
+        A malformed message is reported as whole, so decoding it
+        raises the error.
+        """
+        (stack, pos, end) = (self.stack, self.pos, len(buf))
+        unpack = struct.unpack_from
+        while stack:
+            top = stack[-1]
+            kind = top[0]
+            if kind == _STRUCT or kind == _SEQ:
+                if kind == _STRUCT:
+                    if pos >= end:
+                        break
+                    ttype = buf[pos]
+                    if ttype == TType.STOP:
+                        pos += 1
+                        stack.pop()
+                        continue
+                    if pos + 3 > end:
+                        break
+                    pos += 3
+                else:
+                    (types, left, index) = top[1:]
+                    if not left:
+                        stack.pop()
+                        continue
+                    top[2:] = [left - 1, index + 1]
+                    ttype = types[index % len(types)]
+
+                # Most values are skipped here, without a stack entry.
+                if ttype in _FIXED:
+                    pos += _FIXED[ttype]
+                    if pos > end:
+                        stack.append([_BYTES, pos - end])
+                        pos = end
+                elif ttype == TType.STRING and pos + 4 <= end:
+                    pos += 4 + max(unpack("!i", buf, pos)[0], 0)
+                    if pos > end:
+                        stack.append([_BYTES, pos - end])
+                        pos = end
+                elif ttype == TType.STRUCT:
+                    stack.append([_STRUCT])
+                else:
+                    stack.append([_VALUE, ttype])
+            elif kind == _BYTES:
+                if pos + top[1] > end:
+                    top[1] -= end - pos
+                    pos = end
+                    break
+                pos += top[1]
+                stack.pop()
+            elif kind == _VALUE:
+                ttype = top[1]
+                if ttype == TType.STRING:
+                    if pos + 4 > end:
+                        break
+                    stack[-1] = [_BYTES, max(unpack("!i", buf, pos)[0], 0)]
+                    pos += 4
+                elif ttype == TType.MAP:
+                    if pos + 6 > end:
+                        break
+                    (ktype, vtype, size) = unpack("!bbi", buf, pos)
+                    stack[-1] = [_SEQ, (ktype, vtype), max(size, 0) * 2, 0]
+                    pos += 6
+                elif ttype in (TType.LIST, TType.SET):
+                    if pos + 5 > end:
+                        break
+                    (etype, size) = unpack("!bi", buf, pos)
+                    stack[-1] = [_SEQ, (etype,), max(size, 0), 0]
+                    pos += 5
+                else:
+                    # Unknown; let the decoder complain.
+                    del stack[:]
+            else:
+                if pos + 8 > end:
+                    break
+                (word, size) = unpack("!ii", buf, pos)
+                # A strict header starts with the version, then the
+                # name; an old one with the name, then the type.
+                length = (12 + size) if word < 0 else (9 + word)
+                if pos + length > end:
+                    break
+                pos += length
+                stack[-1] = [_STRUCT]
+        self.pos = pos
+        return not stack
+
+
+class AsyncConnection(object):
+
+    """A non-blocking connection to one server, with one call in flight."""
+
+    def __init__(self, host, loop, timeout=None, on_idle=None, framed=False,
+                 protocol=None):
+        self.host, self.loop = host, loop
+        self.timeout = timeout
+        self.framed = framed
+        self.protocol = protocol or get_protocol('accelerated')
+        self.deadline = None
+        self._on_idle = on_idle
+        self._sock = None
+        self._connecting = False
+        self._wbuf = ""
+        self._rbuf = bytearray()
+        self._scanner = None
+        self._method = self._future = None
+
+    def __str__(self):
+        return str(self.host)
+
+    def fileno(self):
+        """Return the socket's file descriptor, for select()."""
+        return self._sock.fileno()
+
+    def busy(self):
+        """Return True if a call is in flight."""
+        return self._future is not None
+
+    def wants_write(self):
+        """Return True if the connection has something to write."""
+        return self._connecting or bool(self._wbuf)
+
+    def wants_read(self):
+        """Return True if the connection is waiting for a response."""
+        return self.busy() and not self.wants_write()
+
+    def _connect(self):
+        """Start connecting to the server."""
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setblocking(0)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        err = self._sock.connect_ex((self.host.host, int(self.host.port)))
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            raise socket.error(err, os.strerror(err))
+        self._connecting = True
+        self.loop.add(self)
+
+    def send(self, method, args, kwargs, future):
+        """Send a call. Must be called from the loop thread."""
+        assert not self.busy()
+        wbuf = TTransport.TMemoryBuffer()
+        client = Cassandra.Client(self.protocol(wbuf))
+        try:
+            getattr(client, 'send_' + method)(*args, **kwargs)
+        except Exception:
+            future.set_exception(sys.exc_info())
+            self.loop.call_soon(self._idle)
+            return
+
+        self._method, self._future = method, future
+        self._wbuf, self._rbuf = wbuf.getvalue(), bytearray()
+        if not self.framed and issubclass(self.protocol,
+                                          TBinaryProtocol.TBinaryProtocol):
+            self._scanner = _MessageScanner()
+        if self.framed:
+            self._wbuf = struct.pack("!i", len(self._wbuf)) + self._wbuf
+        self.deadline = (time.time() + self.timeout / 1000.0
+                         if self.timeout else None)
+        if self._sock is None:
+            try:
+                self._connect()
+            except socket.error, ex:
+                # Fail it on the next pass, so a dead server doesn't
+                # recurse through every waiting call.
+                self.loop.call_soon(self.fail, exc.ErrorConnectionFailed(
+                        ex.args[-1], str(self)))
+
+    def handle_write(self):
+        """Finish connecting, or write some of the call."""
+        if self._connecting:
+            err = self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                self.fail(exc.ErrorConnectionFailed(os.strerror(err),
+                                                    str(self)))
+                return
+            self._connecting = False
+
+        try:
+            if self._wbuf:
+                sent = self._sock.send(self._wbuf)
+                self._wbuf = self._wbuf[sent:]
+        except socket.error, ex:
+            if ex.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self.fail(exc.ErrorThriftMessage(ex.args[-1], str(self)))
+
+    def handle_read(self):
+        """Read some of the response, finishing the call if it's all here."""
+        # Read until the socket is drained, so a response whose end
+        # can't be found as it arrives is only decoded once per wakeup.
+        while True:
+            try:
+                data = self._sock.recv(_RECV_SIZE)
+            except socket.error, ex:
+                if ex.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.fail(exc.ErrorThriftMessage(ex.args[-1], str(self)))
+                    return
+                break
+
+            if not data:
+                self.fail(exc.ErrorThriftMessage("Connection closed",
+                                                 str(self)))
+                return
+            self._rbuf.extend(data)
+            if len(data) < _RECV_SIZE:
+                break
+
+        if self._complete():
+            self._decode()
+
+    def _complete(self):
+        """Return True if the whole response may have arrived.
+
+        Framed responses give their length, and the end of a binary
+        protocol response is found as it arrives. Others are decoded
+        whenever the server stops sending, and raise EOFError if
+        they're incomplete.
+        """
+        data = self._rbuf
+        if self.framed:
+            return (len(data) >= 4 and
+                    len(data) >= 4 + struct.unpack_from("!i", data)[0])
+        if self._scanner is not None:
+            return self._scanner.scan(data)
+        return True
+
+    def _decode(self):
+        """Finish the call, if the whole response has arrived."""
+        data = str(self._rbuf)
+        if self.framed:
+            data = data[4:]
+
+        rbuf = TTransport.TMemoryBuffer(data)
+        client = Cassandra.Client(self.protocol(rbuf))
+        try:
+            result = getattr(client, 'recv_' + self._method)()
+        except EOFError:
+            return
+        except Exception:
+            self._finish().set_exception(sys.exc_info())
+        else:
+            self._finish().set_result(result)
+
+    def _finish(self):
+        """Clear the call in flight, returning its Future."""
+        future = self._future
+        self._method = self._future = self.deadline = None
+        self._rbuf, self._scanner = bytearray(), None
+        self._idle()
+        return future
+
+    def _idle(self):
+        """Tell the owner this connection is free."""
+        if self._on_idle:
+            self._on_idle(self)
+
+    def close(self):
+        """Close the socket, without failing the call in flight."""
+        if self._sock:
+            self._sock.close()
+        self._sock = None
+
+    def fail(self, ex):
+        """Close the connection, failing the call in flight."""
+        self.loop.remove(self)
+        if self._sock:
+            self._sock.close()
+        self._sock, self._connecting, self._wbuf = None, False, ""
+        if self._future:
+            self._finish().set_exception(ex)
+
+
+class _AsyncHost(object):
+
+    """The connections to one server, and the calls waiting for one."""
+
+    def __init__(self, host, port, loop, max_size=32, timeout=None,
+                 framed=False, protocol=None):
+        self.host, self.port = host, port
+        self.loop, self.max_size = loop, max_size
+        self.timeout = timeout
+        self.framed, self.protocol = framed, protocol
+        self._idle, self._all = [], []
+        self._waiting = deque()
+
+    def __str__(self):
+        return "%s:%s" % (self.host, self.port)
+
+    def call(self, method, args, kwargs, future):
+        """Send a call, or queue it until a connection is free."""
+        if self._idle:
+            self._idle.pop().send(method, args, kwargs, future)
+        elif len(self._all) < self.max_size:
+            conn = AsyncConnection(self, self.loop, self.timeout,
+                                   self._conn_idle, self.framed,
+                                   self.protocol)
+            self._all.append(conn)
+            conn.send(method, args, kwargs, future)
+        else:
+            self._waiting.append((method, args, kwargs, future))
+
+    def _conn_idle(self, conn):
+        """Hand a free connection the next waiting call."""
+        if self._waiting:
+            conn.send(*self._waiting.popleft())
+        else:
+            self._idle.append(conn)
+
+
+class _MemoryHost(object):
+
+    """A memory:// store, called straight from the loop thread."""
+
+    def __init__(self, url):
+        self.url = url
+        self.store = memory.get_store(url)
+
+    def __str__(self):
+        return self.url
+
+    def call(self, method, args, kwargs, future):
+        """Make a call, and finish its Future."""
+        try:
+            result = getattr(self.store, method)(*args, **kwargs)
+        except Exception, ex:
+            future.set_exception(ex)
+        else:
+            future.set_result(result)
+
+
+class AsyncClient(object):
+
+    """A non-blocking Cassandra client.
+
+    Calls are spread round-robin over the servers, with up to
+    pool_max connections to each; calls beyond that wait in a queue.
+    Every Cassandra method is available, and returns a Future. The
+    transport and protocol are named as for connection.Client.
+    """
+
+    def __init__(self, servers, timeout=None, pool_max=32, loop=None,
+                 transport='buffered', protocol='accelerated', **kwargs):
+        self._loop = loop or _LOOP
+        framed = get_transport(transport) is TTransport.TFramedTransport
+        protocol = get_protocol(protocol)
+        self._hosts = []
+        for server in servers:
+            if server.startswith(memory.SCHEME):
+                self._hosts.append(_MemoryHost(server))
+                continue
+            (host, port) = server.split(":")
+            self._hosts.append(_AsyncHost(host, port, self._loop, pool_max,
+                                          timeout, framed, protocol))
+        self._next = 0
+
+    def list_servers(self):
+        """Return all servers we know about."""
+        return self._hosts
+
+    def call(self, method, *args, **kwargs):
+        """Call a Cassandra method, returning a Future of its result."""
+        if not self._hosts:
+            raise exc.ErrorCassandraNoServersConfigured()
+
+        future = Future()
+        self._loop.call_soon(self._dispatch, method, args, kwargs, future)
+        return future
+
+    def _dispatch(self, method, args, kwargs, future):
+        """Send a call to the next server. Runs in the loop thread."""
+        self._next = (self._next + 1) % len(self._hosts)
+        self._hosts[self._next].call(method, args, kwargs, future)
+
+
+def _async_method(name):
+    """Return an AsyncClient method which calls a Cassandra method."""
+
+    def __method__(self, *args, **kwargs):
+        """Call a Cassandra method, returning a Future of its result."""
+        return self.call(name, *args, **kwargs)
+
+    __method__.__name__ = name
+    __method__.__doc__ = getattr(Cassandra.Iface, name).__doc__
+    return __method__
+
+
+for _name in dir(Cassandra.Iface):
+    if not _name.startswith('_'):
+        setattr(AsyncClient, _name, _async_method(_name))
+
+_LOOP = EventLoop()
+
+
+@connection.register_after_fork
+def _after_fork():
+    """Replace the parent's event loop, whose thread isn't running here.
+
+    Its sockets are closed, which sends nothing while the parent still
+    has them open.
+    """
+    global _LOOP, _CLIENTS_LOCK
+    _CLIENTS_LOCK = threading.Lock()
+    _CLIENTS.clear()
+    (loop, _LOOP) = (_LOOP, EventLoop())
+    loop.close()
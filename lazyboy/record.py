@@ -7,16 +7,18 @@
 
 import time
 import copy
+from functools import partial
 from itertools import ifilterfalse as filternot
 
 from cassandra.ttypes import Column, SuperColumn
 
-from lazyboy.connection import get_pool
+from lazyboy.connection import get_pool, deadline as call_deadline
 from lazyboy.base import CassandraBase
 from lazyboy.key import Key
 import lazyboy.iterators as iterators
 import lazyboy.exceptions as exc
 import lazyboy.util as util
+from lazyboy.workers import chain, gather
 
 
 class Record(CassandraBase, dict):
@@ -190,17 +192,35 @@ class Record(CassandraBase, dict):
                 'changed': tuple(self._columns[key]
                                  for key in self._modified.keys())}
 
-    def load(self, key, consistency=None, **predicate_args):
-        """Load this record from primary key"""
+    def load(self, key, consistency=None, deadline=None, **predicate_args):
+        """Load this record from primary key
+
+        If deadline is given, the load must finish within that many
+        seconds, retries included, or ErrorDeadlineExceeded is raised."""
+        if not isinstance(key, Key):
+            key = self.make_key(key)
+
+        self._clean()
+        consistency = consistency or self.consistency
+        with call_deadline(deadline):
+            return self._inject(key, iterators.slice_iterator(
+                    key, consistency, **predicate_args))
+
+    def load_async(self, key, consistency=None, **predicate_args):
+        """Load this record from primary key without blocking.
+
+        Returns a Future of this record."""
         if not isinstance(key, Key):
             key = self.make_key(key)
 
         self._clean()
         consistency = consistency or self.consistency
-        return self._inject(key, iterators.slice_iterator(key, consistency, **predicate_args))
+        return chain(iterators.slice_iterator_async(key, consistency,
+                                                    **predicate_args),
+                     partial(self._inject, key))
 
-    def save(self, consistency=None):
-        """Save the record, returns self."""
+    def _prepare_save(self):
+        """Check the record can be saved, returning the changes to save."""
         if not self.valid():
             raise exc.ErrorMissingField("Missing required field(s):",
                                         self.missing())
@@ -209,9 +229,31 @@ class Record(CassandraBase, dict):
             self.key = self.default_key()
 
         assert isinstance(self.key, Key), "Bad record key in save()"
+        return self._marshal()
+
+    def _saved(self):
+        """Clean up internal state after a save, returning self."""
+        self._modified.clear()
+        self._deleted.clear()
+        self._original = copy.copy(self._columns)
+        return self
+
+    def save(self, consistency=None, deadline=None):
+        """Save the record, returns self.
 
+        If deadline is given, the record, its mirrors and indexes must
+        all be saved within that many seconds, or ErrorDeadlineExceeded
+        is raised."""
         # Marshal and save changes
-        changes = self._marshal()
+        changes = self._prepare_save()
+        with call_deadline(deadline):
+            self._save(changes, consistency)
+
+        # Clean up internal state
+        return self._saved()
+
+    def _save(self, changes, consistency=None):
+        """Save the record, its mirrors and indexes."""
         self._save_internal(self.key, changes, consistency)
 
         try:
@@ -230,12 +272,32 @@ class Record(CassandraBase, dict):
                 self._modified.clear()
             self._original = copy.deepcopy(self._columns)
 
-        # Clean up internal state
-        self._modified.clear()
-        self._deleted.clear()
-        self._original = copy.copy(self._columns)
+    def save_async(self, consistency=None):
+        """Save the record without blocking.
+
+        The record, its mirrors and indexes are all written at once.
+        Returns a Future of this record."""
+        changes = self._prepare_save()
+        futures = [self._save_internal_async(self.key, changes, consistency)]
+        futures.extend(self._save_internal_async(mirror.mirror_key(self),
+                                                 changes, consistency)
+                       for mirror in self.get_mirrors())
+        futures.extend(index.append_async(self)
+                       for index in self.get_indexes())
+        return chain(gather(futures), lambda results: self._saved())
+
+    def _save_internal_async(self, key, changes, consistency=None):
+        """Internal non-blocking save method. Returns a Future."""
+        consistency = consistency or self.consistency
+        client = self._get_async_cas(key.keyspace)
+        futures = [client.remove(key.keyspace, key.key, path,
+                                 self.timestamp(), consistency)
+                   for path in changes['deleted']]
 
-        return self
+        if changes['changed']:
+            futures.append(client.batch_insert(*self._get_batch_args(
+                        key, changes['changed'], consistency)))
+        return gather(futures)
 
     def _save_internal(self, key, changes, consistency=None):
         """Internal save method."""
@@ -298,6 +360,6 @@ class MirroredRecord(Record):
         assert isinstance(parent_record, Record)
         raise exc.ErrorMissingKey("Please implement a mirror_key method.")
 
-    def save(self, consistency=None):
+    def save(self, consistency=None, deadline=None):
         """Refuse to save this record."""
         raise exc.ErrorImmutable("Mirrored records are immutable.")
@@ -11,6 +11,7 @@ from lazyboy.key import Key
 import lazyboy.iterators as itr
 from lazyboy.record import Record
 from lazyboy.base import CassandraBase
+from lazyboy.connection import deadline as call_deadline
 from lazyboy.exceptions import ErrorMissingField
 
 
@@ -53,9 +54,12 @@ class RecordSet(CassandraBase, dict):
         """Append a new record to the set."""
         return self.__setitem__(record.key.key, record)
 
-    def save(self, consistency=None):
+    def save(self, consistency=None, deadline=None):
         """Save all records.
 
+        If deadline is given, every record must be saved within that
+        many seconds, in all.
+
         FIXME: This is really pretty terrible, but until we have batch
         delete and row-spanning mutations, this is as good as it can
         be. Except for SuperColumns."""
@@ -66,25 +70,32 @@ class RecordSet(CassandraBase, dict):
             raise ErrorMissingField("Missing required field(s):",
                                     missing(records))
 
-        for record in records:
-            record.save(consistency)
+        with call_deadline(deadline):
+            for record in records:
+                record.save(consistency)
         return self
 
 
 class KeyRecordSet(RecordSet):
     """A set of Records defined by record key. Records are batch loaded."""
 
-    def __init__(self, keys=None, record_class=None, consistency=None):
-        """Initialize the set."""
+    def __init__(self, keys=None, record_class=None, consistency=None,
+                 deadline=None):
+        """Initialize the set.
+
+        If deadline is given, the records must be loaded within that
+        many seconds."""
         record_class = record_class or Record
-        records = (self._batch_load(record_class, keys, consistency)
+        records = (self._batch_load(record_class, keys, consistency,
+                                    deadline)
                    if keys else None)
         RecordSet.__init__(self, records)
 
-    def _batch_load(self, record_class, keys, consistency=None):
+    def _batch_load(self, record_class, keys, consistency=None,
+                    deadline=None):
         """Return an iterator of records for the given keys."""
         consistency = consistency or self.consistency
-        data = itr.multigetterator(keys, consistency)
+        data = itr.multigetterator(keys, consistency, deadline)
         for (keyspace, col_fams) in data.iteritems():
             for (col_fam, rows) in col_fams.iteritems():
                 for (row_key, cols) in rows.iteritems():
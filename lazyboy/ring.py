@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Client-side view of the Cassandra token ring."""
+
+import bisect
+try:
+    import hashlib
+    _md5 = hashlib.md5
+except ImportError:
+    import md5
+    _md5 = md5.new
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import lazyboy.exceptions as exc
+
+
+def random_token(key):
+    """Return the RandomPartitioner token for a row key.
+
+    This is the absolute value of the MD5 digest of the key, read as a
+    signed, big-endian integer, as Java's BigInteger does.
+    """
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    token = long(_md5(key).hexdigest(), 16)
+    if token >= 2 ** 127:
+        token -= 2 ** 128
+    return abs(token)
+
+
+def order_preserving_token(key):
+    """Return the OrderPreservingPartitioner token for a row key."""
+    return key.decode('utf-8') if isinstance(key, str) else key
+
+
+PARTITIONERS = {
+    'RandomPartitioner': (random_token, long),
+    'OrderPreservingPartitioner': (order_preserving_token, unicode),
+    'CollatingOrderPreservingPartitioner': (order_preserving_token, unicode)}
+
+
+class TokenRing(object):
+
+    """A map of tokens to the servers which own them."""
+
+    def __init__(self, token_map, partitioner='RandomPartitioner'):
+        """Initialize the ring.
+
+        token_map is a dict of {token: endpoint}, or the JSON from
+        get_string_property('token map').
+        """
+        partitioner = partitioner.split('.')[-1]
+        if partitioner not in PARTITIONERS:
+            raise exc.ErrorNotSupported(
+                "Unknown partitioner `%s'" % partitioner)
+        self._token_func, parse = PARTITIONERS[partitioner]
+
+        if isinstance(token_map, basestring):
+            token_map = json.loads(token_map)
+
+        ring = sorted((parse(token), endpoint)
+                      for (token, endpoint) in token_map.iteritems())
+        self.tokens = [token for (token, endpoint) in ring]
+        self.endpoints = [endpoint for (token, endpoint) in ring]
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def token(self, key):
+        """Return the token for a row key."""
+        return self._token_func(key)
+
+    def owner_index(self, key):
+        """Return the index of the endpoint which owns key.
+
+        A node owns the keys with tokens after its predecessor's token,
+        up to and including its own.
+        """
+        return bisect.bisect_left(self.tokens, self.token(key)) % len(self)
+
+    def owners(self, key):
+        """Return endpoints in ring order, starting with the key's owner."""
+        if not self.tokens:
+            return []
+        index = self.owner_index(key)
+        return self.endpoints[index:] + self.endpoints[:index]
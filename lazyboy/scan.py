@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Parallel scans of whole column families.
+
+parallel_scan splits a column family's keys into ranges, and scans
+each with get_range_slice in its own worker process, so decoding and
+processing rows isn't held up by the interpreter lock. It's meant for
+offline jobs, such as reindexing and exports.
+
+Ranges of keys are only meaningful with an order-preserving
+partitioner, which is what Cassandra needs for range scans.
+"""
+
+import cPickle as pickle
+import logging
+import multiprocessing
+import Queue
+
+from cassandra.ttypes import ConsistencyLevel
+
+from lazyboy.connection import get_pool
+from lazyboy.iterators import range_slice_iterator
+from lazyboy.key import Key
+from lazyboy.ring import TokenRing
+
+_LOG = logging.getLogger(__name__)
+
+# The number of keys split_range reads to choose split points, when
+# the token map can't be used
+SAMPLE_SIZE = 10000
+
+# The most results a worker sends back at once, when there's no reducer
+RESULT_BATCH = 100
+
+# The queue results come back to the parent on, in worker processes
+_RESULTS = None
+
+
+def _spread(points, count):
+    """Return count of points, evenly spaced through them."""
+    if len(points) <= count:
+        return list(points)
+    return [points[(n + 1) * len(points) // (count + 1)]
+            for n in range(count)]
+
+
+def _token_points(client, start, finish):
+    """Return the ring's tokens between start and finish, as keys.
+
+    Returns an empty list if the partitioner doesn't preserve order,
+    or the token map isn't available.
+    """
+    if client.partitioner().split('.')[-1] == 'RandomPartitioner':
+        return []
+    try:
+        ring = TokenRing(client.get_string_property('token map'),
+                         client.partitioner())
+    except Exception, ex:
+        _LOG.warn("Couldn't read the token map: %s", ex)
+        return []
+
+    tokens = (token.encode('utf-8') for token in ring.tokens)
+    return [token for token in tokens
+            if token > start and (not finish or token < finish)]
+
+
+def _sampled_points(client, key, start, finish, sample_size):
+    """Return up to sample_size keys between start and finish."""
+    keys = client.get_key_range(key.keyspace, key.column_family, start,
+                                finish, sample_size, ConsistencyLevel.ONE)
+    return [row_key for row_key in keys
+            if row_key > start and (not finish or row_key < finish)]
+
+
+def split_range(key, count, start="", finish="", sample_size=None):
+    """Return up to count (start, finish) ranges covering start to finish.
+
+    key gives the keyspace and column family. The ranges are split at
+    the ring's tokens, if the partitioner preserves order and there
+    are enough of them. Otherwise, they're split evenly through a
+    sample of the first sample_size keys (SAMPLE_SIZE by default); if
+    there are more keys than that, the last range holds the rest.
+
+    Each range's finish is the next one's start; both ends of a range
+    are inclusive.
+    """
+    client = get_pool(key.keyspace)
+    points = _token_points(client, start, finish)
+    if len(points) < count - 1:
+        points = _sampled_points(client, key, start, finish,
+                                 sample_size or SAMPLE_SIZE)
+
+    points = [start] + _spread(points, count - 1) + [finish]
+    return zip(points[:-1], points[1:])
+
+
+def _set_results(queue):
+    """Set the queue a worker process sends results on."""
+    global _RESULTS
+    _RESULTS = queue
+
+
+def _send(batch):
+    """Send a batch of results to the parent, or None when a range ends.
+
+    Batches are pickled here, so a result which can't be is an error
+    in the scan, rather than being dropped by the queue's thread.
+    """
+    _RESULTS.put(pickle.dumps(batch, pickle.HIGHEST_PROTOCOL))
+
+
+def _scan_range(task):
+    """Scan one range of keys, in a worker process.
+
+    Returns the number of rows scanned, whether func returned
+    anything, and its results folded with reducer. Without a reducer,
+    results are sent to the parent as they're found, RESULT_BATCH at
+    a time.
+    """
+    (key_args, start, finish, exclusive, func, reducer, scan_args) = task
+    (rows, found, result, batch) = (0, False, None, [])
+    try:
+        for (key, cols) in range_slice_iterator(Key(**key_args), start=start,
+                                                finish=finish, **scan_args):
+            # The start of each range after the first is the previous
+            # one's finish.
+            if exclusive and key.key == start:
+                continue
+            rows += 1
+            value = func(key, cols)
+            if value is None:
+                continue
+            if reducer:
+                result = reducer(result, value) if found else value
+            else:
+                batch.append(value)
+                if len(batch) >= RESULT_BATCH:
+                    (batch, sent) = ([], batch)
+                    _send(sent)
+            found = True
+        if batch:
+            _send(batch)
+    finally:
+        _send(None)
+    return (rows, found, result)
+
+
+def parallel_scan(key, func, reducer=None, callback=None, processes=None,
+                  splits=None, start="", finish="", sample_size=None,
+                  **scan_args):
+    """Call func with every row in a range of keys, in worker processes.
+
+    key gives the keyspace and column family, and the super column, if
+    any. The keys from start to finish, by default every key in the
+    column family, are split into splits ranges (four per process by
+    default; see split_range), which are scanned by processes worker
+    processes (one per CPU by default). scan_args are passed on to
+    range_slice_iterator, which scans each range.
+
+    func is called with the (Key, columns) of each row. Whatever it
+    returns, other than None, is combined with reducer, which is
+    called with two results and returns their combination, and the
+    combined result of every row is returned. Without a reducer, the
+    results are passed to callback, in this process, as the workers
+    find them, and the number of rows scanned is returned.
+
+    func, reducer and the values func returns must be picklable, so
+    functions must be defined at the top level of a module.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    ranges = split_range(key, splits or processes * 4, start, finish,
+                         sample_size)
+    key_args = dict(keyspace=key.keyspace, column_family=key.column_family,
+                    super_column=key.super_column)
+    scan_args.setdefault('prefetch', True)
+    tasks = [(key_args, range_start, range_finish, index > 0, func, reducer,
+              scan_args)
+             for (index, (range_start, range_finish)) in enumerate(ranges)]
+
+    # A bounded queue holds workers back if callback is slow.
+    results = multiprocessing.Queue(processes * 2)
+    pool = multiprocessing.Pool(processes, _set_results, (results,))
+    try:
+        scans = pool.map_async(_scan_range, tasks)
+        ended = 0
+        while ended < len(tasks):
+            try:
+                batch = pickle.loads(results.get(timeout=0.1))
+            except Queue.Empty:
+                if scans.ready() and not scans.successful():
+                    scans.get()
+                continue
+            if batch is None:
+                ended += 1
+            elif callback:
+                for value in batch:
+                    callback(value)
+
+        (total, found, result) = (0, False, None)
+        for (rows, range_found, range_result) in scans.get():
+            total += rows
+            if reducer and range_found:
+                result = (reducer(result, range_result) if found
+                          else range_result)
+                found = True
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return result if reducer else total
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Call statistics.
+
+Every Client keeps a Stats, which counts calls, errors and retries for
+each method and server, and keeps a latency histogram of each. Stats
+are cheap enough to leave on all the time; listeners, such as
+SlowCallLogger, are told about every call, and decide for themselves
+what's worth the cost of looking at.
+"""
+
+from __future__ import with_statement
+import bisect
+import logging
+import random
+import threading
+
+# Bucket upper bounds, in seconds: 0.1ms to ~100s, each 20% wider.
+BUCKETS = [0.0001 * 1.2 ** n for n in range(77)]
+PERCENTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+
+
+class Histogram(object):
+
+    """A latency histogram with fixed, exponentially sized buckets.
+
+    Percentiles are reported as the upper bound of the bucket they
+    fall in, so they're accurate to within 20%; the maximum is exact.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed):
+        """Record a latency, in seconds."""
+        self.counts[bisect.bisect_left(BUCKETS, elapsed)] += 1
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    def merge(self, other):
+        """Add the samples from another histogram to this one."""
+        for (index, count) in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, fraction):
+        """Return the latency which fraction of samples are within."""
+        if not self.count:
+            return 0.0
+        wanted, seen = fraction * self.count, 0
+        for (index, count) in enumerate(self.counts):
+            seen += count
+            if seen >= wanted and count:
+                return min(BUCKETS[index], self.max) \
+                    if index < len(BUCKETS) else self.max
+        return self.max
+
+    def summary(self):
+        """Return a dict of the count, mean, percentiles and maximum."""
+        out = dict((name, self.percentile(fraction))
+                   for (name, fraction) in PERCENTILES)
+        out.update(count=self.count, max=self.max,
+                   mean=self.total / self.count if self.count else 0.0)
+        return out
+
+
+class _Entry(object):
+
+    """The statistics for one method on one server."""
+
+    __slots__ = ('calls', 'errors', 'latency')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = {}
+        self.latency = Histogram()
+
+
+class Stats(object):
+
+    """Counters and latency histograms for a Client's calls.
+
+    Listeners are called with (method, server, elapsed, exception,
+    args, kwargs) after every call; exception is None if it succeeded.
+    """
+
+    def __init__(self, listeners=None):
+        self.listeners = list(listeners or ())
+        self._entries = {}
+        self._retries = {}
+        self._lock = threading.Lock()
+
+    def record(self, method, server, elapsed, ex=None, args=(), kwargs=None):
+        """Record a call."""
+        with self._lock:
+            entry = self._entries.get((method, server))
+            if entry is None:
+                entry = self._entries[(method, server)] = _Entry()
+            entry.calls += 1
+            entry.latency.record(elapsed)
+            if ex is not None:
+                name = ex.__class__.__name__
+                entry.errors[name] = entry.errors.get(name, 0) + 1
+
+        for listener in self.listeners:
+            try:
+                listener(method, server, elapsed, ex, args, kwargs or {})
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    "Error in stats listener %r", listener)
+
+    def retry(self, method):
+        """Record a retry of a call."""
+        with self._lock:
+            self._retries[method] = self._retries.get(method, 0) + 1
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._entries, self._retries = {}, {}
+
+    def snapshot(self):
+        """Return the statistics so far, as a dict of dicts.
+
+        Each method maps to its total calls, errors by exception class,
+        retries and latency summary, with the same for each server
+        under 'servers'. Latencies are in seconds.
+        """
+        with self._lock:
+            entries = [(method, server, entry.calls, dict(entry.errors),
+                        _copy(entry.latency))
+                       for ((method, server), entry)
+                       in self._entries.iteritems()]
+            retries = dict(self._retries)
+
+        out = {}
+        for (method, server, calls, errors, latency) in entries:
+            totals = out.get(method)
+            if totals is None:
+                totals = out[method] = {
+                    'calls': 0, 'errors': {}, 'servers': {},
+                    'retries': retries.pop(method, 0),
+                    'latency': Histogram()}
+            totals['calls'] += calls
+            for (name, count) in errors.iteritems():
+                totals['errors'][name] = totals['errors'].get(name, 0) + count
+            totals['latency'].merge(latency)
+            totals['servers'][server] = {'calls': calls, 'errors': errors,
+                                         'latency': latency.summary()}
+
+        for (method, count) in retries.iteritems():
+            out[method] = {'calls': 0, 'errors': {}, 'servers': {},
+                           'retries': count, 'latency': Histogram()}
+
+        for totals in out.itervalues():
+            totals['latency'] = totals['latency'].summary()
+        return out
+
+
+def _copy(histogram):
+    """Return a copy of a histogram."""
+    out = Histogram()
+    out.merge(histogram)
+    return out
+
+
+class SlowCallLogger(object):
+
+    """A Stats listener which logs slow and failed calls.
+
+    Calls taking at least threshold seconds are logged as warnings,
+    and failed calls as errors, but only a `sample' fraction of them,
+    so a struggling cluster doesn't flood the log. Arguments are only
+    formatted for calls which are logged.
+    """
+
+    def __init__(self, threshold=0.1, sample=0.01, log=None):
+        self.threshold = threshold
+        self.sample = sample
+        self.log = log or logging.getLogger(__name__)
+
+    def __call__(self, method, server, elapsed, ex, args, kwargs):
+        """Maybe log a call."""
+        if ex is None and elapsed < self.threshold:
+            return
+        if self.sample < 1 and random.random() >= self.sample:
+            return
+
+        if ex is not None:
+            self.log.error("Caught %s while calling: %s -> %s(%s, %s)",
+                           ex.__class__.__name__, server, method, args,
+                           kwargs)
+        else:
+            self.log.warn("%dms: %s -> %s(%s, %s)", elapsed * 1000,
+                          server, method, args, kwargs)
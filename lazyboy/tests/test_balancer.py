@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Unit tests for lazyboy.balancer."""
+
+import unittest
+import time
+
+import lazyboy.balancer as balancer
+
+
+class PolicyTest(unittest.TestCase):
+
+    """Test the base policy."""
+
+    def test_interface(self):
+        policy = balancer.Policy()
+        self.assertRaises(NotImplementedError, policy.choose, ['eggs'])
+        policy.started('eggs')
+        policy.finished('eggs', 0.1)
+
+
+class RoundRobinPolicyTest(unittest.TestCase):
+
+    """Test RoundRobinPolicy."""
+
+    def test_choose(self):
+        policy = balancer.RoundRobinPolicy()
+        servers = ['eggs', 'bacon', 'spam']
+        seen = [policy.choose(servers) for x in range(6)]
+        self.assert_(sorted(seen[:3]) == sorted(servers))
+        self.assert_(seen[:3] == seen[3:])
+
+
+class LeastLatencyPolicyTest(unittest.TestCase):
+
+    """Test LeastLatencyPolicy."""
+
+    def setUp(self):
+        self.policy = balancer.LeastLatencyPolicy()
+        self.servers = ['eggs', 'bacon', 'spam']
+
+    def _call(self, server, elapsed):
+        self.policy.started(server)
+        self.policy.finished(server, elapsed)
+
+    def test_fastest(self):
+        """Make sure the fastest server is chosen."""
+        for (server, elapsed) in zip(self.servers, (0.3, 0.01, 0.2)):
+            self._call(server, elapsed)
+
+        for x in range(10):
+            self.assert_(self.policy.choose(self.servers) == 'bacon')
+
+    def test_outstanding(self):
+        """Make sure in-flight calls count against a server."""
+        for server in self.servers:
+            self._call(server, 0.1)
+
+        self.policy.started('eggs')
+        self.policy.started('bacon')
+        self.assert_(self.policy.choose(self.servers) == 'spam')
+
+        self.policy.finished('eggs', 0.1)
+        self.policy.finished('bacon', 0.1)
+        self.assert_(self.policy._stats['eggs'][2] == 0)
+
+        # Idle servers are picked by outstanding calls
+        policy = balancer.LeastLatencyPolicy()
+        policy.started('eggs')
+        self.assert_(policy.choose(['eggs', 'bacon']) == 'bacon')
+
+    def test_peak(self):
+        """Make sure a slow call raises the average immediately."""
+        self._call('eggs', 0.01)
+        self._call('eggs', 2.0)
+        self.assert_(self.policy._stats['eggs'][0] == 2.0)
+
+        # Fast calls bring it back down gradually
+        self.policy._stats['eggs'][1] = time.time() - self.policy.decay
+        self._call('eggs', 0.01)
+        self.assert_(0.01 < self.policy._stats['eggs'][0] < 2.0)
+
+    def test_decay(self):
+        """Make sure servers without traffic are tried again."""
+        self._call('eggs', 1.0)
+        self._call('bacon', 0.1)
+        self.assert_(self.policy.choose(['eggs', 'bacon']) == 'bacon')
+
+        self.policy._stats['eggs'][1] = time.time() - 10 * self.policy.decay
+        self.assert_(self.policy.cost('eggs') < self.policy.cost('bacon'))
+        self.assert_(self.policy.choose(['eggs', 'bacon']) == 'eggs')
+
+
+if __name__ == '__main__':
+    unittest.main()
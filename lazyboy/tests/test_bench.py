@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Unit tests for lazyboy.bench."""
+
+import os
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+
+from cassandra.ttypes import ColumnParent
+
+import lazyboy.connection as connection
+from lazyboy.bench.server import LoopbackServer
+from lazyboy.bench.workloads import WORKLOADS, KEYSPACE
+from lazyboy.bench.runner import run, main
+import lazyboy.bench.micro as micro
+
+
+class BenchTest(unittest.TestCase):
+
+    """Run the benchmarks against a LoopbackServer, briefly."""
+
+    def setUp(self):
+        self._servers = connection._SERVERS.copy()
+        self.server = LoopbackServer()
+        connection.add_pool(KEYSPACE, [self.server.start()])
+
+    def tearDown(self):
+        self.server.stop()
+        connection.get_pool(KEYSPACE).close()
+        connection._SERVERS.clear()
+        connection._SERVERS.update(self._servers)
+
+    def test_workloads(self):
+        for (name, workload_class) in WORKLOADS.iteritems():
+            workload = workload_class(5)
+            workload.setup()
+            result = run(workload, 2, duration=0.05, warmup=0)
+            self.assert_(result['errors'] == 0, name)
+            self.assert_(result['count'] > 0, name)
+            self.assert_(result['p50'] <= result['p99'] <= result['max'])
+
+    def test_latency(self):
+        self.server.processor._handler.latency = 0.02
+        client = connection.get_pool(KEYSPACE)
+        start = time.time()
+        client.get_count(KEYSPACE, 'row', ColumnParent('Records'), 1)
+        self.assert_(time.time() - start >= 0.02)
+
+    def test_main(self):
+        self.server.stop()
+        out = StringIO()
+        main(["--in-process", "-t", "1", "-d", "0.05", "--warmup", "0",
+              "-w", "record_load,array_extend", "-s", "3"], out)
+        lines = out.getvalue().splitlines()
+        self.assert_(len(lines) == 4)
+        self.assert_(lines[2].split()[:2] == ['record_load', '1'])
+        self.assert_(lines[3].split()[-1] == '0')
+
+
+class MicroTest(unittest.TestCase):
+
+    """Test the microbenchmarks."""
+
+    def setUp(self):
+        self._servers = connection._SERVERS.copy()
+
+    def tearDown(self):
+        connection._SERVERS.clear()
+        connection._SERVERS.update(self._servers)
+
+    def test_benchmarks(self):
+        for (name, setup) in micro.BENCHMARKS:
+            setup()()
+
+    def test_baseline(self):
+        names = set(name for (name, setup) in micro.BENCHMARKS)
+        baseline = micro.json.load(open(micro.BASELINE))
+        self.assert_(set(baseline['results']) == names)
+
+    def test_compare(self):
+        baseline = {'results': {'a': {'relative': 1.0},
+                                'b': {'relative': 1.0}}}
+        current = {'results': {'a': {'relative': 1.1},
+                               'b': {'relative': 1.5},
+                               'c': {'relative': 9.0}}}
+        (changes, regressed) = micro.compare(current, baseline, 0.25)
+        self.assert_(sorted(changes) == ['a', 'b'])
+        self.assert_(abs(changes['b'] - 0.5) < 1e-9)
+        self.assert_(regressed == ['b'])
+
+    def test_main(self):
+        baseline = {'results': {'pack': {'relative': 1e-9}}}
+        out = StringIO()
+        (handle, path) = tempfile.mkstemp()
+        os.write(handle, micro.json.dumps(baseline))
+        os.close(handle)
+        try:
+            status = micro.main(["-b", "pack,unpack", "-o", "",
+                                 "--min-time", "0.001", "-r", "1",
+                                 "--baseline", path], out)
+        finally:
+            os.remove(path)
+        self.assert_(status == 1)
+        lines = out.getvalue().splitlines()
+        self.assert_(len(lines) == 3)
+        self.assert_(lines[1].split()[0] == 'pack')
+        self.assert_(lines[1].endswith('REGRESSED'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,17 +12,22 @@ import time
 import types
 import logging
 import socket
+import threading
 from contextlib import contextmanager
 
 from cassandra import Cassandra
 from cassandra.ttypes import *
 from thrift.transport.TTransport import TTransportException
 from thrift import Thrift
-from thrift.transport import TSocket
+from thrift.transport import TSocket, TTransport
+from thrift.protocol import TBinaryProtocol
 
 import lazyboy.connection as conn
+import lazyboy.balancer as balancer
+from lazyboy.ring import TokenRing
 from lazyboy.exceptions import *
 from test_record import MockClient
+from test_hooks import RecordingHook
 from lazyboy.util import save, raises
 
 
@@ -34,12 +39,58 @@ class _MockTransport(object):
 
     def __init__(self, *args, **kwargs):
         self.calls = {'open': 0, 'close': 0}
+        self._open = False
+
+    def isOpen(self):
+        return self._open
 
     def open(self):
         self.calls['open'] += 1
+        self._open = True
 
     def close(self):
         self.calls['close'] += 1
+        self._open = False
+
+
+class _MockPool(object):
+
+    limiter = None
+
+    def __init__(self, client):
+        self.client = client
+        self.returned = []
+        self.down = False
+
+    def is_up(self):
+        return not self.down
+
+    def mark_down(self):
+        self.down = True
+
+    def mark_up(self):
+        self.down = False
+
+    def record_failure(self):
+        self.mark_down()
+
+    def record_success(self):
+        self.mark_up()
+
+    def allow(self):
+        return True
+
+    def end_probe(self):
+        pass
+
+    def __str__(self):
+        return "mockhost:1234"
+
+    def get(self):
+        return self.client
+
+    def put(self, client, discard=False):
+        self.returned.append((client, discard))
 
 
 class ConnectionTest(unittest.TestCase):
@@ -75,6 +126,133 @@ class TestPools(ConnectionTest):
         self.assertRaises(ErrorCassandraClientNotFound,
                           conn.get_pool, (__name__))
 
+    def test_get_pool_shared(self):
+        """Make sure all threads share one client per pool."""
+        clients = []
+        threads = [threading.Thread(
+                target=lambda: clients.append(conn.get_pool(self.pool)))
+                   for x in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assert_(len(clients) == 5)
+        for client in clients:
+            self.assert_(client is clients[0])
+
+    def test_add_pool_warm_up(self):
+        """Make sure warming up a pool creates its client right away."""
+        conn.add_pool(self.pool, ['localhost:1234'])
+        self.assert_(conn._CLIENTS == {})
+        conn.add_pool(self.pool, ['localhost:1234'], warm_up=2)
+        client = conn._CLIENTS[(conn.os.getpid(), self.pool)]
+        self.assert_(client is conn.get_pool(self.pool))
+
+    def test_add_pool_replaces(self):
+        """Make sure redefining a pool closes the old client."""
+        client = conn.get_pool(self.pool)
+        closed = []
+        client.close = lambda: closed.append(True)
+        conn.add_pool(self.pool, ['localhost:5678'])
+        self.assert_(closed == [True])
+        self.assert_(conn.get_pool(self.pool) is not client)
+
+
+class TestFork(ConnectionTest):
+
+    """Test fork handling."""
+
+    def setUp(self):
+        super(TestFork, self).setUp()
+        self._pid = conn._PID
+        self._hooks = conn._AFTER_FORK[:]
+
+    def tearDown(self):
+        super(TestFork, self).tearDown()
+        conn._PID = self._pid
+        conn._AFTER_FORK[:] = self._hooks
+
+    def _fork(self):
+        """Pretend this process was just forked."""
+        conn._PID = -1
+
+    def test_after_fork(self):
+        client = conn.get_pool(self.pool)
+        pool = client.list_servers()[0]
+        inherited = Generic()
+        inherited.transport = _MockTransport()
+        pool._idle.append((inherited, time.time()))
+        pool._size = 1
+        pool.down = True
+
+        called = []
+        conn.register_after_fork(lambda: called.append(True))
+        self._fork()
+        self.assert_(conn.get_pool(self.pool) is client)
+        self.assert_(conn._PID == conn.os.getpid())
+        self.assert_(called == [True])
+        self.assert_(pool.idle() == 0 and pool.size() == 0)
+        self.assert_(pool.is_up())
+        self.assert_(inherited.transport.calls['close'] == 1)
+
+        # Only once.
+        conn.check_fork()
+        self.assert_(called == [True])
+
+    def test_after_fork_checked_out(self):
+        """A client used before its pool in a child is only reset once."""
+        client = conn.get_pool(self.pool)
+        pool = client.list_servers()[0]
+        backend = Generic()
+        backend.transport = _MockTransport()
+        pool._factory = lambda: backend
+        warmed = []
+        client._start_warm_up = lambda: warmed.append(True)
+        client._warm_up = 1
+
+        self._fork()
+        client._pid = -1
+        with client.get_client() as clt:
+            self.assert_(conn.get_pool(self.pool) is client)
+            self.assert_(pool.size() == 1)
+        self.assert_(pool.size() == 1 and pool.idle() == 1)
+        self.assert_(warmed == [True])
+
+    def test_after_fork_warm_up(self):
+        client = conn.get_pool(self.pool)
+        warmed = []
+        client._start_warm_up = lambda: warmed.append(True)
+        self._fork()
+        conn.after_fork()
+        self.assert_(warmed == [])
+
+        client._warm_up = 2
+        self._fork()
+        conn.after_fork()
+        self.assert_(warmed == [True])
+
+    def test_prefork(self):
+        conn._SERVERS[self.pool]['warm_up'] = 4
+        conn.prefork()
+        client = conn.get_pool(self.pool)
+        self.assert_(client._warm_up == 4)
+        self.assert_([pool.size() for pool in client.list_servers()] == [0])
+
+    def test_client_fork(self):
+        """Make sure a Client used in a child resets itself."""
+        client = conn.Client(['localhost:1234'])
+        pool = client.list_servers()[0]
+        pool._idle.append((Generic(), time.time()))
+        pool._idle[0][0].transport = _MockTransport()
+        workers = client._workers
+        client._pid = -1
+        client._get_server = lambda key=None: _MockPool(None)
+        with client.get_client():
+            pass
+        self.assert_(client._pid == conn.os.getpid())
+        self.assert_(pool.idle() == 0)
+        self.assert_(client._workers is not workers)
+
 
 class TestClient(ConnectionTest):
 
@@ -100,12 +278,24 @@ class TestClient(ConnectionTest):
                      self.client._timeout * .001)
         self.assert_(isinstance(srv, Cassandra.Client))
 
-        with save(conn.TSocket, ('TSocket',)):
+        with save(conn, ('build_transport',)):
             for exc_class in exc_classes:
-                conn.TSocket.TSocket = raises(exc_class)
+                conn.build_transport = raises(exc_class)
                 self.assert_(self.client._build_server(cls, 'localhost', 1234)
                              is None)
 
+    def test_transport_options(self):
+        client = conn.Client(['localhost:1234'], transport='framed',
+                             protocol='binary', connect_timeout=100)
+        srv = client._build_server(Cassandra.Client, 'localhost', 1234)
+        self.assert_(isinstance(srv.transport, TTransport.TFramedTransport))
+        self.assert_(srv._iprot.__class__ is TBinaryProtocol.TBinaryProtocol)
+
+        self.assertRaises(ErrorNotSupported, conn.Client, ['localhost:1234'],
+                          transport='carrier-pigeon')
+        self.assertRaises(ErrorNotSupported, conn.Client, ['localhost:1234'],
+                          protocol='smoke-signals')
+
     def test_get_server(self):
         # Zero clients
         real = self.client._clients
@@ -116,70 +306,59 @@ class TestClient(ConnectionTest):
                          self.client._get_server)
 
         # Round-robin
-        fake = ['eggs', 'bacon', 'spam']
+        fake = [_MockPool(name) for name in ('eggs', 'bacon', 'spam')]
         self.client._clients = fake
-        self.client._current_server = 0
-        for exp in range(2 * len(fake)):
-            srv = self.client._get_server()
-            self.assert_(srv in fake)
+        seen = [self.client._get_server() for x in range(2 * len(fake))]
+        self.assert_(seen[:3] == seen[3:])
+        self.assert_(sorted(seen[:3]) == sorted(fake))
+
+        # Down servers are skipped
+        fake[1].down = True
+        seen = [self.client._get_server() for x in range(len(fake))]
+        self.assert_(fake[1] not in seen)
+        self.assert_(fake[0] in seen and fake[2] in seen)
+
+        # If they're all down, try them anyway
+        for pool in fake:
+            pool.down = True
+        seen = [self.client._get_server() for x in range(len(fake))]
+        self.assert_(sorted(seen) == sorted(fake))
+
+    def test_policy(self):
+        """Make sure the balancing policy is used and informed."""
+        self.assert_(isinstance(self.client._policy,
+                                balancer.RoundRobinPolicy))
+
+        policy = balancer.LeastLatencyPolicy()
+        client = self._client(['localhost:1234'], policy=policy)
+        self.assert_(client._policy is policy)
+
+        client = self._client(['localhost:1234'],
+                              policy=balancer.LeastLatencyPolicy)
+        self.assert_(isinstance(client._policy, balancer.LeastLatencyPolicy))
+
+        calls = []
+        raw_server = Generic()
+        raw_server.transport = _MockTransport()
+        pool = _MockPool(raw_server)
+        client._clients = [pool]
+        client._policy = Generic()
+        client._policy.choose = lambda servers: calls.append(servers) or \
+            servers[0]
+        client._policy.started = lambda server: calls.append(server)
+        client._policy.finished = lambda server, elapsed: calls.append(
+            (server, elapsed))
+
+        with client.get_client() as clt:
+            self.assert_(clt is raw_server)
+        self.assert_(calls[:2] == [[pool], pool])
+        self.assert_(calls[2][0] is pool and calls[2][1] >= 0)
 
     def test_list_servers(self):
         servers = self.client.list_servers()
         self.assert_(servers.__class__ == list)
         self.assert_(self.client._clients == servers)
 
-    def test_connect(self):
-        client = self.client._get_server()
-        self.client._get_server = lambda: client
-
-        # Already connected
-        client.transport = _MockTransport()
-        client.transport.isOpen = lambda: True
-        self.assert_(self.client._connect())
-
-        # Not connected, no error
-        nopens = client.transport.calls['open']
-        with save(client.transport, ('isOpen',)):
-            client.transport.isOpen = lambda: False
-            self.assert_(self.client._connect())
-            self.assert_(client.transport.calls['open'] == nopens + 1)
-
-        # Thrift Exception on connect - trapped
-        ncloses = client.transport.calls['close']
-        with save(client.transport, ('isOpen', 'open')):
-            client.transport.isOpen = lambda: False
-            client.transport.open = raises(TTransportException)
-            self.assertRaises(ErrorThriftMessage, self.client._connect)
-            self.assert_(client.transport.calls['close'] == ncloses +1)
-
-        # Other exception on connect should be ignored
-        with save(client.transport, ('isOpen', 'open')):
-            client.transport.isOpen = lambda: False
-            client.transport.open = raises(Exception)
-            ncloses = client.transport.calls['close']
-            self.assertRaises(Exception, self.client._connect)
-
-        # Connection recycling - reuse same connection
-        nopens = client.transport.calls['open']
-        ncloses = client.transport.calls['close']
-        conn = self.client._connect()
-        self.client._recycle = 60
-        client.connect_time = time.time()
-        self.assert_(conn is self.client._connect())
-        self.assert_(client.transport.calls['open'] == nopens)
-        self.assert_(client.transport.calls['open'] == ncloses)
-
-        # Recycling - reconnect
-        nopens = client.transport.calls['open']
-        ncloses = client.transport.calls['close']
-        conn = self.client._connect()
-        self.client._recycle = 60
-        client.connect_time = 0
-        self.assert_(conn is self.client._connect())
-        self.assert_(client.transport.calls['open'] == nopens + 1)
-        self.assert_(client.transport.calls['close'] == ncloses + 1)
-
-
     def test_methods(self):
         """Test the various client methods."""
 
@@ -188,7 +367,7 @@ class TestClient(ConnectionTest):
         real_client = Generic()
 
         @contextmanager
-        def get_client():
+        def get_client(key=None, pool=None):
             yield real_client
 
         client = self._client(['127.0.0.1:9160'])
@@ -207,86 +386,1057 @@ class TestClient(ConnectionTest):
             self.assert_(res[1] == ('cleese',))
             self.assert_(res[2] == {'gilliam': "Terry"})
 
+    def test_hooks(self):
+        """Make sure hooks see each attempt at a call."""
+        client = conn.Client(['localhost:1234'])
+        pool = _MockPool(Generic())
+        attempts = []
+
+        def get(*args):
+            attempts.append(True)
+            if len(attempts) < 2:
+                raise ErrorThriftMessage("Cleese")
+            return 'eggs'
+
+        pool.client.get = get
+        pool.client.get_string_property = lambda *args: '{}'
+        pool.client.transport = _MockTransport()
+        client._get_server = lambda key=None: pool
+        client._retry_policy = conn.RetryPolicy(backoff=0)
+
+        (hook, global_hook, unsampled) = (RecordingHook(), RecordingHook(),
+                                          RecordingHook())
+        client.add_hook(hook)
+        client.add_hook(unsampled, 0)
+        conn.add_hook(global_hook)
+        try:
+            self.assert_(client.get('Keyspace1', 'key', None, 1) == 'eggs')
+        finally:
+            conn.remove_hook(global_hook)
+
+        events = [('start', 'get', 1),
+                  ('failure', 'get', 1, ErrorThriftMessage),
+                  ('retry', 'get', 1, ErrorThriftMessage),
+                  ('start', 'get', 2), ('success', 'get', 2)]
+        self.assert_(hook.events == events)
+        self.assert_(global_hook.events == events)
+        self.assert_(unsampled.events == [])
+
+        calls = []
+        hook.success = calls.append
+        client.get('Keyspace1', 'key', None, 1)
+        self.assert_(calls[0].keyspace == 'Keyspace1')
+        self.assert_(calls[0].host == 'mockhost:1234')
+        self.assert_(calls[0].elapsed >= 0)
+        self.assert_(calls[0].request_size is None)
+
+        client.get_string_property('token map')
+        self.assert_(calls[1].keyspace is None)
+
+    def test_retry_hook_wrapped(self):
+        """The retry hook sees the failed multiget_slice or batch_mutate."""
+        client = conn.Client(['localhost:1234'])
+        pool = _MockPool(Generic())
+        failures = []
+
+        def fail_once(*args):
+            failures.append(True)
+            if len(failures) % 2:
+                raise ErrorThriftMessage("Cleese")
+            return {}
+
+        pool.client.multiget_slice = pool.client.batch_mutate = fail_once
+        pool.client.transport = _MockTransport()
+        client._get_server = lambda key=None: pool
+        client._retry_policy = conn.RetryPolicy(backoff=0)
+
+        retries = []
+        hook = RecordingHook()
+        hook.retry = lambda call, ex: retries.append(call)
+        client.add_hook(hook)
+        client.multiget_slice('Keyspace1', ['key'], None, None, 1)
+        client.batch_mutate('Keyspace1', {'key': {}}, 1)
+
+        self.assert_([call.method for call in retries] ==
+                     ['multiget_slice', 'batch_mutate'])
+        for call in retries:
+            self.assert_(call.keyspace == 'Keyspace1')
+            self.assert_(call.host == 'mockhost:1234')
+            self.assert_(call.attempt == 1)
+            self.assert_(call.elapsed >= 0)
+
+    def test_stats(self):
+        """Make sure calls and retries are counted."""
+        seen = []
+        client = conn.Client(['localhost:1234'], stats_listeners=[
+                lambda *args: seen.append(args)])
+        pool = _MockPool(Generic())
+        pool.client.get = lambda *args: 'eggs'
+        pool.client.insert = raises(InvalidRequestException)
+        client._get_server = lambda key=None: pool
+        client._retry_policy = conn.RetryPolicy(backoff=0, attempts=2)
+
+        self.assert_(client.get('Keyspace1', 'key', None, 1) == 'eggs')
+        self.assertRaises(InvalidRequestException, client.insert,
+                          'Keyspace1', 'key')
+        pool.client.get = raises(ErrorThriftMessage)
+        self.assertRaises(ErrorThriftMessage, client.get, 'Keyspace1', 'key')
+
+        stats = client.stats()
+        self.assert_(stats['get']['calls'] == 3)
+        self.assert_(stats['get']['retries'] == 1)
+        self.assert_(stats['get']['errors'] == {'ErrorThriftMessage': 2})
+        self.assert_(stats['get']['servers'].keys() == ['mockhost:1234'])
+        self.assert_(stats['insert']['errors'] ==
+                     {'InvalidRequestException': 1})
+        self.assert_(len(seen) == 4)
+        self.assert_(seen[0][:2] == ('get', 'mockhost:1234'))
+        self.assert_(seen[0][4] == ('Keyspace1', 'key', None, 1))
+
+    def test_stats_wrapped(self):
+        """Retries of multiget_slice and batch_mutate count as theirs."""
+        client = conn.Client(['localhost:1234'])
+        pool = _MockPool(Generic())
+        failures = []
+
+        def fail_once(result):
+            def call(*args):
+                failures.append(True)
+                if len(failures) % 2:
+                    raise ErrorThriftMessage("Cleese")
+                return result
+            return call
+
+        pool.client.multiget_slice = fail_once({})
+        pool.client.batch_mutate = fail_once(None)
+        client._get_server = lambda key=None: pool
+        client._retry_policy = conn.RetryPolicy(backoff=0)
+
+        client.multiget_slice('Keyspace1', ['key'], None, None, 1)
+        client.batch_mutate('Keyspace1', {'key': {}}, 1)
+        stats = client.stats()
+        self.assert_(sorted(stats) == ['batch_mutate', 'multiget_slice'])
+        for method in stats:
+            self.assert_(stats[method]['calls'] == 2)
+            self.assert_(stats[method]['retries'] == 1)
+
+    def test_limits(self):
+        """Make sure calls over the in-flight limits are shed."""
+        client = conn.Client(['localhost:1234'], max_in_flight=1,
+                             host_max_in_flight=1)
+        self.assert_(client._limiter.limit == 1)
+        self.assert_(client.list_servers()[0].limiter.limit == 1)
+
+        pool = _MockPool(Generic())
+        pool.limiter = conn.Limiter(5)
+        client._get_server = lambda key=None: pool
+        entered, finish = threading.Event(), threading.Event()
+
+        def get(*args):
+            entered.set()
+            finish.wait(5)
+            return 'eggs'
+        pool.client.get = get
+        thread = threading.Thread(target=client.get,
+                                  args=('Keyspace1', 'key', None, 1))
+        thread.start()
+        entered.wait(5)
+        try:
+            self.assertRaises(ErrorOverloaded, client.get, 'Keyspace1',
+                              'key', None, 1)
+            self.assert_(client._limiter.rejected == 1)
+            # A rejected call gives back the slots it took
+            self.assert_(pool.limiter.in_flight == 1)
+            self.assert_(client.stats()['get']['errors'] ==
+                         {'ErrorOverloaded': 1})
+        finally:
+            finish.set()
+            thread.join()
+        self.assert_(client._limiter.in_flight == 0)
+        self.assert_(pool.limiter.in_flight == 0)
+        self.assert_(client.get('Keyspace1', 'key', None, 1) == 'eggs')
+
+        client = conn.Client(['localhost:1234'], max_in_flight=5,
+                             adaptive_limit=True)
+        self.assert_(isinstance(client._limiter, conn.AdaptiveLimiter))
+        self.assert_(client.list_servers()[0].limiter is None)
+
+    def test_close(self):
+        """Test Client.close."""
+        closed = []
+        for pool in self.client.list_servers():
+            pool.close = lambda: closed.append(True)
+        self.client.close()
+        self.assert_(len(closed) == len(self.client.list_servers()))
+
     def test_get_client(self):
         """Test get_client."""
-        cass_client = Generic()
         raw_server = Generic()
-        self.client._get_server = lambda: raw_server
-        self.client._connect = lambda: raw_server
-        self.client._servers = [raw_server]
-        self.client._current_server = 0
+        pool = _MockPool(raw_server)
+        self.client._get_server = lambda key=None: pool
 
         transport = _MockTransport()
         raw_server.transport = transport
 
         with self.client.get_client() as clt:
             self.assert_(clt is raw_server)
+        self.assert_(pool.returned == [(raw_server, False)])
 
         # Socket error handling
-        ncloses = transport.calls['close']
+        pool.returned = []
         try:
             with self.client.get_client() as clt:
                 raise socket.error(7, "Test error")
             self.fail_("Exception not raised.")
         except ErrorThriftMessage, exc:
-            self.assert_(transport.calls['close'] == ncloses + 1)
+            self.assert_(pool.returned == [(raw_server, True)])
             self.assert_(exc.args[1] == "Test error")
+            self.assert_(exc.args[2] == str(pool))
 
-        closed = []
+        pool.returned = []
         try:
-            raw_server.transport = Generic()
-            raw_server.transport.close = lambda: closed.append(True)
             with self.client.get_client() as clt:
                 raise Thrift.TException("Cleese")
         except ErrorThriftMessage, exc:
-            self.assert_(len(closed) == 1)
+            self.assert_(pool.returned == [(raw_server, True)])
             self.assert_(exc.args[0] == "Cleese")
 
-        closed = []
+        pool.returned = []
         try:
-            raw_server.transport = Generic()
-            raw_server.transport.close = lambda: closed.append(True)
             with self.client.get_client() as clt:
                 raise Thrift.TException()
         except Exception, exc:
-            self.assert_(len(closed) == 1)
+            self.assert_(pool.returned == [(raw_server, True)])
             self.assert_(exc.args[0] != "")
 
-        # Cassandra exceptions - no open/close, added info
+        # Cassandra exceptions - connection reused, added info
         excs = ((NotFoundException, UnavailableException,
-                 InvalidRequestException))
+                 TimedOutException, InvalidRequestException))
         for exc_ in excs:
+            pool.returned = []
             try:
                 with self.client.get_client() as clt:
                     raise exc_("John Cleese")
                 self.fail_("Exception gobbled.")
             except (exc_), ex:
+                self.assert_(pool.returned == [(raw_server, False)])
                 self.assert_(len(ex.args) > 1)
-                server = self.client._servers[self.client._current_server]
-                self.assert_(repr(server) in ex.args[-1])
+                self.assert_(str(pool) in ex.args[-1])
 
+        # Connection errors don't return anything to the pool
+        pool.returned = []
+        pool.get = raises(ErrorThriftMessage)
+        try:
+            with self.client.get_client() as clt:
+                self.fail_("Got a client.")
+        except ErrorThriftMessage:
+            self.assert_(pool.returned == [])
 
-class TestRetry(unittest.TestCase):
+    def test_get_client_mark_down(self):
+        """Make sure failing servers are marked down, and back up."""
+        raw_server = Generic()
+        raw_server.transport = _MockTransport()
+        pool = _MockPool(raw_server)
+        self.client._get_server = lambda key=None: pool
 
-    """Test retry logic."""
+        for error in (socket.error(7, "Test error"), socket.timeout(),
+                      TTransportException("Cleese")):
+            pool.down = False
+            try:
+                with self.client.get_client() as clt:
+                    raise error
+            except ErrorThriftMessage:
+                pass
+            self.assert_(pool.down, "%r didn't mark down" % error)
 
-    def test_retry_default_callback(self):
-        """Make sure retry_default_callback works."""
-        for x in range(conn.RETRY_ATTEMPTS):
-            self.assert_(conn._retry_default_callback(x, None))
+        # Successful calls bring it back
+        with self.client.get_client() as clt:
+            pass
+        self.assert_(not pool.down)
 
-        self.assert_(not conn._retry_default_callback(x + 1, None))
+        # Application errors don't mark anything down
+        for error in (NotFoundException(), InvalidRequestException(),
+                      TimedOutException(), Thrift.TApplicationException()):
+            try:
+                with self.client.get_client() as clt:
+                    raise error
+            except Exception:
+                pass
+            self.assert_(not pool.down, "%r marked down" % error)
+
+        # Neither does a full pool
+        pool.get = raises(ErrorPoolExhausted)
+        self.assertRaises(ErrorPoolExhausted,
+                          self.client.get_client().__enter__)
+        self.assert_(not pool.down)
+
+        pool.get = raises(ErrorThriftMessage)
+        self.assertRaises(ErrorThriftMessage,
+                          self.client.get_client().__enter__)
+        self.assert_(pool.down)
+
+    def test_get_client_circuit_open(self):
+        """Make sure servers which are down aren't called."""
+        raw_server = Generic()
+        raw_server.transport = _MockTransport()
+        pool = _MockPool(raw_server)
+        pool.allow = lambda: False
+        pool.get = raises(AssertionError)
+        self.client._get_server = lambda key=None: pool
+        self.assertRaises(ErrorCircuitOpen,
+                          self.client.get_client().__enter__)
+        self.assert_(pool.returned == [])
+
+    def test_overloaded_probe(self):
+        """A probe shed by the limiter doesn't stay in progress."""
+        pool = conn.HostPool(lambda: None, 'localhost', 1234,
+                             limiter=conn.Limiter(1, 0))
+        pool.mark_down()
+        pool._retry_at = 0
+        self.client._get_server = lambda key=None: pool
+        pool.limiter.acquire()
+        self.assertRaises(ErrorOverloaded,
+                          self.client.get_client().__enter__)
+        self.assert_(pool.is_up() and not pool._probing)
+
+        # Nor does a limiter slot stay taken by a call which isn't let
+        # through.
+        pool.limiter.release()
+        pool._probing = True
+        self.assertRaises(ErrorCircuitOpen,
+                          self.client.get_client().__enter__)
+        self.assert_(pool.limiter.in_flight == 0)
+
+
+class TestTokenAware(unittest.TestCase):
+
+    """Test token-aware routing in Client."""
+
+    def setUp(self):
+        self.client = conn.Client(['10.0.0.1:9160', '10.0.0.2:9160',
+                                   '10.0.0.3:9160'], token_aware=True)
+        self.pools = self.client.list_servers()
+        # Node n owns tokens in ((n - 1) * 100, n * 100]
+        self.ring = TokenRing({'100': '10.0.0.1', '200': '10.0.0.2',
+                               '300': '10.0.0.3'})
+        self.ring.token = lambda key: int(key)
+        self.client._ring = (self.ring, self.pools)
+        self.client._ring_expires = time.time() + 300
+
+    def test_get_server(self):
+        """Make sure keys are routed to their owner."""
+        self.assert_(self.client._get_server('50') is self.pools[0])
+        self.assert_(self.client._get_server('100') is self.pools[0])
+        self.assert_(self.client._get_server('150') is self.pools[1])
+        self.assert_(self.client._get_server('250') is self.pools[2])
+        self.assert_(self.client._get_server('350') is self.pools[0])
+
+        # Down owners fall through to the next node in the ring
+        self.pools[1].mark_down()
+        self.assert_(self.client._get_server('150') is self.pools[2])
+        self.pools[1].mark_up()
+
+        # Off unless asked for
+        self.client._token_aware = False
+        self.client._policy = Generic()
+        self.client._policy.choose = lambda servers: 'policy'
+        self.assert_(self.client._get_server('150') == 'policy')
+
+    def test_no_ring(self):
+        """Make sure calls work before the ring is known."""
+        self.client._ring = None
+        self.client._check_ring = lambda: None
+        self.client._policy = Generic()
+        self.client._policy.choose = lambda servers: 'policy'
+        self.assert_(self.client._get_server('150') == 'policy')
+        self.assert_(self.client._split_keys(['50', '150']) == [['50', '150']])
+
+    def test_unknown_endpoint(self):
+        """Make sure nodes we aren't configured for are skipped."""
+        self.client._ring = (self.ring, [None, None, None])
+        self.client._policy = Generic()
+        self.client._policy.choose = lambda servers: 'policy'
+        self.assert_(self.client._get_server('150') == 'policy')
+
+    def test_refresh_ring(self):
+        """Make sure the token map is fetched and mapped to servers."""
+        self.client._ring_lock.acquire()
+        self.client.get_string_property = lambda prop: (
+            '{"100": "10.0.0.3", "200": "10.0.0.9"}')
+        self.client._refresh_ring()
+        (ring, servers) = self.client._ring
+        self.assert_(ring.tokens == [100, 200])
+        self.assert_(servers == [self.pools[2], None])
+        self.assert_(self.client._ring_expires > time.time())
+        self.assert_(self.client._ring_lock.acquire(False))
+        self.client._ring_lock.release()
+
+        # Errors keep the old ring, and try again soon.
+        self.client._ring_lock.acquire()
+        self.client.get_string_property = raises(ErrorThriftMessage)
+        self.client._refresh_ring()
+        self.assert_(self.client._ring[0] is ring)
+        self.assert_(self.client._ring_expires <= time.time() + 30)
+        self.assert_(self.client._ring_lock.acquire(False))
+
+    def test_check_ring(self):
+        """Make sure stale rings are refreshed in the background."""
+        refreshed = []
+        self.client._refresh_ring = lambda: refreshed.append(True)
+        self.client._check_ring()
+        self.assert_(refreshed == [])
+
+        self.client._ring_expires = 0
+        self.client._check_ring()
+        time.sleep(0.01)
+        self.assert_(refreshed == [True])
+
+        # Only one refresh at a time
+        self.client._check_ring()
+        time.sleep(0.01)
+        self.assert_(refreshed == [True])
+
+    def test_split_keys(self):
+        groups = self.client._split_keys(['50', '150', '60', '250'])
+        self.assert_(sorted(groups) == [['150'], ['250'], ['50', '60']])
+
+    def test_single_key_routing(self):
+        """Make sure single-key calls go to the owner."""
+        hosts = []
+
+        methods = ('get', 'get_slice', 'get_count', 'insert',
+                   'batch_insert', 'remove')
+        real_client = Generic()
+        for method in methods:
+            setattr(real_client, method, lambda *args, **kwargs: True)
+
+        @contextmanager
+        def get_client(key=None, pool=None):
+            hosts.append(self.client._get_server(key))
+            yield real_client
+
+        self.client.get_client = get_client
+        for method in methods:
+            getattr(self.client, method)('Keyspace', '150')
+            getattr(self.client, method)('Keyspace', key='250')
+        self.assert_(hosts == [self.pools[1], self.pools[2]] * 6)
+
+    def test_multiget_slice(self):
+        """Make sure multiget_slice is split up by owner."""
+        calls = []
+
+        @contextmanager
+        def get_client(key=None, pool=None):
+            client = Generic()
+            def multiget_slice(keyspace, keys, *args):
+                calls.append((self.client._get_server(key), sorted(keys)))
+                return dict((key, [key]) for key in keys)
+            client.multiget_slice = multiget_slice
+            yield client
+
+        self.client.get_client = get_client
+        res = self.client.multiget_slice('Keyspace', ['50', '150', '60'],
+                                         'parent', 'predicate', 'cl')
+        self.assert_(res == {'50': ['50'], '60': ['60'], '150': ['150']})
+        self.assert_(sorted(calls) == sorted(
+                [(self.pools[0], ['50', '60']), (self.pools[1], ['150'])]))
+
+        calls[:] = []
+        res = self.client.multiget_slice('Keyspace', keys=['50', '60'])
+        self.assert_(calls == [(self.pools[0], ['50', '60'])])
+
+    def test_batch_mutate(self):
+        """Make sure batch_mutate is split up by owner."""
+        calls = []
+
+        @contextmanager
+        def get_client(key=None, pool=None):
+            client = Generic()
+            def batch_mutate(keyspace, mutation_map, consistency):
+                calls.append((self.client._get_server(key), mutation_map))
+            client.batch_mutate = batch_mutate
+            yield client
+
+        self.client.get_client = get_client
+        self.client.batch_mutate(
+            'Keyspace', {'50': 'eggs', '150': 'bacon', '250': 'spam'}, 'cl')
+        self.assert_(sorted(calls) == sorted(
+                [(self.pools[0], {'50': 'eggs'}),
+                 (self.pools[1], {'150': 'bacon'}),
+                 (self.pools[2], {'250': 'spam'})]))
+
+
+class TestHostPool(unittest.TestCase):
+
+    """Test the per-server connection pool."""
+
+    def setUp(self):
+        self.built = []
+        self.pool = conn.HostPool(self._factory, 'localhost', 1234,
+                                  min_size=1, max_size=2, wait_timeout=0.01)
+
+    def _factory(self):
+        client = Generic()
+        client.transport = _MockTransport()
+        self.built.append(client)
+        return client
+
+    def test_str(self):
+        self.assert_(str(self.pool) == "localhost:1234")
+        self.assert_(isinstance(repr(self.pool), str))
+
+    def test_get_opens(self):
+        client = self.pool.get()
+        self.assert_(client is self.built[0])
+        self.assert_(client.transport.calls['open'] == 1)
+        self.assert_(client.transport.isOpen())
+        self.assert_(hasattr(client, 'connect_time'))
+        self.assert_(self.pool.size() == 1)
+
+    def test_reuse(self):
+        client = self.pool.get()
+        self.pool.put(client)
+        self.assert_(self.pool.idle() == 1)
+        self.assert_(self.pool.get() is client)
+        self.assert_(len(self.built) == 1)
+
+    def test_bounded(self):
+        clients = [self.pool.get(), self.pool.get()]
+        self.assert_(self.pool.size() == 2)
+        self.assertRaises(ErrorPoolExhausted, self.pool.get)
+        self.assert_(len(self.built) == 2)
+
+        self.pool.put(clients[0])
+        self.assert_(self.pool.get() is clients[0])
+
+    def test_wait(self):
+        """Make sure waiting callers get returned connections."""
+        self.pool.wait_timeout = 5
+        clients = [self.pool.get(), self.pool.get()]
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(self.pool.get()))
+        waiter.start()
+        time.sleep(0.01)
+        self.pool.put(clients[1])
+        waiter.join(5)
+        self.assert_(got == [clients[1]])
+
+    def test_discard(self):
+        client = self.pool.get()
+        self.pool.put(client, discard=True)
+        self.assert_(self.pool.size() == 0)
+        self.assert_(self.pool.idle() == 0)
+        self.assert_(client.transport.calls['close'] == 1)
+
+        # Closed while checked out
+        client = self.pool.get()
+        client.transport.close()
+        self.pool.put(client)
+        self.assert_(self.pool.size() == 0)
+
+    def test_open_error(self):
+        def factory():
+            client = self._factory()
+            client.transport.open = raises(TTransportException)
+            return client
+
+        self.pool._factory = factory
+        self.assertRaises(ErrorThriftMessage, self.pool.get)
+        self.assert_(self.pool.size() == 0)
+        self.assert_(self.built[-1].transport.calls['close'] == 1)
+
+        self.pool._factory = lambda: None
+        self.assertRaises(ErrorThriftMessage, self.pool.get)
+        self.assert_(self.pool.size() == 0)
+
+    def test_recycle(self):
+        self.pool.recycle = 60
+        client = self.pool.get()
+        self.pool.put(client)
+        self.assert_(self.pool.get() is client)
+
+        client.connect_time = 0
+        self.pool.put(client)
+        new = self.pool.get()
+        self.assert_(new is not client)
+        self.assert_(client.transport.calls['close'] == 1)
+        self.assert_(self.pool.size() == 1)
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = 60
+        clients = [self.pool.get(), self.pool.get()]
+        self.pool.put(clients[0])
+        self.pool._idle[0] = (clients[0], 0)
+        self.pool.put(clients[1])
+        self.assert_(self.pool.idle() == 1)
+        self.assert_(clients[0].transport.calls['close'] == 1)
+
+        # min_size connections are kept, however old they are.
+        self.pool._idle[0] = (clients[1], 0)
+        self.pool._reap(time.time())
+        self.assert_(self.pool.idle() == 1)
+
+        # But they aren't handed out.
+        new = self.pool.get()
+        self.assert_(new is not clients[1])
+        self.assert_(clients[1].transport.calls['close'] == 1)
+        self.assert_(self.pool.size() == 1)
+
+    def test_idle_timeout_get(self):
+        """Connections are reaped when the pool is next used."""
+        self.pool.idle_timeout = 60
+        clients = [self.pool.get(), self.pool.get()]
+        self.pool.put(clients[0])
+        self.pool.put(clients[1])
+        self.pool._idle[0] = (clients[0], 0)
+        self.assert_(self.pool.get() is clients[1])
+        self.assert_(clients[0].transport.calls['close'] == 1)
+        self.assert_(self.pool.size() == 1)
+
+    def test_mark_down(self):
+        self.pool.down_backoff, self.pool.down_backoff_max = 10, 25
+        client = self.pool.get()
+        self.pool.put(client)
+
+        self.assert_(self.pool.is_up())
+        self.pool.mark_down()
+        self.assert_(not self.pool.is_up())
+        self.assert_(self.pool._backoff == 10)
+        self.assert_(not self.pool.allow())
+        self.assert_(self.pool.idle() == 0)
+        self.assert_(client.transport.calls['close'] == 1)
+
+        # Marking it down again doesn't extend the backoff
+        self.pool.mark_down()
+        self.assert_(self.pool._backoff == 10)
+
+        self.pool.mark_up()
+        self.assert_(self.pool.is_up())
+        self.assert_(self.pool._backoff == 0)
+        self.assert_(self.pool.allow())
+
+    def test_failure_threshold(self):
+        self.pool.failure_threshold = 3
+        for x in range(2):
+            self.pool.record_failure()
+        self.assert_(self.pool.is_up())
+
+        # A success resets the count
+        self.pool.record_success()
+        for x in range(2):
+            self.pool.record_failure()
+        self.assert_(self.pool.is_up())
+        self.pool.record_failure()
+        self.assert_(not self.pool.is_up())
+
+    def test_half_open(self):
+        self.pool.down_backoff, self.pool.down_backoff_max = 10, 25
+        self.pool.mark_down()
+        self.assert_(not self.pool.allow())
+
+        # Failed probes back off exponentially, up to the limit
+        for backoff in (20, 25, 25):
+            self.pool._retry_at = 0
+            self.assert_(self.pool.is_up())
+            self.assert_(self.pool.allow())
+            # Only one probe at a time
+            self.assert_(not self.pool.allow())
+            self.assert_(not self.pool.is_up())
+            self.pool.record_failure()
+            self.assert_(not self.pool.is_up())
+            self.assert_(self.pool._backoff == backoff)
+
+        self.pool._retry_at = 0
+        self.assert_(self.pool.allow())
+        self.pool.record_success()
+        self.assert_(self.pool.is_up())
+        self.assert_(self.pool._backoff == 0)
+
+        # A probe which ends without an answer lets another through
+        self.pool.mark_down()
+        self.pool._retry_at = 0
+        self.assert_(self.pool.allow())
+        self.pool.end_probe()
+        self.assert_(self.pool.allow())
+
+    def test_close(self):
+        clients = [self.pool.get(), self.pool.get()]
+        for client in clients:
+            self.pool.put(client)
+        self.pool.close()
+        self.assert_(self.pool.idle() == 0)
+        self.assert_(self.pool.size() == 0)
+        for client in clients:
+            self.assert_(client.transport.calls['close'] == 1)
+
+    def test_warm(self):
+        self.assert_(self.built == [])
+        self.assert_(self.pool.warm(5) == 2)
+        self.assert_(self.pool.idle() == 2)
+        self.assert_(self.pool.warm(2) == 0)
+        self.assert_(len(self.built) == 2)
+
+        # Failures mark the server down.
+        self.pool.close()
+        self.pool._factory = lambda: None
+        self.pool.failure_threshold = 1
+        self.assert_(self.pool.warm(1) == 0)
+        self.assert_(not self.pool.is_up())
+        self.assert_(self.pool.size() == 0)
+        self.pool.close()
+
+    def test_client_warm(self):
+        client = conn.Client(['localhost:1234', 'localhost:5678'])
+        for pool in client.list_servers():
+            pool._factory = self._factory
+        self.assert_(self.built == [])
+        self.assert_(client.warm(2) == 4)
+        self.assert_([pool.idle() for pool in client.list_servers()] ==
+                     [2, 2])
+
+
+class TestRetry(unittest.TestCase):
+
+    """Test retry logic."""
 
     def test_retry(self):
         """Test retry."""
         retries = []
+        def bad_func():
+            retries.append(True)
+            raise ErrorThriftMessage("Whoops.")
+
+        with save(conn.DEFAULT_RETRY_POLICY, ('backoff',)):
+            conn.DEFAULT_RETRY_POLICY.backoff = 0
+            retry_func = conn.retry()(bad_func)
+            self.assertRaises(ErrorThriftMessage, retry_func)
+            self.assert_(len(retries) == conn.RETRY_ATTEMPTS)
+
+        # Errors which can never succeed aren't retried
+        retries = []
+        def invalid_func():
+            retries.append(True)
+            raise InvalidRequestException("Whoops.")
+        self.assertRaises(InvalidRequestException, conn.retry()(invalid_func))
+        self.assert_(len(retries) == 1)
+
+    def test_retry_callback(self):
+        """Test retry with a callback."""
+        retries = []
         def bad_func():
             retries.append(True)
             raise Exception("Whoops.")
 
-        retry_func = conn.retry()(bad_func)
+        retry_func = conn.retry(lambda attempt, ex: attempt < 3)(bad_func)
         self.assertRaises(Exception, retry_func)
-        self.assert_(len(retries) == conn.RETRY_ATTEMPTS)
+        self.assert_(len(retries) == 3)
+
+    def test_retry_client_policy(self):
+        """Make sure methods use their Client's policy."""
+        calls = []
+        policy = Generic()
+        policy.run = lambda func, args, kwargs, on_retry: calls.append(args)
+        client = conn.Client(['localhost:1234'], retry_policy=policy)
+        client.get('Keyspace', 'key')
+        self.assert_(calls == [(client, 'Keyspace', 'key')])
+        self.assert_(client.get.__name__ == 'get')
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    """Test RetryPolicy."""
+
+    def setUp(self):
+        self.sleeps = []
+        self._sleep = conn.time.sleep
+        conn.time.sleep = self.sleeps.append
+        self.policy = conn.RetryPolicy(attempts=4, backoff=0.1,
+                                       backoff_max=0.3)
+
+    def tearDown(self):
+        conn.time.sleep = self._sleep
+
+    def _failing(self, exc_, name='get', succeed_after=None):
+        calls = []
+        def func():
+            calls.append(True)
+            if succeed_after is None or len(calls) <= succeed_after:
+                raise exc_
+            return True
+        func.__name__ = name
+        return (func, calls)
+
+    def test_backoff(self):
+        (func, calls) = self._failing(ErrorThriftMessage("Cleese"))
+        self.assertRaises(ErrorThriftMessage, self.policy.call, func)
+        self.assert_(len(calls) == 4)
+        self.assert_(len(self.sleeps) == 3)
+        for (sleep, cap) in zip(self.sleeps, (0.1, 0.2, 0.3)):
+            self.assert_(0 <= sleep <= cap)
+
+    def test_success(self):
+        (func, calls) = self._failing(socket.error(), succeed_after=2)
+        self.assert_(self.policy.call(func) is True)
+        self.assert_(len(calls) == 3)
+
+    def test_classification(self):
+        for error in (UnavailableException(), TimedOutException(),
+                      socket.timeout(), ErrorThriftMessage()):
+            self.assert_(self.policy.should_retry('get', 1, error))
+            self.assert_(not self.policy.should_retry('get', 4, error))
+
+        for error in (InvalidRequestException(), NotFoundException(),
+                      ErrorPoolExhausted(), Exception()):
+            self.assert_(not self.policy.should_retry('get', 1, error))
+
+    def test_writes(self):
+        timeout = TimedOutException()
+        self.assert_(self.policy.should_retry('insert', 1, timeout))
+
+        self.policy.retry_writes = False
+        self.assert_(self.policy.should_retry('get', 1, timeout))
+        self.assert_(not self.policy.should_retry('insert', 1, timeout))
+        self.assert_(not self.policy.should_retry('batch_mutate', 1, timeout))
+        # It never got there, so it's safe.
+        self.assert_(self.policy.should_retry(
+                'insert', 1, ErrorConnectionFailed()))
+
+    def test_deadline(self):
+        self.policy.deadline = 0
+        (func, calls) = self._failing(ErrorThriftMessage("Cleese"))
+        self.assertRaises(ErrorThriftMessage, self.policy.call, func)
+        self.assert_(len(calls) == 1)
+
+    def test_call_deadline(self):
+        (func, calls) = self._failing(ErrorThriftMessage("Cleese"))
+        with conn.deadline(10):
+            self.assertRaises(ErrorThriftMessage, self.policy.call, func)
+        self.assert_(len(calls) == 4)
+
+        (func, calls) = self._failing(ErrorThriftMessage("Cleese"))
+        with conn.deadline(0):
+            self.assertRaises(ErrorThriftMessage, self.policy.call, func)
+        self.assert_(len(calls) == 1)
+
+    def test_budget(self):
+        self.policy.budget = conn.RetryBudget(ratio=0, min_rate=0,
+                                              capacity=2)
+        (func, calls) = self._failing(ErrorThriftMessage("Cleese"))
+        self.assertRaises(ErrorThriftMessage, self.policy.call, func)
+        self.assert_(len(calls) == 3)
+
+        # Budget's spent; no more retries.
+        (func, calls) = self._failing(ErrorThriftMessage("Cleese"))
+        self.assertRaises(ErrorThriftMessage, self.policy.call, func)
+        self.assert_(len(calls) == 1)
+
+
+class TestDeadline(unittest.TestCase):
+
+    """Test per-call deadlines."""
+
+    def test_nesting(self):
+        self.assert_(conn.get_deadline() is None)
+        self.assert_(conn.time_left() is None)
+        with conn.deadline(10):
+            outer = conn.get_deadline()
+            self.assert_(9 < conn.time_left() <= 10)
+            # Inner deadlines can shorten, but not extend
+            with conn.deadline(20):
+                self.assert_(conn.get_deadline() == outer)
+            with conn.deadline(None):
+                self.assert_(conn.get_deadline() == outer)
+            with conn.deadline(1):
+                self.assert_(conn.time_left() <= 1)
+            self.assert_(conn.get_deadline() == outer)
+        self.assert_(conn.get_deadline() is None)
+
+    def test_call(self):
+        client = conn.Client(['localhost:1234'])
+        backend = Generic()
+        backend.transport = _MockTransport()
+        backend.get = lambda *args: 'result'
+        pool = _MockPool(backend)
+        client._get_server = lambda key=None, exclude=None: pool
+
+        with conn.deadline(1):
+            self.assert_(client.get('Keyspace1', 'key', None, 1) == 'result')
+
+        # Nothing is sent once the deadline has passed
+        backend.get = raises(AssertionError)
+        with conn.deadline(-1):
+            self.assertRaises(ErrorDeadlineExceeded, client.get,
+                              'Keyspace1', 'key', None, 1)
+        self.assert_(pool.returned == [(backend, False)])
+
+    def test_pool_wait(self):
+        pool = conn.HostPool(Generic, 'localhost', 1234, max_size=1,
+                             wait_timeout=10)
+        pool._size = 1
+        start = time.time()
+        with conn.deadline(0.01):
+            self.assertRaises(ErrorDeadlineExceeded, pool.get)
+        self.assert_(time.time() - start < 1)
+
+        pool.wait_timeout = 0.01
+        with conn.deadline(10):
+            self.assertRaises(ErrorPoolExhausted, pool.get)
+
+
+class TestRetryBudget(unittest.TestCase):
+
+    """Test RetryBudget."""
+
+    def test_ratio(self):
+        budget = conn.RetryBudget(ratio=0.5, min_rate=0, capacity=10)
+        budget._balance = 0
+        budget.deposit()
+        self.assert_(not budget.withdraw())
+        budget.deposit()
+        self.assert_(budget.withdraw())
+        self.assert_(not budget.withdraw())
+
+    def test_capacity(self):
+        budget = conn.RetryBudget(ratio=1, min_rate=0, capacity=2)
+        for x in range(10):
+            budget.deposit()
+        self.assert_(budget.withdraw() and budget.withdraw())
+        self.assert_(not budget.withdraw())
+
+    def test_min_rate(self):
+        budget = conn.RetryBudget(ratio=0, min_rate=10, capacity=10)
+        budget._balance = 0
+        budget._last = time.time() - 1
+        self.assert_(budget.withdraw())
+
+
+class TestHedgePolicy(unittest.TestCase):
+
+    """Test HedgePolicy."""
+
+    def test_delay(self):
+        policy = conn.HedgePolicy(percentile=0.9, window=100, min_samples=10,
+                                  min_delay=0.001)
+        self.assert_(policy.delay('get') is None)
+        for x in range(1, 10):
+            policy.record('get', x / 100.0)
+        self.assert_(policy.delay('get') is None)
+        policy.record('get', 0.1)
+        self.assert_(policy.delay('get') == 0.1)
+        self.assert_(policy.delay('get_slice') is None)
+
+        # Only recent calls count.
+        for x in range(100):
+            policy.record('get', 0)
+        self.assert_(policy.delay('get') == 0.001)
+
+    def test_budget(self):
+        policy = conn.HedgePolicy(budget=conn.RetryBudget(
+                ratio=0, min_rate=0, capacity=1))
+        self.assert_(policy.allow())
+        self.assert_(not policy.allow())
+        self.assert_(conn.HedgePolicy().allow())
+
+
+class TestHedging(unittest.TestCase):
+
+    """Test hedged reads in Client."""
+
+    def setUp(self):
+        self.hedge = conn.HedgePolicy(min_samples=1, min_delay=0.01)
+        self.hedge.record('get', 0.01)
+        self.client = conn.Client(['localhost:1234', 'localhost:1235'],
+                                  hedge_policy=self.hedge)
+        self.calls = []
+        self.pools = []
+        for (index, (name, delay)) in enumerate((('slow', 0.5),
+                                                  ('fast', 0))):
+            self.pools.append(_MockPool(Generic()))
+            self._set_get(index, self._get(name, delay))
+        self.client._clients = self.pools
+        self.client._get_server = lambda key=None, exclude=None: (
+            self.pools[1] if exclude is self.pools[0] else self.pools[0])
+
+    def _get(self, name, delay, exc_=None):
+        """Return a get which answers after delay, on a socket.
+
+        Shutting the socket down cancels it, as for a Thrift call."""
+        (sock, peer) = socket.socketpair()
+        transport = Generic()
+        transport.socket = Generic()
+        transport.socket.handle = sock
+
+        def get(*args, **kwargs):
+            self.calls.append(name)
+            sock.settimeout(delay)
+            try:
+                if delay and sock.recv(1) == "":
+                    raise TTransportException(message="read 0 bytes")
+            except socket.timeout:
+                pass
+            if exc_:
+                raise exc_
+            return name
+        get.transport, get.peer = transport, peer
+        return get
+
+    def _set_get(self, index, get):
+        self.pools[index].client.get = get
+        self.pools[index].client.transport = get.transport
+
+    def test_hedge(self):
+        released = []
+        for pool in self.pools:
+            pool.limiter = Generic()
+            pool.limiter.acquire = lambda timeout: time.time()
+            pool.limiter.release = (lambda started=None, dropped=False:
+                                    released.append(dropped))
+        start = time.time()
+        self.assert_(self.client.get('Keyspace1', 'key', None, 1) == 'fast')
+        self.assert_(time.time() - start < 0.4)
+        self.assert_(self.calls == ['slow', 'fast'])
+        # The slow call was cancelled, not blamed on its server.
+        self.assert_(not self.pools[0].down)
+        self.assert_(released == [False, False])
+
+    def test_no_hedge(self):
+        """Fast calls, and calls before latency is known, aren't hedged."""
+        self._set_get(0, self._get('first', 0))
+        self.assert_(self.client.get('Keyspace1', 'key', None, 1) == 'first')
+        self.assert_(self.calls == ['first'])
+
+        self.hedge._samples = {}
+        self._set_get(0, self._get('slow', 0.05))
+        self.assert_(self.client.get('Keyspace1', 'key', None, 1) == 'slow')
+        self.assert_(self.calls == ['first', 'slow'])
+
+    def test_failed_hedge(self):
+        """A retryable failure waits for the other answer."""
+        self._set_get(1, self._get('fast', 0, UnavailableException()))
+        self._set_get(0, self._get('slow', 0.05))
+        self.assert_(self.client.get('Keyspace1', 'key', None, 1) == 'slow')
+
+        # But other exceptions are answers.
+        self._set_get(1, self._get('fast', 0, NotFoundException()))
+        self._set_get(0, self._get('slow', 0.5))
+        start = time.time()
+        self.assertRaises(NotFoundException, self.client.get, 'Keyspace1',
+                          'key', None, 1)
+        self.assert_(time.time() - start < 0.4)
+
+    def test_concurrency(self):
+        """First calls don't wait for the hedge workers."""
+        self.client._hedge_policy = self.hedge = conn.HedgePolicy(
+            min_samples=1, workers=2)
+        self.hedge.record('get', 1.0)
+        self.pools[0].client.get = lambda *args: time.sleep(0.05)
+        threads = [threading.Thread(target=self.client.get,
+                                    args=('Keyspace1', 'key', None, 1))
+                   for x in range(8)]
+        start = time.time()
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        self.assert_(time.time() - start < 0.15)
 
 
 class DebugTraceClientTest(unittest.TestCase):
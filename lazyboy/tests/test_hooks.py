@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Unit tests for lazyboy.hooks."""
+
+import unittest
+
+import lazyboy.hooks as hooks
+from lazyboy.util import raises
+
+
+class RecordingHook(hooks.Hook):
+
+    """A hook which remembers the events it sees."""
+
+    def __init__(self):
+        self.events = []
+
+    def start(self, call):
+        self.events.append(('start', call.method, call.attempt))
+
+    def success(self, call):
+        self.events.append(('success', call.method, call.attempt))
+
+    def failure(self, call, ex):
+        self.events.append(('failure', call.method, call.attempt,
+                            ex.__class__))
+
+    def retry(self, call, ex):
+        self.events.append(('retry', call.method, call.attempt,
+                            ex.__class__))
+
+
+class HooksTest(unittest.TestCase):
+
+    """Test Hooks."""
+
+    def test_add_remove(self):
+        registry = hooks.Hooks()
+        self.assert_(not registry)
+        (first, second) = (hooks.Hook(), hooks.Hook())
+        registry.add(first)
+        registry.add(second, 0)
+        self.assert_(len(registry) == 2)
+        self.assert_(registry.sample() == [first])
+        registry.remove(first)
+        self.assert_(registry.sample() == [])
+        registry.remove(second)
+        self.assert_(not registry)
+
+    def test_sample(self):
+        registry = hooks.Hooks()
+        hook = hooks.Hook()
+        registry.add(hook, 0.5)
+        seen = sum(len(registry.sample()) for x in range(1000))
+        self.assert_(300 < seen < 700)
+
+    def test_fire(self):
+        hook = RecordingHook()
+        broken = hooks.Hook()
+        broken.start = raises(Exception)
+        call = hooks.CallInfo('get', 'Keyspace1', 'localhost:9160')
+        hooks.fire([broken, hook], 'start', call)
+        self.assert_(hook.events == [('start', 'get', 1)])
+        self.assert_('get' in repr(call))
+
+
+if __name__ == '__main__':
+    unittest.main()
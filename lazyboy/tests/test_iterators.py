@@ -6,6 +6,8 @@
 
 """Unit tests for lazyboy.iterators."""
 
+import threading
+import time
 import unittest
 import types
 import uuid
@@ -77,6 +79,70 @@ class SliceIteratorTest(unittest.TestCase):
         for col in slice_iterator:
             self.assert_(isinstance(col, ttypes.SuperColumn))
 
+    def test_slice_iterator_paged(self):
+        """Test slice_iterator fetching a row a page at a time."""
+        names = ["col-%02d" % n for n in range(25)]
+        requests = []
+
+        def get_slice(keyspace, key, column_parent, predicate, consistency):
+            srange = predicate.slice_range
+            requests.append(srange.count)
+            cols = sorted(names, reverse=srange.reversed)
+            if srange.start:
+                cols = [name for name in cols if
+                        (name <= srange.start if srange.reversed
+                         else name >= srange.start)]
+            return list(iterators.pack(Column(name, "x", 0)
+                                       for name in cols[:srange.count]))
+        self.client.get_slice = get_slice
+
+        key = Key(keyspace="eggs", column_family="bacon", key="tomato")
+        cols = iterators.slice_iterator(key, ConsistencyLevel.ONE,
+                                        page_size=10)
+        self.assert_(cols.next().name == "col-00")
+        self.assert_(requests == [10])
+        self.assert_([col.name for col in cols] == names[1:])
+        self.assert_(requests == [10, 11, 11])
+
+        cols = iterators.slice_iterator(key, ConsistencyLevel.ONE,
+                                        page_size=10, reversed=True)
+        self.assert_([col.name for col in cols] == names[::-1])
+
+        del requests[:]
+        cols = iterators.slice_iterator(key, ConsistencyLevel.ONE,
+                                        page_size=10, count=15)
+        self.assert_([col.name for col in cols] == names[:15])
+        self.assert_(requests == [10, 6])
+
+        cols = iterators.slice_iterator(key, ConsistencyLevel.ONE,
+                                        page_size=10, read_ahead=1)
+        self.assert_([col.name for col in cols] == names)
+
+        del requests[:]
+        cols = iterators.slice_iterator(key, ConsistencyLevel.ONE,
+                                        page_size=0)
+        self.assert_(len(list(cols)) == 25)
+        self.assert_(requests == [100000])
+
+    def test_slice_iterator_deleted(self):
+        """Test slice_iterator when a page's last column is removed."""
+        names = ["c%d" % n for n in range(6)]
+
+        def get_slice(keyspace, key, column_parent, predicate, consistency):
+            srange = predicate.slice_range
+            cols = [name for name in names if name >= srange.start]
+            return list(iterators.pack(Column(name, "x", 0)
+                                       for name in cols[:srange.count]))
+        self.client.get_slice = get_slice
+
+        key = Key(keyspace="eggs", column_family="bacon", key="tomato")
+        cols = iterators.slice_iterator(key, ConsistencyLevel.ONE,
+                                        page_size=3)
+        seen = [cols.next().name for n in range(3)]
+        names.remove("c2")
+        seen.extend(col.name for col in cols)
+        self.assert_(seen == ["c0", "c1", "c2", "c3", "c4", "c5"])
+
     def test_multigetterator(self):
         """Test multigetterator."""
         keys = [Key("eggs", "bacon", "cleese"),
@@ -124,6 +190,104 @@ class SliceIteratorTest(unittest.TestCase):
                         else:
                             self.assert_(isinstance(column, Column))
 
+    def test_multigetterator_chunks(self):
+        """Test multigetterator splitting and fanning out groups."""
+        keys = ([Key("eggs", "bacon", "row-%d" % n) for n in range(5)] +
+                [Key("eggs", "spam", "row-%d" % n, super_column="sc")
+                 for n in range(3)])
+        calls, lock = [], threading.Lock()
+
+        def multiget_slice(keyspace, keys, column_parent, predicate,
+                           consistencylevel):
+            with lock:
+                calls.append((column_parent.column_family, keys))
+            time.sleep(0.05)
+            return dict((key, list(iterators.pack(
+                            [Column(name=key, value=keyspace)])))
+                        for key in keys)
+        self.client.multiget_slice = multiget_slice
+
+        start = time.time()
+        res = iterators.multigetterator(keys, ConsistencyLevel.ONE,
+                                        chunk_size=2)
+        self.assert_(time.time() - start < 0.15)
+        self.assert_(sorted(len(row_keys) for (cf, row_keys) in calls) ==
+                     [1, 1, 2, 2, 2])
+        self.assert_(sorted(res['eggs']['bacon']) ==
+                     ["row-%d" % n for n in range(5)])
+        self.assert_(sorted(res['eggs']['spam']) ==
+                     ["row-%d" % n for n in range(3)])
+        cols = list(res['eggs']['spam']['row-1']['sc'])
+        self.assert_(cols[0].name == 'row-1')
+
+    def test_list_multigetterator(self):
+        """Test list_multigetterator."""
+        keys = [Key("eggs", "bacon" if n % 3 else "spam", "row-%d" % n)
+                for n in range(10)]
+        read = []
+
+        def key_gen():
+            for key in keys:
+                read.append(key)
+                yield key
+
+        def multiget_slice(keyspace, keys, column_parent, predicate,
+                           consistencylevel):
+            return dict((key, list(iterators.pack(
+                            [Column(name=key, value="x")]))
+                         if key != "row-4" else [])
+                        for key in keys)
+        self.client.multiget_slice = multiget_slice
+
+        res = iterators.list_multigetterator(key_gen(), ConsistencyLevel.ONE,
+                                             chunk_size=2, window=2)
+        (key, cols) = res.next()
+        self.assert_(key is keys[0])
+        self.assert_([col.name for col in cols] == ["row-0"])
+        # Only two batches are read ahead
+        self.assert_(len(read) == 4)
+
+        rest = list(res)
+        self.assert_([key for (key, cols) in rest] == keys[1:])
+        self.assert_(rest[3][1] is iterators.MISSING)
+        self.assert_(not iterators.MISSING)
+        self.assert_(rest[4][1][0].name == "row-5")
+
+    def test_range_slice_iterator(self):
+        """Test range_slice_iterator paging through a column family."""
+        rows = ["row-%02d" % n for n in range(25)]
+        requests = []
+
+        def get_range_slice(keyspace, column_parent, predicate, start_key,
+                            finish_key, row_count, consistency_level):
+            requests.append((start_key, row_count))
+            return [ttypes.KeySlice(row, list(iterators.pack(
+                            [Column(row, "x", 0)] if row != "row-03" else [])))
+                    for row in rows if row >= start_key][:row_count]
+        self.client.get_range_slice = get_range_slice
+
+        key = Key(keyspace="eggs", column_family="bacon")
+        for prefetch in (False, True):
+            del requests[:]
+            scan = iterators.range_slice_iterator(
+                key, page_size=10, prefetch=prefetch)
+            (row_key, cols) = scan.next()
+            self.assert_(row_key.key == "row-00")
+            self.assert_(row_key.column_family == "bacon")
+            self.assert_([col.name for col in cols] == ["row-00"])
+            # The next page is fetched in the background
+            for n in range(100 if prefetch else 0):
+                if len(requests) > 1:
+                    break
+                time.sleep(0.01)
+            self.assert_(len(requests) == 1 + prefetch)
+
+            found = [row_key.key for (row_key, cols) in scan]
+            self.assert_(found == [row for row in rows[1:]
+                                   if row != "row-03"])
+            self.assert_(requests == [("", 10), ("row-09", 11),
+                                      ("row-19", 11)])
+
     def test_sparse_get(self):
         """Test sparse_get."""
         key = Key(keyspace="eggs", column_family="bacon", key="tomato")
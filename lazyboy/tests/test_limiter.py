@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Unit tests for lazyboy.limiter."""
+
+import threading
+import time
+import unittest
+
+from lazyboy.limiter import Limiter, AdaptiveLimiter
+from lazyboy.exceptions import ErrorOverloaded
+
+
+class LimiterTest(unittest.TestCase):
+
+    """Test Limiter."""
+
+    def test_reject(self):
+        limiter = Limiter(2)
+        started = [limiter.acquire(), limiter.acquire()]
+        self.assert_(limiter.in_flight == 2)
+        self.assertRaises(ErrorOverloaded, limiter.acquire)
+        self.assert_(limiter.rejected == 1)
+
+        limiter.release(started[0])
+        limiter.acquire()
+        self.assert_(limiter.in_flight == 2)
+
+    def test_wait(self):
+        limiter = Limiter(1, wait=5)
+        started = limiter.acquire()
+        timer = threading.Timer(0.05, limiter.release, (started,))
+        timer.start()
+        start = time.time()
+        limiter.acquire()
+        self.assert_(0.02 < time.time() - start < 1)
+
+        # A shorter timeout wins
+        start = time.time()
+        self.assertRaises(ErrorOverloaded, limiter.acquire, 0.01)
+        self.assert_(time.time() - start < 1)
+
+    def test_reset(self):
+        limiter = Limiter(1)
+        limiter.acquire()
+        limiter.reset()
+        self.assert_(limiter.in_flight == 0)
+        limiter.acquire()
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+
+    """Test AdaptiveLimiter."""
+
+    def setUp(self):
+        self.limiter = AdaptiveLimiter(10, min_limit=2)
+        self.limiter.latency = 0.01
+
+    def test_cut(self):
+        """Slow and failed calls cut the limit, down to min_limit."""
+        self.limiter._update(time.time(), 0.05, False)
+        self.assert_(self.limiter.limit == 9)
+        self.limiter._update(time.time(), 0.01, True)
+        self.assert_(self.limiter.limit == 8)
+        for x in range(50):
+            self.limiter._update(time.time(), 0.05, False)
+        self.assert_(self.limiter.limit == 2)
+
+    def test_one_cut_per_round(self):
+        """Calls which started before a cut don't cut it again."""
+        started = time.time() - 1
+        self.limiter._update(started, 0.05, False)
+        self.limiter._update(started, 0.05, False)
+        self.assert_(self.limiter.limit == 9)
+
+    def test_grow(self):
+        for x in range(5):
+            self.limiter._update(time.time(), 0.05, True)
+        self.assert_(self.limiter.limit == 5)
+        for x in range(60):
+            self.limiter._update(time.time(), 0.01, False)
+        self.assert_(self.limiter.limit == 10)
+
+    def test_latency(self):
+        limiter = AdaptiveLimiter(10, smoothing=0.5)
+        limiter.release(limiter.acquire())
+        self.assert_(limiter.latency is not None)
+        baseline = limiter.latency
+        limiter._update(time.time(), baseline + 1, False)
+        self.assert_(limiter.latency > baseline)
+
+
+if __name__ == '__main__':
+    unittest.main()
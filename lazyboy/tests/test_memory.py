@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Unit tests for lazyboy.memory."""
+
+import struct
+import unittest
+import uuid
+
+from cassandra.ttypes import Column, SuperColumn, ColumnOrSuperColumn, \
+    ColumnParent, ColumnPath, SlicePredicate, SliceRange, \
+    NotFoundException, InvalidRequestException
+
+import lazyboy.connection as connection
+import lazyboy.nonblocking as nonblocking
+import lazyboy.memory as memory
+from lazyboy.iterators import multigetterator
+from lazyboy.key import Key
+from lazyboy.record import Record
+from lazyboy.view import View, BatchLoadingView
+
+
+def _range(start="", finish="", reversed=False, count=100):
+    return SlicePredicate(slice_range=SliceRange(start, finish, reversed,
+                                                 count))
+
+
+def _names(cols):
+    return [col.column.name for col in cols]
+
+
+class _Mutation(object):
+
+    def __init__(self, column_or_supercolumn=None, deletion=None):
+        self.column_or_supercolumn = column_or_supercolumn
+        self.deletion = deletion
+
+
+class _Deletion(object):
+
+    def __init__(self, timestamp, super_column=None, predicate=None):
+        self.timestamp = timestamp
+        self.super_column = super_column
+        self.predicate = predicate
+
+
+class MemoryStoreTest(unittest.TestCase):
+
+    """Test MemoryStore."""
+
+    def setUp(self):
+        self.store = memory.MemoryStore()
+        self.parent = ColumnParent('Standard1')
+
+    def _insert(self, key, name, value, timestamp=1, column_family=None,
+                super_column=None):
+        self.store.insert('Keyspace1', key,
+                          ColumnPath(column_family or 'Standard1',
+                                     super_column, name),
+                          value, timestamp, 1)
+
+    def _get(self, key, name, column_family=None, super_column=None):
+        return self.store.get('Keyspace1', key,
+                              ColumnPath(column_family or 'Standard1',
+                                         super_column, name), 1).column
+
+    def test_get(self):
+        self._insert('row', 'eggs', 'spam')
+        col = self._get('row', 'eggs')
+        self.assert_((col.name, col.value, col.timestamp) ==
+                     ('eggs', 'spam', 1))
+        self.assertRaises(NotFoundException, self._get, 'row', 'bacon')
+        self.assertRaises(NotFoundException, self._get, 'other', 'eggs')
+
+        # Callers get their own copy
+        col.value = 'changed'
+        self.assert_(self._get('row', 'eggs').value == 'spam')
+
+    def test_timestamps(self):
+        self._insert('row', 'eggs', 'new', 5)
+        self._insert('row', 'eggs', 'old', 4)
+        self.assert_(self._get('row', 'eggs').value == 'new')
+        self._insert('row', 'eggs', 'newer', 6)
+        self.assert_(self._get('row', 'eggs').value == 'newer')
+
+    def test_slice(self):
+        for name in ('c', 'a', 'e', 'b', 'd'):
+            self._insert('row', name, name.upper())
+        get = lambda predicate: _names(self.store.get_slice(
+                'Keyspace1', 'row', self.parent, predicate, 1))
+        self.assert_(get(_range()) == ['a', 'b', 'c', 'd', 'e'])
+        self.assert_(get(_range('b', 'd')) == ['b', 'c', 'd'])
+        self.assert_(get(_range('b', count=2)) == ['b', 'c'])
+        self.assert_(get(_range(reversed=True, count=2)) == ['e', 'd'])
+        self.assert_(get(_range('d', 'b', True)) == ['d', 'c', 'b'])
+        self.assert_(get(SlicePredicate(column_names=['e', 'x', 'a'])) ==
+                     ['e', 'a'])
+        self.assert_(self.store.get_count('Keyspace1', 'row', self.parent,
+                                          1) == 5)
+
+    def test_comparator(self):
+        self.store.define('Keyspace1', 'Long', comparator='LongType')
+        for num in (10, -5, 300, 2):
+            self._insert('row', struct.pack('>q', num), str(num),
+                         column_family='Long')
+        cols = self.store.get_slice('Keyspace1', 'row', ColumnParent('Long'),
+                                    _range(), 1)
+        self.assert_([col.column.value for col in cols] ==
+                     ['-5', '2', '10', '300'])
+        self.assertRaises(InvalidRequestException, self._insert, 'row',
+                          'short', 'x', column_family='Long')
+
+        self.store.define('Keyspace1', 'Time', comparator='TimeUUIDType')
+        ids = [uuid.uuid1() for x in range(5)]
+        for id_ in reversed(ids):
+            self._insert('row', id_.bytes, '', column_family='Time')
+        cols = self.store.get_slice('Keyspace1', 'row', ColumnParent('Time'),
+                                    _range(), 1)
+        self.assert_(_names(cols) == [id_.bytes for id_ in ids])
+
+        self.assertRaises(InvalidRequestException, self.store.define,
+                          'Keyspace1', 'Bad', comparator='NoSuchType')
+
+    def test_remove(self):
+        self._insert('row', 'eggs', 'spam', 5)
+        self._insert('row', 'bacon', 'spam', 5)
+        column = ColumnPath('Standard1', None, 'eggs')
+
+        # Older deletes don't remove newer columns
+        self.store.remove('Keyspace1', 'row', column, 4, 1)
+        self.assert_(self._get('row', 'eggs').value == 'spam')
+
+        # Deletes win ties, and hold off older writes
+        self.store.remove('Keyspace1', 'row', column, 5, 1)
+        self.assertRaises(NotFoundException, self._get, 'row', 'eggs')
+        self._insert('row', 'eggs', 'spam', 5)
+        self.assertRaises(NotFoundException, self._get, 'row', 'eggs')
+        self._insert('row', 'eggs', 'spam', 6)
+        self.assert_(self._get('row', 'eggs').value == 'spam')
+
+        # Whole rows
+        self.store.remove('Keyspace1', 'row', ColumnPath('Standard1'), 10, 1)
+        self.assert_(self.store.get_slice('Keyspace1', 'row', self.parent,
+                                          _range(), 1) == [])
+        self.assert_(self.store.get_key_range('Keyspace1', 'Standard1') ==
+                     [])
+        self._insert('row', 'eggs', 'spam', 9)
+        self.assertRaises(NotFoundException, self._get, 'row', 'eggs')
+
+    def test_super(self):
+        for (sup, name) in (('b', 'y'), ('a', 'z'), ('a', 'x')):
+            self._insert('row', name, sup + name, 1, 'Super1', sup)
+        self.assert_(self._get('row', 'x', 'Super1', 'a').value == 'ax')
+
+        cols = self.store.get_slice('Keyspace1', 'row',
+                                    ColumnParent('Super1'), _range(), 1)
+        self.assert_([col.super_column.name for col in cols] == ['a', 'b'])
+        self.assert_([col.name for col in cols[0].super_column.columns] ==
+                     ['x', 'z'])
+        cols = self.store.get_slice('Keyspace1', 'row',
+                                    ColumnParent('Super1', 'a'), _range(),
+                                    1)
+        self.assert_(_names(cols) == ['x', 'z'])
+
+        self.store.remove('Keyspace1', 'row', ColumnPath('Super1', 'a'), 2, 1)
+        cols = self.store.get_slice('Keyspace1', 'row',
+                                    ColumnParent('Super1'), _range(), 1)
+        self.assert_([col.super_column.name for col in cols] == ['b'])
+        self.assertRaises(NotFoundException, self.store.get, 'Keyspace1',
+                          'row', ColumnPath('Super1', 'a'), 1)
+
+        # Super and standard column families can't be mixed up
+        self._insert('row', 'x', 'x')
+        self.assertRaises(InvalidRequestException, self._insert, 'row', 'x',
+                          'x', 1, 'Super1')
+        self.assertRaises(InvalidRequestException, self._insert, 'row', 'x',
+                          'x', 1, 'Standard1', 'a')
+
+    def test_batch_insert(self):
+        self.store.batch_insert('Keyspace1', 'row', {
+                'Standard1': [ColumnOrSuperColumn(column=Column('a', 'A', 1))],
+                'Super1': [ColumnOrSuperColumn(super_column=SuperColumn(
+                            's', [Column('b', 'B', 1)]))]}, 1)
+        self.assert_(self._get('row', 'a').value == 'A')
+        self.assert_(self._get('row', 'b', 'Super1', 's').value == 'B')
+
+    def test_batch_mutate(self):
+        self._insert('row', 'old', 'x')
+        self.store.batch_mutate('Keyspace1', {'row': {'Standard1': [
+                        _Mutation(ColumnOrSuperColumn(
+                                column=Column('new', 'y', 2))),
+                        _Mutation(deletion=_Deletion(
+                                2, predicate=SlicePredicate(
+                                    column_names=['old'])))]}}, 1)
+        self.assert_(self._get('row', 'new').value == 'y')
+        self.assertRaises(NotFoundException, self._get, 'row', 'old')
+
+        self.store.batch_mutate('Keyspace1', {'row': {'Standard1': [
+                        _Mutation(deletion=_Deletion(3))]}}, 1)
+        self.assertRaises(NotFoundException, self._get, 'row', 'new')
+
+    def test_ranges(self):
+        for key in ('c', 'a', 'd', 'b'):
+            self._insert(key, 'col', key)
+        self.assert_(self.store.get_key_range('Keyspace1', 'Standard1', 'b',
+                                              '', 2, 1) == ['b', 'c'])
+        slices = self.store.get_range_slice('Keyspace1', self.parent,
+                                            _range(), 'b', 'c', 10, 1)
+        self.assert_([(row.key, _names(row.columns)) for row in slices] ==
+                     [('b', ['col']), ('c', ['col'])])
+
+        res = self.store.multiget_slice('Keyspace1', ['a', 'x'], self.parent,
+                                        _range(), 1)
+        self.assert_(_names(res['a']) == ['col'] and res['x'] == [])
+        res = self.store.multiget('Keyspace1', ['a', 'x'],
+                                  ColumnPath('Standard1', None, 'col'), 1)
+        self.assert_(res['a'].column.value == 'a')
+        self.assert_(res['x'].column is None)
+
+    def test_describe(self):
+        self.store.define('Keyspace1', 'Super1', 'Super', 'UTF8Type')
+        self._insert('row', 'col', 'x')
+        self.assert_(self.store.describe_keyspace('Keyspace1') == {
+                'Standard1': {'Type': 'Standard', 'CompareWith': 'BytesType'},
+                'Super1': {'Type': 'Super', 'CompareWith': 'UTF8Type',
+                           'CompareSubcolumnsWith': 'BytesType'}})
+        self.assertRaises(NotFoundException, self.store.describe_keyspace,
+                          'Keyspace2')
+
+
+class MemoryPoolTest(unittest.TestCase):
+
+    """Test using a memory:// store through lazyboy."""
+
+    def setUp(self):
+        self._servers = connection._SERVERS.copy()
+        connection.add_pool('Keyspace1', ['memory://test'])
+        self.store = memory.get_store('memory://test')
+
+    def tearDown(self):
+        self.store.clear()
+        connection._SERVERS.clear()
+        connection._SERVERS.update(self._servers)
+        nonblocking._CLIENTS.clear()
+
+    def test_shared(self):
+        self.assert_(memory.get_store('memory://test') is self.store)
+        self.assert_(memory.get_store() is not self.store)
+        client = connection.get_pool('Keyspace1')
+        self.assert_([str(pool) for pool in client.list_servers()] ==
+                     ['memory://test'])
+
+    def test_record(self):
+        key = Key('Keyspace1', 'Standard1', 'rec')
+        record = Record()
+        record.key = key
+        record.update({'eggs': 'spam', 'bacon': 'toast'})
+        record.save()
+        loaded = Record().load(key)
+        self.assert_(dict(loaded) == {'eggs': 'spam', 'bacon': 'toast'})
+
+        del loaded['bacon']
+        loaded.save()
+        self.assert_(dict(Record().load(key)) == {'eggs': 'spam'})
+        self.assert_(Record().load_async(key).result(5)['eggs'] == 'spam')
+
+    def test_views(self):
+        for x in range(25):
+            name = "%03d" % x
+            record = Record(name=name)
+            record.key = Key('Keyspace1', 'Standard1', name)
+            record.save()
+            view = View(Key('Keyspace1', 'Standard1', 'view'),
+                        Key('Keyspace1', 'Standard1'))
+            view.append(record)
+
+        keys = [Key('Keyspace1', 'Standard1', "%03d" % x) for x in range(25)]
+        rows = multigetterator(keys, None)['Keyspace1']['Standard1']
+        self.assert_(len(rows) == 25)
+
+        for view_class in (View, BatchLoadingView):
+            view = view_class(Key('Keyspace1', 'Standard1', 'view'),
+                              Key('Keyspace1', 'Standard1'))
+            view.chunk_size = 7
+            self.assert_([record['name'] for record in view] ==
+                         ["%03d" % x for x in range(25)])
+
+
+if __name__ == '__main__':
+    unittest.main()
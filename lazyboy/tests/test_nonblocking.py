@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Unit tests for lazyboy.nonblocking."""
+
+import errno
+import socket
+import threading
+import time
+import unittest
+
+from cassandra import Cassandra
+from cassandra.ttypes import Column, ColumnOrSuperColumn, ColumnParent, \
+    SuperColumn, \
+    ColumnPath, SlicePredicate, SliceRange, NotFoundException
+from thrift.Thrift import TApplicationException, TMessageType
+from thrift.transport import TSocket, TTransport
+from thrift.protocol import TBinaryProtocol
+
+import lazyboy.connection as connection
+import lazyboy.nonblocking as nonblocking
+import lazyboy.iterators as iterators
+import lazyboy.exceptions as exc
+from lazyboy.hooks import Hook
+from lazyboy.key import Key
+from lazyboy.record import Record
+from lazyboy.view import View, BatchLoadingView
+from lazyboy.workers import Future
+
+
+class _Handler(object):
+
+    """A Cassandra.Iface which keeps standard columns in a dict."""
+
+    def __init__(self):
+        self.rows = {}
+
+    def _row(self, keyspace, key, column_family):
+        return self.rows.setdefault((keyspace, column_family, key), {})
+
+    def get(self, keyspace, key, column_path, consistency_level):
+        row = self._row(keyspace, key, column_path.column_family)
+        if column_path.column not in row:
+            raise NotFoundException()
+        return ColumnOrSuperColumn(column=row[column_path.column])
+
+    def get_slice(self, keyspace, key, column_parent, predicate,
+                  consistency_level):
+        row = self._row(keyspace, key, column_parent.column_family)
+        srange = predicate.slice_range
+        names = sorted(name for name in row if name >= srange.start)
+        return [ColumnOrSuperColumn(column=row[name])
+                for name in names[:srange.count]]
+
+    def multiget_slice(self, keyspace, keys, column_parent, predicate,
+                       consistency_level):
+        return dict((key, self.get_slice(keyspace, key, column_parent,
+                                         predicate, consistency_level))
+                    for key in keys)
+
+    def insert(self, keyspace, key, column_path, value, timestamp,
+               consistency_level):
+        self._row(keyspace, key, column_path.column_family)[
+            column_path.column] = Column(column_path.column, value,
+                                         timestamp)
+
+    def batch_insert(self, keyspace, key, cfmap, consistency_level):
+        for (column_family, cols) in cfmap.iteritems():
+            row = self._row(keyspace, key, column_family)
+            for col in cols:
+                row[col.column.name] = col.column
+
+    def remove(self, keyspace, key, column_path, timestamp,
+               consistency_level):
+        self._row(keyspace, key, column_path.column_family).pop(
+            column_path.column, None)
+
+
+class _Server(object):
+
+    """A Thrift server on a loopback port, with a thread per connection."""
+
+    def __init__(self, handler, transport=TTransport.TBufferedTransport):
+        self.processor = Cassandra.Processor(handler)
+        self.transport = transport
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(16)
+        self.address = "127.0.0.1:%d" % self.sock.getsockname()[1]
+        thread = threading.Thread(target=self._accept)
+        thread.setDaemon(True)
+        thread.start()
+
+    def _accept(self):
+        while True:
+            (conn, addr) = self.sock.accept()
+            thread = threading.Thread(target=self._serve, args=(conn,))
+            thread.setDaemon(True)
+            thread.start()
+
+    def _serve(self, conn):
+        sock = TSocket.TSocket()
+        sock.handle = conn
+        trans = self.transport(sock)
+        proto = TBinaryProtocol.TBinaryProtocolAccelerated(trans)
+        try:
+            while True:
+                self.processor.process(proto, proto)
+        except (EOFError, TTransport.TTransportException, socket.error):
+            conn.close()
+
+
+class NonblockingTest(unittest.TestCase):
+
+    """Test the non-blocking client against a loopback server."""
+
+    def setUp(self):
+        self.handler = _Handler()
+        self.server = _Server(self.handler)
+        self._servers = connection._SERVERS.copy()
+        connection.add_pool('Keyspace1', [self.server.address])
+        self.client = nonblocking.get_pool('Keyspace1')
+
+    def tearDown(self):
+        connection._SERVERS.clear()
+        connection._SERVERS.update(self._servers)
+        nonblocking._CLIENTS.clear()
+
+    def test_get_pool(self):
+        self.assert_(nonblocking.get_pool('Keyspace1') is self.client)
+        self.assertRaises(exc.ErrorCassandraClientNotFound,
+                          nonblocking.get_pool, 'Nonexistent')
+
+    def test_after_fork(self):
+        loop = nonblocking._LOOP
+        pid = connection._PID
+        connection._PID = -1
+        try:
+            client = nonblocking.get_pool('Keyspace1')
+        finally:
+            connection._PID = pid
+        self.assert_(client is not self.client)
+        self.assert_(nonblocking._LOOP is not loop)
+
+        path = ColumnPath('Standard1', None, 'eggs')
+        client.insert('Keyspace1', 'row', path, 'spam', 1, 1).result(5)
+
+    def test_calls(self):
+        path = ColumnPath('Standard1', None, 'eggs')
+        self.client.insert('Keyspace1', 'row', path, 'spam', 1, 1).result(5)
+        self.assert_(self.client.get('Keyspace1', 'row', path, 1).result(5)
+                     .column.value == 'spam')
+
+        missing = ColumnPath('Standard1', None, 'bacon')
+        self.assertRaises(NotFoundException,
+                          self.client.get('Keyspace1', 'row', missing,
+                                          1).result, 5)
+
+    def test_concurrent(self):
+        """Make sure many calls can be in flight at once."""
+        path = ColumnPath('Standard1', None, 'col')
+        futures = [self.client.insert('Keyspace1', str(x), path, str(x), 1, 1)
+                   for x in range(100)]
+        [future.result(5) for future in futures]
+        futures = [self.client.get('Keyspace1', str(x), path, 1)
+                   for x in range(100)]
+        self.assert_([f.result(5).column.value for f in futures] ==
+                     map(str, range(100)))
+        self.assert_(len(self.client.list_servers()[0]._all) <= 32)
+
+    def test_large_response(self):
+        """Make sure responses larger than one recv() are decoded."""
+        value = "x" * (nonblocking._RECV_SIZE * 3)
+        path = ColumnPath('Standard1', None, 'big')
+        self.client.insert('Keyspace1', 'big', path, value, 1, 1).result(5)
+        self.assert_(self.client.get('Keyspace1', 'big', path, 1).result(5)
+                     .column.value == value)
+
+    def test_exact_response(self):
+        """Make sure responses of exactly N recv()s are decoded."""
+        def reply_size(value):
+            buf = TTransport.TMemoryBuffer()
+            proto = TBinaryProtocol.TBinaryProtocol(buf)
+            proto.writeMessageBegin('get', TMessageType.REPLY, 0)
+            Cassandra.get_result(success=ColumnOrSuperColumn(
+                    column=Column('big', value, 1))).write(proto)
+            proto.writeMessageEnd()
+            return len(buf.getvalue())
+
+        path = ColumnPath('Standard1', None, 'big')
+        overhead = reply_size("")
+        for count in (1, 2, 5):
+            size = nonblocking._RECV_SIZE * count
+            value = "x" * (size - overhead)
+            self.assert_(reply_size(value) == size)
+            self.client.insert('Keyspace1', 'big', path, value, 1,
+                               1).result(5)
+            self.assert_(self.client.get('Keyspace1', 'big', path,
+                                         1).result(5).column.value == value)
+
+    def test_framed(self):
+        server = _Server(self.handler, TTransport.TFramedTransport)
+        client = nonblocking.AsyncClient([server.address],
+                                         transport='framed')
+        value = "x" * (nonblocking._RECV_SIZE * 2)
+        path = ColumnPath('Standard1', None, 'big')
+        client.insert('Keyspace1', 'big', path, value, 1, 1).result(5)
+        self.assert_(client.get('Keyspace1', 'big', path, 1).result(5)
+                     .column.value == value)
+
+        self.assert_(connection.Client([server.address], transport='framed')
+                     .get('Keyspace1', 'big', path, 1).column.value == value)
+
+    def test_hook_sizes(self):
+        """Make sure the blocking client counts bytes for hooks."""
+        client = connection.Client([self.server.address])
+        calls = []
+        hook = Hook()
+        hook.success = calls.append
+        client.add_hook(hook)
+        path = ColumnPath('Standard1', None, 'eggs')
+        client.insert('Keyspace1', 'row', path, 'x' * 1000, 1, 1)
+        client.get('Keyspace1', 'row', path, 1)
+        self.assert_(calls[0].request_size > 1000)
+        self.assert_(0 < calls[0].response_size < 100)
+        self.assert_(calls[1].request_size < 100)
+        self.assert_(calls[1].response_size > 1000)
+
+    def test_deadline(self):
+        """Make sure the blocking client cuts timeouts to the deadline."""
+        client = connection.Client([self.server.address], timeout=5000)
+        path = ColumnPath('Standard1', None, 'eggs')
+        client.insert('Keyspace1', 'row', path, 'spam', 1, 1)
+        get = self.handler.get
+        self.handler.get = lambda *args: time.sleep(0.5) or get(*args)
+
+        start = time.time()
+        with connection.deadline(0.05):
+            self.assertRaises(exc.ErrorDeadlineExceeded, client.get,
+                              'Keyspace1', 'row', path, 1)
+        self.assert_(time.time() - start < 0.4)
+        pool = client.list_servers()[0]
+        self.assert_(pool._failures == 0 and pool.is_up())
+
+        # Connections get their own timeout back
+        self.handler.get = get
+        self.assert_(client.get('Keyspace1', 'row', path, 1)
+                     .column.value == 'spam')
+        with connection.deadline(1):
+            client.get('Keyspace1', 'row', path, 1)
+        conn = pool._idle[-1][0]
+        self.assert_(conn.transport.socket.handle.gettimeout() == 5)
+
+    def test_record_deadline(self):
+        key = Key('Keyspace1', 'Standard1', 'rec')
+        record = Record()
+        record.key = key
+        record['eggs'] = 'spam'
+        record.save(deadline=1)
+        self.assert_(Record().load(key, deadline=1)['eggs'] == 'spam')
+        self.assertRaises(exc.ErrorDeadlineExceeded, Record().load, key,
+                          deadline=-1)
+
+    def test_view_deadline(self):
+        for view_class in (View, BatchLoadingView):
+            view = self._make_view(view_class, 20)
+            view.deadline = 5
+            self.assert_(len([record for record in view]) == 20)
+
+            get_slice = self.handler.get_slice
+            self.handler.get_slice = \
+                lambda *args: time.sleep(0.05) or get_slice(*args)
+            try:
+                view.deadline = 0.12
+                start = time.time()
+                self.assertRaises(exc.ErrorDeadlineExceeded,
+                                  lambda: [record for record in view])
+                self.assert_(time.time() - start < 0.5)
+            finally:
+                self.handler.get_slice = get_slice
+
+    def test_connection_failed(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        address = "127.0.0.1:%d" % sock.getsockname()[1]
+        sock.close()
+
+        client = nonblocking.AsyncClient([address])
+        future = client.get('Keyspace1', 'row',
+                            ColumnPath('Standard1', None, 'eggs'), 1)
+        self.assertRaises(exc.ErrorConnectionFailed, future.result, 5)
+
+    def test_timeout(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(1)
+        address = "127.0.0.1:%d" % sock.getsockname()[1]
+
+        client = nonblocking.AsyncClient([address], timeout=50)
+        future = client.get('Keyspace1', 'row',
+                            ColumnPath('Standard1', None, 'eggs'), 1)
+        self.assertRaises(exc.ErrorThriftMessage, future.result, 5)
+        sock.close()
+
+    def test_record(self):
+        key = Key('Keyspace1', 'Standard1', 'rec')
+        record = Record()
+        record.key = key
+        record.update({'eggs': 'spam', 'bacon': 'toast'})
+        self.assert_(record.save_async().result(5) is record)
+        self.assert_(not record.is_modified())
+
+        loaded = Record().load_async(key).result(5)
+        self.assert_(loaded['eggs'] == 'spam')
+        self.assert_(loaded['bacon'] == 'toast')
+
+        del loaded['bacon']
+        loaded.save_async().result(5)
+        self.assert_('bacon' not in Record().load_async(key).result(5))
+
+        self.assertRaises(exc.ErrorNoSuchRecord,
+                          Record().load_async(key.clone(key='nope')).result,
+                          5)
+
+    def test_multigetterator(self):
+        for row in ('a', 'b', 'c'):
+            self.handler._row('Keyspace1', row, 'Standard1')['col'] = \
+                Column('col', row, 1)
+        keys = [Key('Keyspace1', 'Standard1', row) for row in ('a', 'b', 'c')]
+        res = iterators.multigetterator_async(keys, None).result(5)
+        rows = res['Keyspace1']['Standard1']
+        self.assert_(sorted(rows.keys()) == ['a', 'b', 'c'])
+        self.assert_([col.value for col in rows['b']] == ['b'])
+
+    def _make_view(self, view_class, count):
+        for x in range(count):
+            name = "%03d" % x
+            self.handler._row('Keyspace1', name, 'Standard1')['name'] = \
+                Column('name', name, 1)
+            self.handler._row('Keyspace1', 'view', 'Standard1')[name] = \
+                Column(name, name, 1)
+
+        view = view_class(Key('Keyspace1', 'Standard1', 'view'),
+                          Key('Keyspace1', 'Standard1'))
+        view.chunk_size = 7
+        return view
+
+    def test_view_iter_async(self):
+        for view_class in (View, BatchLoadingView):
+            view = self._make_view(view_class, 20)
+            names = [future.result(5)['name'] for future in view.iter_async()]
+            self.assert_(names == ["%03d" % x for x in range(20)],
+                         view_class)
+            self.assert_(view.last_col.name == "019")
+
+
+def _reply(method, result, strict=True, mtype=TMessageType.REPLY):
+    """Return a reply to method, as a server would send it."""
+    buf = TTransport.TMemoryBuffer()
+    proto = TBinaryProtocol.TBinaryProtocol(buf, strictWrite=strict)
+    proto.writeMessageBegin(method, mtype, 0)
+    result.write(proto)
+    proto.writeMessageEnd()
+    return buf.getvalue()
+
+
+class _ChunkedSocket(object):
+
+    """A socket which gives up one chunk of data per wakeup."""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.ready = False
+
+    def recv(self, size):
+        if not self.ready:
+            raise socket.error(errno.EAGAIN, "Try again")
+        self.ready = False
+        return self.chunks.pop(0)
+
+
+class MessageScannerTest(unittest.TestCase):
+
+    """Test finding the end of unframed responses."""
+
+    def _replies(self):
+        col = Column('name', 'value', 1)
+        slice_ = [ColumnOrSuperColumn(column=col),
+                  ColumnOrSuperColumn(super_column=SuperColumn(
+                    'super', [col, col]))]
+        return [
+            _reply('get_slice', Cassandra.get_slice_result(success=slice_)),
+            _reply('get_slice', Cassandra.get_slice_result(success=slice_),
+                   strict=False),
+            _reply('multiget_slice', Cassandra.multiget_slice_result(
+                    success={'a': slice_, 'b': []})),
+            _reply('get_count', Cassandra.get_count_result(success=5)),
+            _reply('get', Cassandra.get_result(nfe=NotFoundException())),
+            _reply('get', TApplicationException(1, "Oops"),
+                   mtype=TMessageType.EXCEPTION)]
+
+    def test_scan(self):
+        for reply in self._replies():
+            scanner = nonblocking._MessageScanner()
+            buf = bytearray()
+            for byte in reply[:-1]:
+                buf.extend(byte)
+                self.assert_(not scanner.scan(buf))
+            buf.extend(reply[-1])
+            self.assert_(scanner.scan(buf))
+            self.assert_(scanner.pos == len(reply))
+
+    def test_chunked(self):
+        """A large response in small pieces is only decoded once."""
+        value = "x" * (1 << 20)
+        reply = _reply('get', Cassandra.get_result(
+                success=ColumnOrSuperColumn(column=Column('big', value, 1))))
+        sock = _ChunkedSocket(reply[n:n + 4096]
+                              for n in range(0, len(reply), 4096))
+        loop = nonblocking.EventLoop()
+        conn = nonblocking.AsyncConnection('host', loop)
+        conn._sock = sock
+        future = Future()
+        path = ColumnPath('Standard1', None, 'big')
+        conn.send('get', ('Keyspace1', 'big', path, 1), {}, future)
+        decodes = []
+        decode = conn._decode
+        conn._decode = lambda: decodes.append(True) or decode()
+        while sock.chunks:
+            sock.ready = True
+            conn.handle_read()
+        self.assert_(decodes == [True])
+        self.assert_(future.result(0).column.value == value)
+        loop.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -181,6 +181,10 @@ class KeyRecordSetTest(unittest.TestCase):
 
     def setUp(self):
         self.object = sets.KeyRecordSet()
+        self.__get_pool = sets.itr.get_pool
+
+    def tearDown(self):
+        sets.itr.get_pool = self.__get_pool
 
     def test_batch_load(self):
         records, keys = [], []
@@ -214,6 +218,9 @@ class KeyRecordSetTest(unittest.TestCase):
         """Make sure KeyRecordSet.__init__ works as expected"""
         fake_key = partial(Key, "Eggs", "Bacon")
         keys = [fake_key(str(uuid.uuid1())) for x in range(10)]
+        mock_client = MockClient([])
+        mock_client.multiget_slice = lambda *args: {}
+        sets.itr.get_pool = lambda ks: mock_client
         rs = sets.KeyRecordSet(keys, Record)
 
 
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Unit tests for lazyboy.ring."""
+
+import unittest
+
+import lazyboy.ring as ring
+from lazyboy.exceptions import ErrorNotSupported
+
+
+class TokenTest(unittest.TestCase):
+
+    """Test token functions."""
+
+    def test_random_token(self):
+        """Make sure tokens match Cassandra's RandomPartitioner."""
+        # MD5 digests with the high bit clear are used as-is...
+        self.assert_(ring.random_token("a") ==
+                     0x0cc175b9c0f1b6a831c399e269772661)
+        # ...and with it set, they're negated two's complement.
+        self.assert_(ring.random_token("b") ==
+                     2 ** 128 - 0x92eb5ffee6ae2fec3ad71c777531578f)
+        self.assert_(ring.random_token(u"b") == ring.random_token("b"))
+        for key in ("eggs", "bacon", "spam"):
+            self.assert_(0 <= ring.random_token(key) <= 2 ** 127)
+
+    def test_order_preserving_token(self):
+        self.assert_(ring.order_preserving_token("eggs") == u"eggs")
+        self.assert_(isinstance(ring.order_preserving_token("eggs"),
+                                unicode))
+
+
+class TokenRingTest(unittest.TestCase):
+
+    """Test TokenRing."""
+
+    def setUp(self):
+        self.ring = ring.TokenRing(
+            '{"bbb": "10.0.0.2", "aaa": "10.0.0.1", "ccc": "10.0.0.3"}',
+            'org.apache.cassandra.dht.OrderPreservingPartitioner')
+
+    def test_init(self):
+        self.assert_(len(self.ring) == 3)
+        self.assert_(self.ring.tokens == ["aaa", "bbb", "ccc"])
+        self.assert_(self.ring.endpoints ==
+                     ["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+        self.assertRaises(ErrorNotSupported, ring.TokenRing, {}, "Foo")
+
+    def test_random(self):
+        tokens = ring.TokenRing({"10": "10.0.0.2", "9": "10.0.0.1"})
+        self.assert_(tokens.tokens == [9, 10])
+
+    def test_owners(self):
+        self.assert_(self.ring.owners("a")[0] == "10.0.0.1")
+        self.assert_(self.ring.owners("aaa")[0] == "10.0.0.1")
+        self.assert_(self.ring.owners("aab") ==
+                     ["10.0.0.2", "10.0.0.3", "10.0.0.1"])
+        self.assert_(self.ring.owners("ccd")[0] == "10.0.0.1")
+        self.assert_(ring.TokenRing({}).owners("eggs") == [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Unit tests for lazyboy.scan."""
+
+import json
+import operator
+import os
+import unittest
+
+import lazyboy.connection as connection
+import lazyboy.memory as memory
+import lazyboy.scan as scan
+from lazyboy.key import Key
+from lazyboy.record import Record
+
+
+def _row_key(key, cols):
+    return key.key
+
+
+def _values(key, cols):
+    return sum(int(col.value) for col in cols)
+
+
+def _pids(key, cols):
+    return set([os.getpid()])
+
+
+def _unpicklable(key, cols):
+    return lambda: key
+
+
+class ScanTest(unittest.TestCase):
+
+    """Test parallel scans of a memory:// store."""
+
+    def setUp(self):
+        self._servers = connection._SERVERS.copy()
+        connection.add_pool('Keyspace1', ['memory://scan'],
+                            partitioner='OrderPreservingPartitioner')
+        self.store = memory.get_store('memory://scan')
+        self.key = Key('Keyspace1', 'Standard1')
+        for n in range(50):
+            record = Record(a=str(n), b="1")
+            record.key = self.key.clone(key="row-%02d" % n)
+            record.save()
+
+    def tearDown(self):
+        self.store.clear()
+        connection._SERVERS.clear()
+        connection._SERVERS.update(self._servers)
+
+    def test_split_sampled(self):
+        ranges = scan.split_range(self.key, 5)
+        self.assert_(len(ranges) == 5)
+        self.assert_(ranges[0][0] == "" and ranges[-1][1] == "")
+        for (before, after) in zip(ranges, ranges[1:]):
+            self.assert_(before[1] == after[0])
+
+        # Only the sampled keys are split evenly
+        ranges = scan.split_range(self.key, 2, sample_size=10)
+        self.assert_(ranges == [("", "row-05"), ("row-05", "")])
+
+    def test_split_tokens(self):
+        tokens = dict(("row-%02d" % n, "127.0.0.1") for n in (10, 20, 30))
+        self.store.get_string_property = lambda prop: json.dumps(tokens)
+        ranges = scan.split_range(self.key, 4)
+        self.assert_(ranges == [("", "row-10"), ("row-10", "row-20"),
+                                ("row-20", "row-30"), ("row-30", "")])
+
+        # Too few tokens falls back to sampling
+        ranges = scan.split_range(self.key, 8)
+        self.assert_(len(ranges) == 8)
+        self.assert_(ranges[1][0] not in tokens)
+
+    def test_parallel_scan(self):
+        keys = []
+        rows = scan.parallel_scan(self.key, _row_key, callback=keys.append,
+                                  processes=2, splits=7)
+        self.assert_(rows == 50)
+        self.assert_(sorted(keys) == ["row-%02d" % n for n in range(50)])
+
+        total = scan.parallel_scan(self.key, _values, operator.add,
+                                   processes=2, page_size=3)
+        self.assert_(total == sum(range(50)) + 50)
+
+        pids = scan.parallel_scan(self.key, _pids, operator.or_,
+                                  processes=2, start="row-10",
+                                  finish="row-19")
+        self.assert_(os.getpid() not in pids)
+
+    def test_batches(self):
+        """Results without a reducer come back in batches."""
+        (batch, scan.RESULT_BATCH) = (scan.RESULT_BATCH, 3)
+        try:
+            keys = []
+            rows = scan.parallel_scan(self.key, _row_key,
+                                      callback=keys.append, processes=2,
+                                      splits=2)
+        finally:
+            scan.RESULT_BATCH = batch
+        self.assert_(rows == 50)
+        self.assert_(sorted(keys) == ["row-%02d" % n for n in range(50)])
+
+        self.assertRaises(Exception, scan.parallel_scan, self.key,
+                          _unpicklable, callback=keys.append, processes=1)
+
+    def test_nothing(self):
+        self.store.clear()
+        self.assert_(scan.parallel_scan(self.key, _values, operator.add,
+                                        processes=1) is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Unit tests for lazyboy.stats."""
+
+import unittest
+
+import lazyboy.stats as stats
+from lazyboy.util import raises
+
+
+class HistogramTest(unittest.TestCase):
+
+    """Test Histogram."""
+
+    def test_empty(self):
+        summary = stats.Histogram().summary()
+        self.assert_(summary['count'] == 0)
+        self.assert_(summary['p99'] == summary['max'] == 0)
+
+    def test_percentiles(self):
+        hist = stats.Histogram()
+        for ms in range(1, 101):
+            hist.record(ms / 1000.0)
+        summary = hist.summary()
+        self.assert_(summary['count'] == 100)
+        self.assert_(summary['max'] == 0.1)
+        self.assert_(abs(summary['mean'] - 0.0505) < 1e-9)
+        for (name, expected) in (('p50', 0.05), ('p95', 0.095),
+                                 ('p99', 0.099)):
+            self.assert_(expected <= summary[name] <= expected * 1.2,
+                         (name, summary[name]))
+
+    def test_outliers(self):
+        hist = stats.Histogram()
+        hist.record(0)
+        hist.record(1000)
+        self.assert_(hist.percentile(0.5) <= stats.BUCKETS[0])
+        self.assert_(hist.percentile(1) == 1000)
+
+    def test_merge(self):
+        (first, second) = (stats.Histogram(), stats.Histogram())
+        first.record(0.01)
+        second.record(0.5)
+        first.merge(second)
+        self.assert_(first.count == 2 and first.max == 0.5)
+
+
+class StatsTest(unittest.TestCase):
+
+    """Test Stats."""
+
+    def test_snapshot(self):
+        calls = stats.Stats()
+        calls.record('get', 'a:1', 0.01)
+        calls.record('get', 'b:1', 0.02, KeyError())
+        calls.record('get', 'b:1', 0.03, KeyError())
+        calls.retry('get')
+        calls.retry('insert')
+
+        snapshot = calls.snapshot()
+        get = snapshot['get']
+        self.assert_(get['calls'] == 3)
+        self.assert_(get['errors'] == {'KeyError': 2})
+        self.assert_(get['retries'] == 1)
+        self.assert_(get['latency']['max'] == 0.03)
+        self.assert_(get['servers']['a:1']['calls'] == 1)
+        self.assert_(get['servers']['b:1']['errors'] == {'KeyError': 2})
+        self.assert_(snapshot['insert']['retries'] == 1)
+        self.assert_(snapshot['insert']['calls'] == 0)
+
+        calls.reset()
+        self.assert_(calls.snapshot() == {})
+
+    def test_listeners(self):
+        seen = []
+        calls = stats.Stats([lambda *args: seen.append(args),
+                             raises(Exception)])
+        calls.record('get', 'a:1', 0.01, None, ('Keyspace1',))
+        self.assert_(seen == [('get', 'a:1', 0.01, None, ('Keyspace1',),
+                               {})])
+
+
+class SlowCallLoggerTest(unittest.TestCase):
+
+    """Test SlowCallLogger."""
+
+    def setUp(self):
+        self.errors, self.warnings = [], []
+        log = type('Log', (object,), {
+                'error': lambda log, *args: self.errors.append(args),
+                'warn': lambda log, *args: self.warnings.append(args)})()
+        self.logger = stats.SlowCallLogger(threshold=0.1, sample=1, log=log)
+
+    def test_log(self):
+        self.logger('get', 'a:1', 0.01, None, (), {})
+        self.assert_(self.errors == self.warnings == [])
+
+        self.logger('get', 'a:1', 0.2, None, ('Keyspace1',), {})
+        self.assert_(len(self.warnings) == 1)
+        self.assert_(self.warnings[0][1:4] == (200, 'a:1', 'get'))
+
+        self.logger('get', 'a:1', 0.01, KeyError(), (), {})
+        self.assert_(len(self.errors) == 1)
+        self.assert_(self.errors[0][1] == 'KeyError')
+
+    def test_sample(self):
+        self.logger.sample = 0
+        self.logger('get', 'a:1', 0.2, KeyError(), (), {})
+        self.assert_(self.errors == self.warnings == [])
+
+
+if __name__ == '__main__':
+    unittest.main()
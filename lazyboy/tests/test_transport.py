@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Unit tests for lazyboy.transport."""
+
+import socket
+import unittest
+
+from thrift.transport import TTransport
+from thrift.protocol import TBinaryProtocol
+
+import lazyboy.transport as transport
+from lazyboy.exceptions import ErrorNotSupported
+
+
+class TransportTest(unittest.TestCase):
+
+    """Test building transports."""
+
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_build(self):
+        (trans, proto) = transport.build_transport('127.0.0.1', self.port)
+        self.assert_(isinstance(trans, TTransport.TBufferedTransport))
+        self.assert_(isinstance(proto,
+                                TBinaryProtocol.TBinaryProtocolAccelerated))
+        self.assert_(trans.DEFAULT_BUFFER ==
+                     TTransport.TBufferedTransport.DEFAULT_BUFFER)
+
+        (trans, proto) = transport.build_transport(
+            '127.0.0.1', self.port, 'framed', 'binary')
+        self.assert_(isinstance(trans, TTransport.TFramedTransport))
+        self.assert_(proto.__class__ is TBinaryProtocol.TBinaryProtocol)
+
+        (trans, proto) = transport.build_transport(
+            '127.0.0.1', self.port, read_buffer=65536)
+        self.assert_(trans.DEFAULT_BUFFER == 65536)
+
+    def test_unsupported(self):
+        self.assertRaises(ErrorNotSupported, transport.get_transport, 'http')
+        self.assertRaises(ErrorNotSupported, transport.get_protocol, 'json')
+        if transport.TCompactProtocol is None:
+            self.assertRaises(ErrorNotSupported, transport.get_protocol,
+                              'compact')
+
+    def test_socket_options(self):
+        sock = transport.Socket('127.0.0.1', self.port, timeout=250,
+                                connect_timeout=50, keepalive=True,
+                                send_buffer=65536, recv_buffer=65536)
+        self.assert_(sock._timeout == 0.25)
+        sock.open()
+        try:
+            self.assert_(sock.handle.gettimeout() == 0.25)
+            self.assert_(sock.handle.getsockopt(socket.IPPROTO_TCP,
+                                                socket.TCP_NODELAY))
+            self.assert_(sock.handle.getsockopt(socket.SOL_SOCKET,
+                                                socket.SO_KEEPALIVE))
+            self.assert_(sock.handle.getsockopt(socket.SOL_SOCKET,
+                                                socket.SO_RCVBUF) >= 65536)
+        finally:
+            sock.close()
+
+    def test_connect_timeout(self):
+        """Make sure the connect timeout is used while connecting."""
+        timeouts = []
+
+        class _Sock(object):
+            family = socket.AF_INET
+
+            def settimeout(self, timeout):
+                timeouts.append(timeout)
+
+            def connect(self, addr):
+                pass
+
+            def setsockopt(self, *args):
+                pass
+
+        sock = transport.Socket('127.0.0.1', self.port, timeout=250,
+                                connect_timeout=50)
+        real = socket.socket
+        transport.TSocket.socket.socket = lambda *args: _Sock()
+        try:
+            sock.open()
+        finally:
+            transport.TSocket.socket.socket = real
+        self.assert_(timeouts == [0.05, 0.25])
+
+
+if __name__ == '__main__':
+    unittest.main()
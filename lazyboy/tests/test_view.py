@@ -5,6 +5,8 @@
 #
 """Unit tests for Lazyboy views."""
 
+import threading
+import time
 import unittest
 import uuid
 import types
@@ -116,6 +118,31 @@ class ViewTest(unittest.TestCase):
         in a remainder."""
         self.__base_view_test(self.object, 100, 7)
 
+    def test_view_read_ahead(self):
+        """Make sure iteration works when pages are read ahead."""
+        self.object.read_ahead = 2
+        self.__base_view_test(self.object, 0, 10)
+        self.__base_view_test(self.object, 100, 10)
+        self.__base_view_test(self.object, 100, 7)
+
+        threads = []
+        get_slice = MockClient.get_slice
+
+        def slow_get_slice(*args):
+            threads.append(threading.currentThread())
+            time.sleep(0.02)
+            return get_slice(*args)
+        MockClient.get_slice = slow_get_slice
+
+        # Fetching and using pages overlap
+        self.object.chunk_size = 10
+        start = time.time()
+        for key in self.object._keys():
+            if key.key % 10 == 0:
+                time.sleep(0.02)
+        self.assert_(time.time() - start < 0.35)
+        self.assert_(threading.currentThread() not in threads)
+
     def test_iter(self):
         """Test View.__iter__()"""
 
@@ -220,6 +247,42 @@ class BatchLoadingViewTest(unittest.TestCase):
         finally:
             view.multigetterator = mg
 
+    def test_pipeline(self):
+        """Make sure pipelined loading keeps the view's order."""
+        mg = view.multigetterator
+        self.object = view.BatchLoadingView(None, Key("Digg", "Users"))
+        self.object.chunk_size = 5
+        cols = [Column("name:%02d" % x, "val:%02d" % x) for x in range(30)]
+        self.object._cols = lambda start=None, end=None: iter(cols)
+        threads = set()
+
+        def multigetterator(keys, consistency):
+            threads.add(threading.currentThread())
+            time.sleep(0.02)
+            return {'Digg': {'Users': dict(
+                        (key.key, [Column("key", key.key)]) for key in keys)}}
+
+        try:
+            view.multigetterator = multigetterator
+            for pipeline in (1, 3, 0):
+                self.object.pipeline = pipeline
+                threads.clear()
+                start = time.time()
+                for (index, record) in enumerate(self.object):
+                    self.assert_(record['key'] == cols[index].value)
+                    self.assert_(record.key.key == cols[index].value)
+                    self.assert_(self.object.last_col is cols[index])
+                    if index % 5 == 0:
+                        time.sleep(0.02)
+                self.assert_(index == 29)
+                current = threading.currentThread() in threads
+                self.assert_(current == (not pipeline))
+                if pipeline:
+                    # Fetching and using batches overlap
+                    self.assert_(time.time() - start < 0.2)
+        finally:
+            view.multigetterator = mg
+
 
 class PartitionedViewTest(unittest.TestCase):
 
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Unit tests for lazyboy.workers."""
+
+import unittest
+import threading
+import time
+
+import lazyboy.workers as workers
+from lazyboy.util import raises
+
+
+class FutureTest(unittest.TestCase):
+
+    """Test Future."""
+
+    def test_result(self):
+        future = workers.Future()
+        self.assert_(not future.done())
+        self.assertRaises(RuntimeError, future.result, 0)
+        future.run(lambda x: x * 2, 21)
+        self.assert_(future.done())
+        self.assert_(future.result() == 42)
+
+    def test_exception(self):
+        future = workers.Future()
+        future.run(raises(KeyError, "eggs"))
+        self.assert_(future.done())
+        self.assertRaises(KeyError, future.result)
+
+    def test_add_done_callback(self):
+        future, seen = workers.Future(), []
+        future.add_done_callback(seen.append)
+        self.assert_(seen == [])
+        future.set_result(1)
+        self.assert_(seen == [future])
+        future.add_done_callback(seen.append)
+        self.assert_(seen == [future, future])
+
+    def test_chain(self):
+        future = workers.Future()
+        chained = workers.chain(future, lambda x: x * 2)
+        self.assert_(not chained.done())
+        future.set_result(21)
+        self.assert_(chained.result() == 42)
+
+        future = workers.Future()
+        chained = workers.chain(future, lambda x: x * 2)
+        future.set_exception(KeyError("eggs"))
+        self.assertRaises(KeyError, chained.result)
+
+    def test_gather(self):
+        self.assert_(workers.gather([]).result() == [])
+
+        futures = [workers.Future() for x in range(3)]
+        gathered = workers.gather(futures)
+        for (x, future) in reversed(list(enumerate(futures))):
+            self.assert_(not gathered.done())
+            future.set_result(x)
+        self.assert_(gathered.result() == [0, 1, 2])
+
+        futures = [workers.Future() for x in range(2)]
+        gathered = workers.gather(futures)
+        futures[0].set_exception(KeyError())
+        self.assert_(not gathered.done())
+        futures[1].set_result(1)
+        self.assertRaises(KeyError, gathered.result)
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    """Test WorkerPool."""
+
+    def test_submit(self):
+        pool = workers.WorkerPool(2)
+        futures = [pool.submit(lambda x: x + 1, x) for x in range(10)]
+        self.assert_([f.result(5) for f in futures] == range(1, 11))
+        self.assert_(len(pool._threads) <= 2)
+
+    def test_concurrent(self):
+        """Make sure calls actually run at the same time."""
+        pool = workers.WorkerPool(4)
+        barrier = threading.Semaphore(0)
+
+        def wait():
+            barrier.release()
+            time.sleep(0.01)
+            return threading.currentThread().getName()
+
+        names = pool.run_all([wait] * 4)
+        self.assert_(len(set(names)) == 4)
+        self.assert_(threading.currentThread().getName() in names)
+
+    def test_run_all(self):
+        pool = workers.WorkerPool(2)
+        self.assert_(pool.run_all([]) == [])
+        self.assert_(pool.run_all(lambda x=x: x for x in range(5)) ==
+                     range(5))
+
+        funcs = [lambda: 1, raises(KeyError), lambda: 3]
+        self.assertRaises(KeyError, pool.run_all, funcs)
+
+
+class ReadAheadTest(unittest.TestCase):
+
+    """Test read_ahead."""
+
+    def test_order(self):
+        self.assert_(list(workers.read_ahead(range(10), 2)) == range(10))
+        self.assert_(list(workers.read_ahead([])) == [])
+
+    def test_ahead(self):
+        produced = []
+
+        def items():
+            for n in range(10):
+                produced.append(threading.currentThread())
+                yield n
+
+        items = workers.read_ahead(items(), 2)
+        time.sleep(0.05)
+        # Two are queued, and one is waiting to be
+        self.assert_(len(produced) == 3)
+        self.assert_(threading.currentThread() not in produced)
+        self.assert_(items.next() == 0)
+
+        # Stopping early stops the thread
+        items.close()
+        time.sleep(0.25)
+        self.assert_(len(produced) <= 5)
+        self.assert_(not produced[0].isAlive())
+
+    def test_exception(self):
+        def items():
+            yield 1
+            raise KeyError()
+
+        items = workers.read_ahead(items())
+        self.assert_(items.next() == 1)
+        self.assertRaises(KeyError, items.next)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Thrift transports and protocols for connections."""
+
+import socket
+
+from thrift.transport import TSocket, TTransport
+from thrift.protocol import TBinaryProtocol
+try:
+    from thrift.protocol import TCompactProtocol
+except ImportError:
+    TCompactProtocol = None
+
+import lazyboy.exceptions as exc
+
+
+TRANSPORTS = {'buffered': TTransport.TBufferedTransport,
+              'framed': TTransport.TFramedTransport}
+
+PROTOCOLS = {'binary': TBinaryProtocol.TBinaryProtocol,
+             'accelerated': TBinaryProtocol.TBinaryProtocolAccelerated}
+if TCompactProtocol is not None:
+    PROTOCOLS['compact'] = TCompactProtocol.TCompactProtocol
+
+
+def get_transport(name):
+    """Return the Thrift transport class called name."""
+    if name not in TRANSPORTS:
+        raise exc.ErrorNotSupported("Unknown transport `%s'" % name)
+    return TRANSPORTS[name]
+
+
+def get_protocol(name):
+    """Return the Thrift protocol class called name."""
+    if name not in PROTOCOLS:
+        raise exc.ErrorNotSupported(
+            "Protocol `%s' isn't supported by this Thrift" % name)
+    return PROTOCOLS[name]
+
+
+class Socket(TSocket.TSocket):
+
+    """A TSocket with separate connect and read timeouts.
+
+    Timeouts are in milliseconds, as for TSocket.setTimeout; if
+    connect_timeout isn't given, the read timeout is used for both.
+    TCP_NODELAY, SO_KEEPALIVE and the kernel's send and receive buffer
+    sizes are set once the socket is connected.
+    """
+
+    def __init__(self, host, port, timeout=None, connect_timeout=None,
+                 nodelay=True, keepalive=False, send_buffer=None,
+                 recv_buffer=None):
+        TSocket.TSocket.__init__(self, host, int(port))
+        self.setTimeout(timeout)
+        self.connect_timeout = connect_timeout
+        self.nodelay, self.keepalive = nodelay, keepalive
+        self.send_buffer, self.recv_buffer = send_buffer, recv_buffer
+
+    bytes_read = bytes_written = 0
+
+    def read(self, sz):
+        """Read up to sz bytes, counting them."""
+        buff = TSocket.TSocket.read(self, sz)
+        self.bytes_read += len(buff)
+        return buff
+
+    def write(self, buff):
+        """Write buff, counting it."""
+        TSocket.TSocket.write(self, buff)
+        self.bytes_written += len(buff)
+
+    def open(self):
+        """Connect, then set the read timeout and socket options."""
+        timeout = self._timeout
+        if self.connect_timeout is not None:
+            self._timeout = self.connect_timeout / 1000.0
+        try:
+            TSocket.TSocket.open(self)
+        finally:
+            self._timeout = timeout
+
+        self.handle.settimeout(timeout)
+        if self.handle.family in (socket.AF_INET, socket.AF_INET6):
+            self.handle.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                                   int(bool(self.nodelay)))
+        if self.keepalive:
+            self.handle.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if self.send_buffer:
+            self.handle.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                                   self.send_buffer)
+        if self.recv_buffer:
+            self.handle.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                   self.recv_buffer)
+
+
+def build_transport(host, port, transport='buffered',
+                    protocol='accelerated', timeout=None,
+                    connect_timeout=None, read_buffer=None,
+                    write_buffer=None, nodelay=True, keepalive=False):
+    """Return (transport, protocol) for a connection to host:port.
+
+    read_buffer sets how much a buffered transport reads from the
+    socket at a time, and both it and write_buffer set the socket's
+    kernel buffers, so large slices and mutations move in fewer
+    system calls. The Socket is available as the transport's `socket'
+    attribute.
+    """
+    sock = Socket(host, port, timeout, connect_timeout, nodelay, keepalive,
+                  write_buffer, read_buffer)
+    trans = get_transport(transport)(sock)
+    trans.socket = sock
+    if read_buffer and hasattr(trans, 'DEFAULT_BUFFER'):
+        trans.DEFAULT_BUFFER = read_buffer
+    return (trans, get_protocol(protocol)(trans))
@@ -6,17 +6,22 @@
 """Lazyboy: Views."""
 
 import datetime
+import time
 import uuid
 import traceback
+from functools import partial
 from itertools import islice
 
 from cassandra.ttypes import SlicePredicate, SliceRange, Column
 
 from lazyboy.key import Key
 from lazyboy.base import CassandraBase
-from lazyboy.iterators import multigetterator, unpack, chunk_seq
+from lazyboy.iterators import multigetterator, multigetterator_async, \
+    unpack, chunk_seq
 from lazyboy.record import Record
-from lazyboy.connection import Client
+from lazyboy.connection import Client, until, get_deadline
+from lazyboy.workers import chain, read_ahead
+import lazyboy.exceptions as exc
 
 
 def _iter_time(start=None, **kwargs):
@@ -35,7 +40,13 @@ def _iter_days(start=None):
 
 class View(CassandraBase):
 
-    """A regular view."""
+    """A regular view.
+
+    If deadline is set, iterating over the view must finish within that
+    many seconds, or ErrorDeadlineExceeded is raised. If read_ahead is
+    set, up to that many pages of the view are fetched in the
+    background while the current one is used.
+    """
 
     def __init__(self, view_key=None, record_key=None, record_class=None,
                  start_col=None, exclusive=False):
@@ -53,6 +64,8 @@ class View(CassandraBase):
         self.last_col = None
         self.start_col = start_col
         self.exclusive = exclusive
+        self.deadline = None
+        self.read_ahead = 0
 
     def __repr__(self):
         return "%s: %s" % (self.__class__.__name__, self.key)
@@ -62,8 +75,25 @@ class View(CassandraBase):
         return self._get_cas().get_count(
             self.key.keyspace, self.key.key, self.key, self.consistency)
 
+    def _deadline_at(self):
+        """Return when an iteration starting now must finish, or None."""
+        return (time.time() + self.deadline if self.deadline is not None
+                else None)
+
     def _cols(self, start_col=None, end_col=None):
         """Yield columns in the view."""
+        # Pages may be read in another thread, so the caller's deadline
+        # is passed along.
+        with until(self._deadline_at()):
+            pages = self._col_pages(start_col, end_col, get_deadline())
+        if self.read_ahead:
+            pages = read_ahead(pages, self.read_ahead)
+        for page in pages:
+            for col in page:
+                yield col
+
+    def _col_pages(self, start_col=None, end_col=None, at=None):
+        """Yield lists of the columns in the view, a page at a time."""
         client = self._get_cas()
         assert isinstance(client, Client), \
             "Incorrect client instance: %s" % client.__class__
@@ -77,24 +107,58 @@ class View(CassandraBase):
             # need to the count adjusted and the first record dropped.
             fudge = 1 if self.exclusive else int(passes > 0)
 
-            cols = client.get_slice(
-                self.key.keyspace, self.key.key, self.key,
-                SlicePredicate(slice_range=SliceRange(
-                        last_col, end_col, self.reversed, chunk_size + fudge)),
-                self.consistency)
+            with until(at):
+                cols = client.get_slice(
+                    self.key.keyspace, self.key.key, self.key,
+                    SlicePredicate(slice_range=SliceRange(
+                            last_col, end_col, self.reversed,
+                            chunk_size + fudge)),
+                    self.consistency)
 
             if len(cols) == 0:
                 raise StopIteration()
 
-            for col in unpack(cols[fudge:]):
-                yield col
-                last_col = col.name
+            page = list(unpack(cols[fudge:]))
+            yield page
+            if page:
+                last_col = page[-1].name
 
             passes += 1
 
             if len(cols) < self.chunk_size:
                 raise StopIteration()
 
+    def _page_predicate(self, start_col, end_col, fudge):
+        """Return a SlicePredicate for a page of the view."""
+        return SlicePredicate(slice_range=SliceRange(
+                start_col, end_col, self.reversed, self.chunk_size + fudge))
+
+    def _pages_async(self, start_col=None, end_col=None):
+        """Yield lists of columns in the view, a page at a time.
+
+        Pages are read without blocking, and each is requested before
+        the previous one is yielded.
+        """
+        client = self._get_async_cas()
+        end_col = end_col or ""
+        fudge = 1 if self.exclusive else 0
+        res = client.get_slice(
+            self.key.keyspace, self.key.key, self.key,
+            self._page_predicate(start_col or self.start_col or "", end_col,
+                                 fudge), self.consistency)
+
+        while res:
+            cols = res.result()
+            page, res = list(unpack(cols[fudge:])), None
+            if page and len(cols) >= self.chunk_size:
+                fudge = 1
+                res = client.get_slice(
+                    self.key.keyspace, self.key.key, self.key,
+                    self._page_predicate(page[-1].name, end_col, fudge),
+                    self.consistency)
+            if page:
+                yield page
+
     def _keys(self, start_col=None, end_col=None):
         """Yield keys in this view"""
         return (self.make_key(col) for col in self._cols(start_col, end_col))
@@ -106,9 +170,25 @@ class View(CassandraBase):
 
     def __iter__(self):
         """Iterate over all objects in this view."""
+        at = self._deadline_at()
         for (key, col) in ((self.make_key(col), col) for col in self._cols()):
             self.last_col = col
-            yield self.record_class().load(key)
+            with until(at):
+                record = self.record_class().load(key)
+            yield record
+
+    def iter_async(self):
+        """Iterate over Futures of all objects in this view, in order.
+
+        Every record in a page of the view is loaded at once, without
+        blocking; the next page is requested while this one is used.
+        """
+        for cols in self._pages_async():
+            futures = [self.record_class().load_async(self.make_key(col))
+                       for col in cols]
+            for (col, future) in zip(cols, futures):
+                self.last_col = col
+                yield future
 
     def _record_key(self, record=None):
         """Return the column name for a given record."""
@@ -124,6 +204,16 @@ class View(CassandraBase):
             self.key.get_path(column=self._record_key(record)),
             record.key.key, record.timestamp(), self.consistency)
 
+    def append_async(self, record):
+        """Append a record to a view without blocking. Returns a Future."""
+        assert isinstance(record, Record), \
+            "Can't append non-record type %s to view %s" % \
+            (record.__class__, self.__class__)
+        return self._get_async_cas().insert(
+            self.key.keyspace, self.key.key,
+            self.key.get_path(column=self._record_key(record)),
+            record.key.key, record.timestamp(), self.consistency)
+
     def remove(self, record):
         """Remove a record from a view"""
         assert isinstance(record, Record), \
@@ -141,18 +231,32 @@ class FaultTolerantView(View):
 
     def __iter__(self):
         """Iterate over all objects in this view, ignoring bad keys."""
+        at = self._deadline_at()
         for key in self._keys():
             try:
-                yield self.record_class().load(key)
-            except GeneratorExit:
+                with until(at):
+                    record = self.record_class().load(key)
+            except exc.ErrorDeadlineExceeded:
                 raise
             except Exception:
-                pass
+                continue
+            yield record
+
+
+def _pipe(iterable, depth):
+    """Run iterable in its own thread, depth items ahead, if depth is set."""
+    return read_ahead(iterable, depth) if depth else iterable
 
 
 class BatchLoadingView(View):
 
-    """A view which loads records in bulk."""
+    """A view which loads records in bulk.
+
+    Paging through the view, fetching records and hydrating them run
+    as a pipeline, each stage in its own thread, up to pipeline batches
+    ahead of the next; records are still yielded in view order. Set
+    pipeline to 0 to run every stage in the caller's thread.
+    """
 
     def __init__(self, view_key=None, record_key=None, record_class=None,
                  start_col=None, exclusive=False):
@@ -160,34 +264,72 @@ class BatchLoadingView(View):
         View.__init__(self, view_key, record_key, record_class, start_col,
                       exclusive)
         self.chunk_size = 5000
+        self.pipeline = 1
 
     def __iter__(self):
         """Batch load and iterate over all objects in this view."""
-        all_cols = self._cols()
+        # Stages run in other threads, so the caller's deadline is
+        # passed along.
+        with until(self._deadline_at()):
+            at = get_deadline()
+
+        batches = _pipe(self._col_batches(at), self.pipeline)
+        batches = _pipe(self._fetch_batches(batches, at), self.pipeline)
+        for (cols, records) in _pipe(self._hydrate_batches(batches),
+                                     self.pipeline):
+            for (col, record) in zip(cols, records):
+                self.last_col = col
+                yield record
 
-        cols = [True]
-        fetched = 0
-        while len(cols) > 0:
-            cols = tuple(islice(all_cols, self.chunk_size))
-            fetched += len(cols)
+    def _col_batches(self, at=None):
+        """Yield tuples of chunk_size columns from the view."""
+        all_cols = iter(self._cols())
+        while True:
+            with until(at):
+                cols = tuple(islice(all_cols, self.chunk_size))
+            if not cols:
+                return
+            yield cols
+
+    def _fetch_batches(self, batches, at=None):
+        """Yield (cols, keys, multigetterator output) for batches."""
+        for cols in batches:
             keys = tuple(self.make_key(col) for col in cols)
-            recs = multigetterator(keys, self.consistency)
+            with until(at):
+                recs = multigetterator(keys, self.consistency)
+            yield (cols, keys, recs)
 
+    def _hydrate_batches(self, batches):
+        """Yield (cols, records) for fetched batches."""
+        for (cols, keys, recs) in batches:
             if (self.record_key.keyspace not in recs
                 or self.record_key.column_family not in
                 recs[self.record_key.keyspace]):
-                raise StopIteration()
-
-            data = recs[self.record_key.keyspace][self.record_key.column_family]
-
-            for (index, k) in enumerate(keys):
-                record_data = data[k.key]
-                if k.is_super():
-                    record_data = record_data[k.super_column]
-
-                self.last_col = cols[index]
-                yield (self.record_class()._inject(
-                        self.record_key.clone(key=k.key), record_data))
+                return
+            yield (cols, [self._hydrate(key, recs) for key in keys])
+
+    def _hydrate(self, key, recs):
+        """Return a record for key from multigetterator output."""
+        record_data = (recs[self.record_key.keyspace]
+                       [self.record_key.column_family][key.key])
+        if key.is_super():
+            record_data = record_data[key.super_column]
+        return self.record_class()._inject(
+            self.record_key.clone(key=key.key), record_data)
+
+    def iter_async(self):
+        """Iterate over Futures of all objects in this view, in order.
+
+        Each page of records is fetched with one non-blocking
+        multigetterator; the next page of the view is requested while
+        this one is used.
+        """
+        for cols in self._pages_async():
+            keys = [self.make_key(col) for col in cols]
+            recs = multigetterator_async(keys, self.consistency)
+            for (col, key) in zip(cols, keys):
+                self.last_col = col
+                yield chain(recs, partial(self._hydrate, key))
 
 
 class PartitionedView(object):
@@ -225,3 +367,7 @@ class PartitionedView(object):
     def append(self, record):
         """Append a record to the view."""
         return self._append_view(record).append(record)
+
+    def append_async(self, record):
+        """Append a record to the view without blocking."""
+        return self._append_view(record).append_async(record)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+# © 2009, 2010 Digg, Inc. All rights reserved.
+# Author: Ian Eure <ian@digg.com>
+#
+
+"""Lazyboy: Worker threads for running calls concurrently."""
+
+from __future__ import with_statement
+import logging
+import sys
+import threading
+import Queue
+
+_LOG = logging.getLogger(__name__)
+
+
+class Future(object):
+
+    """The result of a call which is running in another thread."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        """Return True if the call has finished."""
+        return self._done.isSet()
+
+    def _finish(self):
+        """Mark the call finished, and run callbacks."""
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                _LOG.exception("Error in Future callback")
+
+    def add_done_callback(self, callback):
+        """Call callback with this future when the call finishes.
+
+        If it has already finished, callback is called immediately.
+        """
+        with self._lock:
+            if not self._done.isSet():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_result(self, result):
+        """Set the result of the call."""
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        """Set the exception raised by the call, as from sys.exc_info().
+
+        A bare exception instance is accepted, too.
+        """
+        if isinstance(exc_info, BaseException):
+            exc_info = (exc_info.__class__, exc_info, None)
+        self._exc_info = exc_info
+        self._finish()
+
+    def run(self, func, *args, **kwargs):
+        """Call func, storing its result or exception."""
+        try:
+            self.set_result(func(*args, **kwargs))
+        except Exception:
+            self.set_exception(sys.exc_info())
+
+    def wait(self, timeout=None):
+        """Wait for the call to finish. Returns True if it did."""
+        self._done.wait(timeout)
+        return self.done()
+
+    def result(self, timeout=None):
+        """Return the result of the call, raising any exception from it."""
+        if not self.wait(timeout):
+            raise RuntimeError("Call didn't finish in %ss" % timeout)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+def chain(future, func):
+    """Return a Future of func called with the result of future.
+
+    Exceptions from either are passed on to the returned Future.
+    """
+    out = Future()
+
+    def __chain__(done):
+        """Call func with the result."""
+        try:
+            out.set_result(func(done.result()))
+        except Exception:
+            out.set_exception(sys.exc_info())
+
+    future.add_done_callback(__chain__)
+    return out
+
+
+def gather(futures):
+    """Return a Future of a list of the results of futures.
+
+    If any of them fails, the returned Future fails with the first
+    exception, once all are done.
+    """
+    futures = list(futures)
+    out = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def __gather__(done):
+        """Finish once every future has."""
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        out.run(lambda: [future.result() for future in futures])
+
+    if not futures:
+        out.set_result([])
+    for future in futures:
+        future.add_done_callback(__gather__)
+    return out
+
+
+_END = object()
+
+
+def read_ahead(iterable, depth=1, name="lazyboy-read-ahead"):
+    """Return an iterator over iterable, which runs ahead of the caller.
+
+    Items are taken from iterable in a background thread, starting at
+    once, while the caller works on earlier ones; at most depth of
+    them wait to be used, so a slow caller holds the thread back.
+    Exceptions from iterable are raised to the caller, in order. If
+    the caller stops early, the thread stops once it next has an item.
+    """
+    queue = Queue.Queue(depth)
+    stop = threading.Event()
+
+    def __put__(entry):
+        """Queue an entry. Returns False if the caller has stopped."""
+        queue.put(entry)
+        return not stop.isSet()
+
+    def __produce__():
+        """Queue every item, then the end."""
+        try:
+            for item in iterable:
+                if not __put__((item, None)):
+                    return
+        except Exception:
+            __put__((None, sys.exc_info()))
+        else:
+            __put__((_END, None))
+
+    def __consume__():
+        """Yield items from the queue."""
+        try:
+            while True:
+                (item, exc_info) = queue.get()
+                if exc_info:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                if item is _END:
+                    return
+                yield item
+        finally:
+            stop.set()
+            # Make room, in case the thread is waiting for it.
+            try:
+                queue.get_nowait()
+            except Queue.Empty:
+                pass
+
+    thread = threading.Thread(target=__produce__, name=name)
+    thread.setDaemon(True)
+    thread.start()
+    return __consume__()
+
+
+class WorkerPool(object):
+
+    """A pool of daemon threads which run calls.
+
+    Threads are started on demand, up to size.
+    """
+
+    def __init__(self, size=8, name="lazyboy-worker"):
+        assert size > 0
+        self.size = size
+        self.name = name
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._idle = 0
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """Run func in a worker thread. Returns a Future."""
+        future = Future()
+        with self._lock:
+            if self._idle:
+                self._idle -= 1
+            elif len(self._threads) < self.size:
+                thread = threading.Thread(
+                    target=self._work,
+                    name="%s-%d" % (self.name, len(self._threads)))
+                thread.setDaemon(True)
+                self._threads.append(thread)
+                thread.start()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def _work(self):
+        """Run calls from the queue."""
+        while True:
+            (future, func, args, kwargs) = self._queue.get()
+            future.run(func, *args, **kwargs)
+            with self._lock:
+                self._idle += 1
+
+    def run_all(self, funcs):
+        """Call every function in funcs concurrently, returning a list
+        of their results.
+
+        The last function is called in the current thread. If any call
+        raises an exception, the first is re-raised once all are done.
+        """
+        funcs = list(funcs)
+        if not funcs:
+            return []
+
+        futures = [self.submit(func) for func in funcs[:-1]]
+        last = Future()
+        last.run(funcs[-1])
+        futures.append(last)
+        for future in futures:
+            future.wait()
+        return [future.result() for future in futures]